@@ -0,0 +1,204 @@
+import copy
+import datetime as dt
+import json
+import sqlite3
+import threading
+
+from feature_engine import (WINDOW_DAYS, _get_date_only, _float_to_dollar,
+                            _parse_post_date)
+
+
+# Incremental Scoring State
+# For every UserID only what the features need is kept:
+# - days: for each posting date that is (or will be) inside the window,
+#   the amount sum and the first amount per transaction type, plus the
+#   TransactionIDs already applied so re-sent transactions are skipped
+# - max_debit: [amount, category] of the largest debit ever seen
+# Days that fall out of the window are pruned, so the state, and the work
+# per call, is bounded by the window and the new transactions.
+
+
+def empty_state():
+    return {'days': {}, 'max_debit': None}
+
+
+def _day_key(day):
+    return day.strftime("%Y-%m-%d")
+
+
+def apply_transactions(state, transactions, today=None):
+    # Returns a new state with the transactions applied; the given state is
+    # left untouched so a failed update never leaves half-applied changes
+    today = today or _get_date_only()
+    state = copy.deepcopy(state) if state else empty_state()
+    days = state['days']
+    parsed_dates = {}
+
+    try:
+        for transaction in transactions:
+            transaction_type = transaction['Type'].lower()
+            amount = transaction['Amount']
+            post_date = _parse_post_date(transaction['PostDate'],
+                                         parsed_dates)
+            transaction_id = transaction.get('TransactionID')
+
+            # Only midnight timestamps line up with the calendar days
+            if post_date != _get_date_only(post_date):
+                post_date = None
+
+            day = (days.setdefault(_day_key(post_date),
+                                   {'types': {}, 'ids': []})
+                   if post_date is not None else None)
+            if day is not None and transaction_id is not None:
+                if transaction_id in day['ids']:
+                    continue
+                day['ids'].append(transaction_id)
+
+            # First of equal maximums wins, as with idxmax
+            max_debit = state['max_debit']
+            if transaction_type == 'debit' and (
+                    max_debit is None or amount > max_debit[0]):
+                state['max_debit'] = [amount, transaction['Category']]
+
+            if day is not None:
+                type_totals = day['types'].setdefault(
+                    transaction_type, [0, amount])
+                type_totals[0] += amount
+    except Exception:
+        raise KeyError
+
+    # Dropping days that have left the window for good
+    window_start = _day_key(today - dt.timedelta(days=WINDOW_DAYS - 1))
+    for day_key in [key for key in days if key < window_start]:
+        del days[day_key]
+
+    return state
+
+
+def state_to_feature_json(state, current_balance, fico_score, today=None):
+    # Same features as raw_data_to_feature_tuple over the full history.
+    # Within a day and type the balance moves one way, so the type totals
+    # plus the first amount of the oldest day give the same extremes.
+    today = today or _get_date_only()
+    state = state or empty_state()
+
+    result_json = {'current_balance': _float_to_dollar(current_balance),
+                   'fico_score': fico_score,
+                   'catg_max_debits': (state['max_debit'][1]
+                                       if state['max_debit'] else 'None')}
+
+    window_start = today - dt.timedelta(days=WINDOW_DAYS - 1)
+    running_sums = []
+    type_sums = {}
+    cum_sum_amount = 0.0
+    for offset in range(WINDOW_DAYS):
+        day = state['days'].get(
+            _day_key(window_start + dt.timedelta(days=offset)))
+        if not day or not day['types']:
+            running_sums.append(cum_sum_amount)
+            continue
+
+        # Credits are processed before Debits on the same day
+        for transaction_type in sorted(day['types']):
+            total, first_amount = day['types'][transaction_type]
+            sign = 1 if transaction_type == 'credit' else -1
+            if not running_sums:
+                running_sums.append(cum_sum_amount + sign * first_amount)
+            cum_sum_amount += sign * total
+            running_sums.append(cum_sum_amount)
+            type_sums[transaction_type] = (
+                type_sums.get(transaction_type, 0) + total)
+
+    if not type_sums:
+        result_json['max_bal_l30'] = result_json['current_balance']
+        result_json['min_bal_l30'] = result_json['current_balance']
+        result_json['sum_debit_l30'] = 0
+        result_json['sum_credit_l30'] = 0
+        return result_json
+
+    initial_balance = result_json['current_balance'] - cum_sum_amount
+    balances = [running_sum + initial_balance
+                for running_sum in running_sums]
+
+    result_json['max_bal_l30'] = _float_to_dollar(max(balances))
+    result_json['min_bal_l30'] = _float_to_dollar(min(balances))
+    result_json['sum_debit_l30'] = (
+        _float_to_dollar(type_sums['debit']) if 'debit' in type_sums else 0)
+    result_json['sum_credit_l30'] = (
+        _float_to_dollar(type_sums['credit']) if 'credit' in type_sums else 0)
+
+    return result_json
+
+
+class InMemoryBalanceStore(object):
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        return self._states.get(user_id)
+
+    def update(self, user_id, update_function):
+        # Read-modify-write of one user's state as a single step
+        with self._lock:
+            state = update_function(self._states.get(user_id))
+            self._states[user_id] = state
+        return state
+
+
+class SQLiteBalanceStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        connection = self._connect()
+        try:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS balance_state "
+                "(user_id TEXT PRIMARY KEY, state TEXT NOT NULL)")
+        finally:
+            connection.close()
+
+    def _connect(self):
+        # Autocommit mode, transactions are opened explicitly
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _select(self, connection, user_id):
+        row = connection.execute(
+            "SELECT state FROM balance_state WHERE user_id = ?",
+            (user_id, )).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get(self, user_id):
+        connection = self._connect()
+        try:
+            return self._select(connection, user_id)
+        finally:
+            connection.close()
+
+    def update(self, user_id, update_function):
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent
+        # updates (from any worker process) are applied one after another
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                state = update_function(self._select(connection, user_id))
+                connection.execute(
+                    "INSERT OR REPLACE INTO balance_state (user_id, state) "
+                    "VALUES (?, ?)", (user_id, json.dumps(state)))
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            return state
+        finally:
+            connection.close()
+
+
+def create_balance_store(store_type, path=None):
+    if store_type == 'memory':
+        return InMemoryBalanceStore()
+    if store_type == 'sqlite':
+        return SQLiteBalanceStore(path)
+    return None
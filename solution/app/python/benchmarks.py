@@ -0,0 +1,256 @@
+import argparse
+import datetime as dt
+import json
+import random
+import sys
+import time
+
+import main
+from feature_engine import _get_date_only, single_pass_feature_tuple
+from response_writer import RESPONSE_FORMATS
+from window_features import AGGREGATES, windowed_feature_tuple
+
+
+# Latency and Throughput Benchmarks
+# Times payload validation, feature extraction (both engines), encoding,
+# prediction, response serialization and the full /predictions request on
+# synthetic applicants, for single and batch payloads.
+#
+#   cd solution/app
+#   python python/benchmarks.py --save benchmark_baseline.json
+#   python python/benchmarks.py --compare benchmark_baseline.json
+#
+# --compare exits with status 1 when a case's p50 latency regressed by more
+# than --tolerance against the baseline.
+
+# Categories known to the encoder
+CATEGORIES = (['Entertainment', 'Deposits'] +
+              ['XXX-%02d' % number for number in range(2, 56)])
+
+TRANSACTION_COUNTS = [0, 10, 1000, 100000]
+BATCH_SIZE = 100
+SERIALIZE_BATCH_SIZE = 10000
+
+
+def synthetic_applicant(transaction_count, category_count=len(CATEGORIES),
+                        date_spread_days=60, seed=0):
+    generator = random.Random(seed)
+    categories = CATEGORIES[:category_count]
+    today = _get_date_only()
+    transactions = [
+        {"TransactionID": "%08d-%04d" % (seed, number),
+         "Amount": round(generator.uniform(1, 2500), 2),
+         "Category": generator.choice(categories),
+         "Type": generator.choice(["debit", "credit"]),
+         "PostDate": (today - dt.timedelta(
+             days=generator.randint(0, date_spread_days))).strftime(
+                 "%Y-%m-%d")}
+        for number in range(transaction_count)]
+    return {"UserID": "synthetic-%d" % seed,
+            "CurrentBalance": round(generator.uniform(-500, 20000), 2),
+            "FICOScore": generator.randint(300, 850),
+            "Transactions": transactions}
+
+
+def _percentile(sorted_values, percentile):
+    # Nearest-rank percentile
+    index = int(round(percentile / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def time_case(function, records_per_call=1, min_runs=5, max_runs=200,
+              max_seconds=5.0):
+    # One warm-up call, then runs until max_runs or max_seconds (but at
+    # least min_runs) have passed
+    function()
+    latencies = []
+    started = time.time()
+    while len(latencies) < max_runs and (
+            len(latencies) < min_runs or time.time() - started < max_seconds):
+        call_started = time.time()
+        function()
+        latencies.append(time.time() - call_started)
+
+    latencies.sort()
+    return {'runs': len(latencies),
+            'p50_ms': _percentile(latencies, 50) * 1000,
+            'p95_ms': _percentile(latencies, 95) * 1000,
+            'p99_ms': _percentile(latencies, 99) * 1000,
+            'records_per_second': (records_per_call * len(latencies) /
+                                   sum(latencies))}
+
+
+def build_cases(client, encoding_pipeline, prediction_pipeline,
+                transaction_counts=TRANSACTION_COUNTS, case_filter=None):
+    # Each case's inputs are only generated when the case passes the filter,
+    # so running a few small cases does not build the 100k histories
+    cases = {}
+
+    def add(name, make_case):
+        if not case_filter or case_filter in name:
+            cases[name] = make_case()
+
+    def post(payload):
+        return lambda: client.post('/predictions', data=payload,
+                                   content_type='application/json')
+
+    applicants = {}
+
+    def applicant_with(transaction_count):
+        if transaction_count not in applicants:
+            applicants[transaction_count] = synthetic_applicant(
+                transaction_count)
+        return applicants[transaction_count]
+
+    for transaction_count in transaction_counts:
+        suffix = '_%d_txns' % transaction_count
+
+        add('validation' + suffix, lambda: (
+            lambda a=applicant_with(transaction_count):
+                main.validate_request(a), 1))
+        add('features_pandas' + suffix, lambda: (
+            lambda a=applicant_with(transaction_count):
+                main.raw_data_to_feature_tuple(a), 1))
+        add('features_single_pass' + suffix, lambda: (
+            lambda a=applicant_with(transaction_count):
+                single_pass_feature_tuple(a), 1))
+        add('predictions_single' + suffix, lambda: (
+            post(json.dumps(applicant_with(transaction_count))), 1))
+        # 100 large histories per request is too slow to repeat usefully
+        if transaction_count <= 1000:
+            add('predictions_batch' + suffix, lambda: (
+                post(json.dumps([synthetic_applicant(transaction_count,
+                                                     seed=seed)
+                                 for seed in range(BATCH_SIZE)])),
+                BATCH_SIZE))
+
+    # Category cardinality and date spread only matter to feature building
+    for category_count in [1, 5, len(CATEGORIES)]:
+        add('features_single_pass_1000_txns_%d_categories' % category_count,
+            lambda: (lambda a=synthetic_applicant(
+                1000, category_count=category_count):
+                single_pass_feature_tuple(a), 1))
+    for date_spread_days in [7, 30, 365]:
+        add('features_pandas_1000_txns_%d_day_spread' % date_spread_days,
+            lambda: (lambda a=synthetic_applicant(
+                1000, date_spread_days=date_spread_days):
+                main.raw_data_to_feature_tuple(a), 1))
+
+    # A long history of which only a sliver is in the 30 day window
+    add('features_pandas_100000_txns_1095_day_spread', lambda: (
+        lambda a=synthetic_applicant(100000, date_spread_days=1095):
+            main.raw_data_to_feature_tuple(a), 1))
+
+    # Every aggregate over 7, 30, 60 and 90 days from one daily series
+    add('features_windows_1000_txns_4_windows', lambda: (
+        lambda a=synthetic_applicant(1000, date_spread_days=120):
+            windowed_feature_tuple(a, [7, 30, 60, 90], AGGREGATES), 1))
+
+    # Serializing a large batch response in every format
+    response_jsons = []
+
+    def serialize(response_format):
+        if not response_jsons:
+            response_jsons.extend(
+                {"UserID": "synthetic-%d" % number,
+                 'prediction': str(number % 2)}
+                for number in range(SERIALIZE_BATCH_SIZE))
+
+        def run():
+            with main.app.test_request_context():
+                main.make_scoring_response(response_jsons,
+                                           response_format).get_data()
+        return run
+
+    for response_format in RESPONSE_FORMATS:
+        add('serialize_batch_%d_%s' % (SERIALIZE_BATCH_SIZE, response_format),
+            lambda: (serialize(response_format), SERIALIZE_BATCH_SIZE))
+
+    feature_rows = [
+        main._feature_json_to_row(main.raw_data_to_feature_tuple(
+            synthetic_applicant(10, seed=seed)))
+        for seed in range(BATCH_SIZE)]
+    encoded_rows = encoding_pipeline.transform(feature_rows)
+    add('encoding_single', lambda: (
+        lambda: encoding_pipeline.transform(feature_rows[:1]), 1))
+    add('encoding_batch', lambda: (
+        lambda: encoding_pipeline.transform(feature_rows), BATCH_SIZE))
+    add('prediction_single', lambda: (
+        lambda: prediction_pipeline.predict(encoded_rows[:1]), 1))
+    add('prediction_batch', lambda: (
+        lambda: prediction_pipeline.predict(encoded_rows), BATCH_SIZE))
+
+    return cases
+
+
+def run_benchmarks(case_filter=None, max_seconds=5.0,
+                   transaction_counts=TRANSACTION_COUNTS):
+    encoding_pipeline, prediction_pipeline = main.model_registry.get()
+    main.app.testing = True
+    client = main.app.test_client()
+
+    # The feature cache would turn every repeat into a hit
+    main.feature_cache.clear()
+    main.feature_cache.max_size = 0
+
+    results = {}
+    cases = build_cases(client, encoding_pipeline, prediction_pipeline,
+                        transaction_counts, case_filter)
+    for name in sorted(cases):
+        function, records_per_call = cases[name]
+        results[name] = time_case(function, records_per_call,
+                                  max_seconds=max_seconds)
+        sys.stderr.write(
+            "%-58s p50 %9.3fms  p95 %9.3fms  p99 %9.3fms  %10.1f rec/s\n" % (
+                name, results[name]['p50_ms'], results[name]['p95_ms'],
+                results[name]['p99_ms'], results[name]['records_per_second']))
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2):
+    # Returns the cases whose p50 latency grew by more than the tolerance
+    regressions = {}
+    for name, baseline_result in baseline.items():
+        if name not in results:
+            continue
+        ratio = results[name]['p50_ms'] / max(baseline_result['p50_ms'],
+                                              1e-6)
+        if ratio > 1 + tolerance:
+            regressions[name] = ratio
+    return regressions
+
+
+def parse_args(argv):
+    arg_parser = argparse.ArgumentParser(
+        description="Benchmark feature extraction and scoring")
+    arg_parser.add_argument('--save', help="Write results to this JSON file")
+    arg_parser.add_argument('--compare',
+                            help="Baseline JSON file to check against")
+    arg_parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Allowed p50 slow down (default: 0.2)")
+    arg_parser.add_argument('--filter', help="Only run cases containing this")
+    arg_parser.add_argument('--max-seconds', type=float, default=5.0,
+                            help="Time budget per case (default: 5)")
+    arg_parser.add_argument('--model-path', default=None)
+    return arg_parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    main.model_registry.load(model_path=args.model_path)
+    results = run_benchmarks(case_filter=args.filter,
+                             max_seconds=args.max_seconds)
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare_to_baseline(
+                results, json.load(baseline_file), args.tolerance)
+        for name, ratio in sorted(regressions.items()):
+            sys.stderr.write("REGRESSION %s: p50 is %.2fx the baseline\n" % (
+                name, ratio))
+        if regressions:
+            sys.exit(1)
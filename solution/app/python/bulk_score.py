@@ -0,0 +1,103 @@
+import argparse
+import collections
+import multiprocessing
+import sys
+import time
+
+import main
+from model_registry import ENCODER_PIPELINE_PATH, MODEL_PIPELINE_PATH
+from record_io import iter_chunks, iter_file_records, to_ndjson
+
+
+# Offline Bulk Scoring
+# Reads applicants from JSON (a list or a single object) or NDJSON files,
+# scores them across a pool of worker processes and writes one NDJSON result
+# line per applicant, in input order.
+#
+#   python python/bulk_score.py applicants.ndjson --output results.ndjson
+
+
+def _init_worker(encoder_path, model_path, feature_engine):
+    # Every worker loads the Pipelines once and keeps them for all its chunks
+    main.FEATURE_ENGINE = feature_engine
+    main.model_registry.load(encoder_path=encoder_path, model_path=model_path)
+
+
+def _score_chunk(chunk):
+    return main.process_batch_request(chunk)
+
+
+def bulk_score(input_paths, output_path, processes=None, chunk_size=500,
+               encoder_path=ENCODER_PIPELINE_PATH,
+               model_path=MODEL_PIPELINE_PATH,
+               feature_engine=main.FEATURE_ENGINE):
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(
+        processes, initializer=_init_worker,
+        initargs=(encoder_path, model_path, feature_engine))
+
+    # Pool.imap would read the whole input ahead of the workers, so only a
+    # couple of chunks per worker are kept in flight instead
+    max_pending = 2 * processes
+    pending = collections.deque()
+    summary = {'records': 0, 'errors': 0}
+    start_time = time.time()
+
+    def write_results(response_jsons, output_file):
+        summary['records'] += len(response_jsons)
+        summary['errors'] += sum(1 for response_json in response_jsons
+                                 if 'error_code' in response_json)
+        output_file.write(to_ndjson(response_jsons))
+
+    try:
+        with open(output_path, 'w') as output_file:
+            for chunk in iter_chunks(iter_file_records(input_paths),
+                                     chunk_size):
+                pending.append(pool.apply_async(_score_chunk, (chunk, )))
+                if len(pending) >= max_pending:
+                    write_results(pending.popleft().get(), output_file)
+
+            while pending:
+                write_results(pending.popleft().get(), output_file)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    summary['seconds'] = time.time() - start_time
+    summary['records_per_second'] = (
+        summary['records'] / summary['seconds'] if summary['seconds'] else 0)
+    return summary
+
+
+def parse_args(argv):
+    arg_parser = argparse.ArgumentParser(
+        description="Score applicant files offline with a process pool")
+    arg_parser.add_argument('inputs', nargs='+',
+                            help="JSON (.json) or NDJSON files of applicants")
+    arg_parser.add_argument('--output', required=True,
+                            help="NDJSON file to write results to")
+    arg_parser.add_argument('--processes', type=int, default=None,
+                            help="Worker processes (default: CPU count)")
+    arg_parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Applicants scored per batch (default: 500)")
+    arg_parser.add_argument('--encoder-path', default=ENCODER_PIPELINE_PATH)
+    arg_parser.add_argument('--model-path', default=MODEL_PIPELINE_PATH)
+    arg_parser.add_argument('--feature-engine', default=main.FEATURE_ENGINE,
+                            choices=main.FEATURE_ENGINES)
+    return arg_parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    summary = bulk_score(args.inputs, args.output,
+                         processes=args.processes,
+                         chunk_size=args.chunk_size,
+                         encoder_path=args.encoder_path,
+                         model_path=args.model_path,
+                         feature_engine=args.feature_engine)
+    sys.stderr.write(
+        "Scored %(records)d records (%(errors)d errors) in %(seconds).2fs: "
+        "%(records_per_second).1f records/s\n" % summary)
@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def _bucket(value):
+    # Power of two histogram buckets: 1, 2, 4, 8, ...
+    bucket = 1
+    while bucket < value:
+        bucket *= 2
+    return bucket
+
+
+class CoalescerTimeout(Exception):
+    pass
+
+
+class _PendingPrediction(object):
+
+    def __init__(self, feature_json):
+        self.feature_json = feature_json
+        self.result = None
+        self._done = threading.Event()
+
+    def set_result(self, result):
+        self.result = result
+        self._done.set()
+
+    def wait(self, timeout):
+        if not self._done.wait(timeout):
+            raise CoalescerTimeout("No prediction within %.1fs" % timeout)
+        return self.result
+
+
+class PredictionCoalescer(object):
+    # Collects single predictions from concurrent request handlers for up to
+    # max_wait_ms or max_batch_size items and scores them as one batch.
+    # score_batch takes a list of Feature JSONs and returns one prediction
+    # (or Exception) per item, like main.generate_batch_predictions.
+    # A caller waits at most result_timeout seconds for its prediction and
+    # gets CoalescerTimeout after that, so a stuck dispatcher cannot hang
+    # the request threads.
+
+    def __init__(self, score_batch, max_wait_ms=5, max_batch_size=64,
+                 result_timeout=30.0):
+        self.score_batch = score_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.result_timeout = result_timeout
+        self.batch_sizes = {}
+        self.queue_depths = {}
+        self.batches = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker_pid = None
+
+    @property
+    def enabled(self):
+        return self.max_wait > 0 and self.max_batch_size > 1
+
+    def _ensure_worker(self):
+        # Started lazily and once per process, so forked workers each get
+        # their own dispatcher thread
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid != os.getpid():
+                worker = threading.Thread(target=self._run,
+                                          name='prediction-coalescer')
+                worker.daemon = True
+                worker.start()
+                self._worker_pid = os.getpid()
+
+    def submit(self, feature_json):
+        self._ensure_worker()
+        pending = _PendingPrediction(feature_json)
+        self._queue.put(pending)
+        result = pending.wait(self.result_timeout)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _collect_batch(self, batch):
+        # Appends to batch, so items taken off the queue are still answered
+        # if collecting fails halfway
+        batch.append(self._queue.get())
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+    def _record(self, batch_size, queue_depth):
+        with self._lock:
+            self.batches += 1
+            batch_bucket = _bucket(batch_size)
+            self.batch_sizes[batch_bucket] = (
+                self.batch_sizes.get(batch_bucket, 0) + 1)
+            depth_bucket = _bucket(queue_depth) if queue_depth else 0
+            self.queue_depths[depth_bucket] = (
+                self.queue_depths.get(depth_bucket, 0) + 1)
+
+    def _run(self):
+        # Any failure fails the collected batch and the loop carries on; the
+        # dispatcher thread never exits while callers may be waiting on it
+        while True:
+            batch = []
+            try:
+                self._collect_batch(batch)
+                self._record(len(batch), self._queue.qsize())
+                results = self.score_batch(
+                    [pending.feature_json for pending in batch])
+                if len(results) != len(batch):
+                    raise ValueError("Scored %d predictions for %d items" %
+                                     (len(results), len(batch)))
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for pending, result in zip(batch, results):
+                pending.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {'max_wait_ms': self.max_wait * 1000.0,
+                    'max_batch_size': self.max_batch_size,
+                    'queue_depth': self._queue.qsize(),
+                    'batches': self.batches,
+                    'batch_size_histogram': dict(
+                        (str(bucket), count)
+                        for bucket, count in self.batch_sizes.items()),
+                    'queue_depth_histogram': dict(
+                        (str(bucket), count)
+                        for bucket, count in self.queue_depths.items())}
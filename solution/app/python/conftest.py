@@ -0,0 +1,40 @@
+import os
+
+import pytest
+from sklearn.externals import joblib
+from sklearn.linear_model import LogisticRegression
+
+
+RESOURCES_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'resources')
+
+ENCODER_PIPELINE_PATH = os.path.join(RESOURCES_DIR, 'encoder_pipeline.pkl')
+
+
+def _fit_sample_model():
+    # Small stand-in for the production model with the same input layout
+    # (seven encoded features) so the serving path can be exercised
+    features = [[9270.02, 9397.36, 7227.61, 127.34, 2169.75, 44, 476],
+                [42.82, 2048.64, 42.82, 123.45, 2048.64, 1, 682],
+                [100.0, 150.0, 50.0, 100.0, 50.0, 0, 810],
+                [5.0, 500.0, 5.0, 495.0, 0.0, 56, 550]]
+    return LogisticRegression(solver='lbfgs').fit(features, [0, 1, 1, 0])
+
+
+@pytest.fixture
+def model_paths(tmpdir):
+    model_path = str(tmpdir.join('model_pipeline.pkl'))
+    joblib.dump(_fit_sample_model(), model_path)
+    return ENCODER_PIPELINE_PATH, model_path
+
+
+@pytest.fixture
+def client(model_paths, monkeypatch):
+    import main
+    from feature_cache import FeatureCache
+    from model_registry import ModelRegistry
+
+    monkeypatch.setattr(main, 'model_registry', ModelRegistry(*model_paths))
+    monkeypatch.setattr(main, 'feature_cache', FeatureCache())
+    main.app.testing = True
+    return main.app.test_client()
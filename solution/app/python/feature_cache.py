@@ -0,0 +1,92 @@
+import datetime as dt
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from feature_engine import _get_date_only
+
+
+def payload_cache_key(raw_data_json):
+    # Canonical hash of the fields the features depend on. TransactionID
+    # and UserID are left out so re-submissions of the same history match;
+    # transaction order is kept as it decides ties in catg_max_debits.
+    transactions = raw_data_json.get('Transactions') or []
+    if isinstance(transactions, dict):
+        # Columnar Transactions
+        transactions = dict((key, value) for key, value in transactions.items()
+                            if key != 'TransactionID')
+    else:
+        transactions = [dict((key, value) for key, value in transaction.items()
+                             if key != 'TransactionID')
+                        for transaction in transactions]
+    relevant_fields = {
+        'CurrentBalance': raw_data_json.get('CurrentBalance'),
+        'FICOScore': raw_data_json.get('FICOScore'),
+        'Transactions': transactions}
+    canonical_json = json.dumps(relevant_fields, sort_keys=True,
+                                separators=(',', ':'))
+    return hashlib.sha1(canonical_json.encode('utf-8')).hexdigest()
+
+
+class FeatureCache(object):
+    # Bounded LRU cache of scored payloads. Entries expire at the next
+    # midnight, when the 30 day window of the features moves by a day.
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, key):
+        now = dt.datetime.today()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if now >= expires_at:
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            # Re-inserting marks the entry as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+
+        expires_at = _get_date_only() + dt.timedelta(days=1)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
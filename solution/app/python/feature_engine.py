@@ -0,0 +1,277 @@
+import datetime as dt
+import time
+
+from dateutil import parser as date_parser
+
+
+# Number of calendar days, ending today, covered by the *_l30 features
+WINDOW_DAYS = 30
+
+# Columnar PostDates are day numbers counted from this date
+EPOCH = dt.datetime(1970, 1, 1)
+
+# Transactions read between two checks of the processing deadline
+DEADLINE_CHECK_ROWS = 4096
+
+
+class ProcessingTimeExceeded(Exception):
+    pass
+
+
+def check_deadline(deadline):
+    # deadline is a time.time() value, or None for no limit
+    if deadline is not None and time.time() > deadline:
+        raise ProcessingTimeExceeded(
+            "Building the features took longer than allowed")
+
+
+def _get_date_only(input_datetime=None):
+    # Defaults to today at call time, so the window moves with the calendar
+    if input_datetime is None:
+        input_datetime = dt.datetime.today()
+    return (input_datetime
+            .replace(hour=0, minute=0, second=0,
+                     microsecond=0, tzinfo=None))
+
+
+def _float_to_dollar(input_float):
+    return float("%.2f" % input_float)
+
+
+def _parse_post_date(post_date, parsed_dates):
+    # Transactions mostly share a handful of dates, so each distinct
+    # string is parsed once per request
+    try:
+        return parsed_dates[post_date]
+    except KeyError:
+        pass
+
+    try:
+        parsed_date = dt.datetime.strptime(post_date, "%Y-%m-%d")
+    except ValueError:
+        # Same lenient formats pandas.to_datetime accepts
+        parsed_date = date_parser.parse(post_date)
+
+    parsed_dates[post_date] = parsed_date
+    return parsed_date
+
+
+def is_columnar(transactions):
+    # Columnar Transactions are parallel arrays instead of a list of objects:
+    #   {"Amount": [...], "PostDate": [day numbers since 1970-01-01],
+    #    "Type": {"values": [...], "codes": [...]},
+    #    "Category": {"values": [...], "codes": [...]}}
+    return isinstance(transactions, dict)
+
+
+def transaction_count(raw_data_json):
+    transactions = raw_data_json['Transactions']
+    if is_columnar(transactions):
+        return len(transactions.get('Amount') or [])
+    return len(transactions)
+
+
+def _iter_row_transactions(transactions):
+    parsed_dates = {}
+    for transaction in transactions:
+        yield (transaction['Type'].lower(),
+               transaction['Amount'],
+               transaction.get('Category'),
+               _parse_post_date(transaction['PostDate'], parsed_dates))
+
+
+def _iter_columnar_transactions(transactions):
+    # Dictionary codes and day numbers are decoded through small lookup
+    # tables, no per-transaction objects are built
+    type_values = [value.lower() for value in transactions['Type']['values']]
+    category_values = transactions['Category']['values']
+    post_dates = {}
+    for amount, type_code, category_code, day_number in zip(
+            transactions['Amount'], transactions['Type']['codes'],
+            transactions['Category']['codes'], transactions['PostDate']):
+        post_date = post_dates.get(day_number)
+        if post_date is None:
+            post_date = post_dates[day_number] = (
+                EPOCH + dt.timedelta(days=day_number))
+        yield (type_values[type_code], amount, category_values[category_code],
+               post_date)
+
+
+def prefilter_window_rows(transactions, deadline=None):
+    # Cheap first pass over row Transactions for the DataFrame engine: keeps
+    # the rows posted at midnight of a day in the window and tracks the
+    # largest debit over the whole history, the only thing older rows are
+    # needed for. Whether a PostDate falls in the window is worked out once
+    # per distinct string, so long histories cost a dictionary lookup per row
+    # instead of a date parse and a DataFrame row.
+    # Returns (rows in the window, category of the largest debit).
+    window_start = _get_date_only() - dt.timedelta(days=WINDOW_DAYS - 1)
+    in_window = {}
+    parsed_dates = {}
+    window_rows = []
+    max_debit_amount = None
+    catg_max_debits = 'None'
+    try:
+        for number, transaction in enumerate(transactions):
+            if deadline is not None and not number % DEADLINE_CHECK_ROWS:
+                check_deadline(deadline)
+
+            # First of equal maximums wins, as with idxmax
+            if transaction['Type'].lower() == 'debit':
+                amount = transaction['Amount']
+                if max_debit_amount is None or amount > max_debit_amount:
+                    max_debit_amount = amount
+                    catg_max_debits = transaction.get('Category')
+
+            post_date = transaction['PostDate']
+            keep = in_window.get(post_date)
+            if keep is None:
+                offset = (_parse_post_date(post_date, parsed_dates) -
+                          window_start)
+                keep = in_window[post_date] = (
+                    0 <= offset.days < WINDOW_DAYS and
+                    not offset.seconds and not offset.microseconds)
+            if keep:
+                window_rows.append(transaction)
+    except ProcessingTimeExceeded:
+        raise
+    except Exception:
+        raise KeyError
+    return window_rows, catg_max_debits
+
+
+def to_columnar_transactions(transactions):
+    # Row Transactions to the columnar layout (TransactionIDs are dropped)
+    type_codes = {}
+    category_codes = {}
+    columns = {'Amount': [], 'PostDate': [],
+               'Type': {'values': [], 'codes': []},
+               'Category': {'values': [], 'codes': []}}
+    parsed_dates = {}
+    for transaction in transactions:
+        columns['Amount'].append(transaction['Amount'])
+        columns['PostDate'].append(
+            (_parse_post_date(transaction['PostDate'], parsed_dates) -
+             EPOCH).days)
+        for column, codes in [('Type', type_codes),
+                              ('Category', category_codes)]:
+            value = transaction[column]
+            if value not in codes:
+                codes[value] = len(columns[column]['values'])
+                columns[column]['values'].append(value)
+            columns[column]['codes'].append(codes[value])
+    return columns
+
+
+def single_pass_feature_tuple(raw_data_json, deadline=None):
+
+    # Same features as main.raw_data_to_feature_tuple, computed with one pass
+    # over the Transactions and plain Python instead of DataFrames.
+    # Additions happen in the same order as the pandas cumsum/groupby so the
+    # rounded results are identical. Accepts row or columnar Transactions.
+
+    # Creating Blank JSON
+    result_json = {}
+
+    # Adding in the simple components (Current Balance and FICO Score)
+    try:
+        result_json['current_balance'] = _float_to_dollar(
+            raw_data_json['CurrentBalance'])
+        result_json['fico_score'] = raw_data_json['FICOScore']
+    except Exception:
+        raise KeyError
+
+    # No Transactions, or none in the window: Balance is flat
+    flat_balance = {
+        'max_bal_l30': result_json['current_balance'],
+        'min_bal_l30': result_json['current_balance'],
+        'sum_debit_l30': 0,
+        'sum_credit_l30': 0}
+
+    if transaction_count(raw_data_json) == 0:
+        result_json.update(flat_balance)
+        result_json['catg_max_debits'] = 'None'
+        return result_json
+
+    # Window Start is the oldest of the calendar days ending today
+    window_start = _get_date_only() - dt.timedelta(days=WINDOW_DAYS - 1)
+
+    # Single Pass: track the largest debit over the whole history and keep
+    # (day in window, type, amount) for transactions posted in the window
+    transactions = raw_data_json['Transactions']
+    max_debit_amount = None
+    result_json['catg_max_debits'] = 'None'
+    window_transactions = []
+    try:
+        for number, (transaction_type, amount, category, post_date) in (
+                enumerate(_iter_columnar_transactions(transactions)
+                          if is_columnar(transactions)
+                          else _iter_row_transactions(transactions))):
+            if deadline is not None and not number % DEADLINE_CHECK_ROWS:
+                check_deadline(deadline)
+
+            # First of equal maximums wins, as with idxmax
+            if transaction_type == 'debit' and (
+                    max_debit_amount is None or amount > max_debit_amount):
+                max_debit_amount = amount
+                result_json['catg_max_debits'] = category
+
+            # Only midnight timestamps line up with the calendar days
+            offset = post_date - window_start
+            if (0 <= offset.days < WINDOW_DAYS and
+                    not offset.seconds and not offset.microseconds):
+                window_transactions.append(
+                    (offset.days, transaction_type, amount))
+    except ProcessingTimeExceeded:
+        raise
+    except Exception:
+        raise KeyError
+
+    if not window_transactions:
+        result_json.update(flat_balance)
+        return result_json
+
+    # Ordering by Day and then Type puts credits before debits on each day
+    window_transactions.sort(key=lambda row: (row[0], row[1]))
+
+    # Running Balance assuming initial Zero Balance, one point per
+    # transaction and one per day without transactions
+    running_sums = []
+    type_sums = {}
+    cum_sum_amount = 0.0
+    transaction_index = 0
+    for day in range(WINDOW_DAYS):
+        if (transaction_index == len(window_transactions) or
+                window_transactions[transaction_index][0] != day):
+            running_sums.append(cum_sum_amount)
+            continue
+
+        while (transaction_index < len(window_transactions) and
+               window_transactions[transaction_index][0] == day):
+            _, transaction_type, amount = (
+                window_transactions[transaction_index])
+            if transaction_type == 'credit':
+                cum_sum_amount += amount
+            else:
+                cum_sum_amount += -amount
+            running_sums.append(cum_sum_amount)
+            type_sums[transaction_type] = (
+                type_sums.get(transaction_type, 0) + amount)
+            transaction_index += 1
+
+    # Initial Balance based on Gap between Final Sum and Current Balance
+    initial_balance = result_json['current_balance'] - cum_sum_amount
+    balances = [running_sum + initial_balance
+                for running_sum in running_sums]
+
+    result_json['max_bal_l30'] = _float_to_dollar(max(balances))
+    result_json['min_bal_l30'] = _float_to_dollar(min(balances))
+
+    # Sum of Debits and Credits over the Window
+    result_json['sum_debit_l30'] = (
+        _float_to_dollar(type_sums['debit']) if 'debit' in type_sums else 0)
+    result_json['sum_credit_l30'] = (
+        _float_to_dollar(type_sums['credit']) if 'credit' in type_sums else 0)
+
+    # Results!
+    return result_json
@@ -0,0 +1,210 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+
+# Frozen Encoder
+# The encoder Pipeline is a ColumnTransformer that passes the numeric
+# features through and ordinal encodes catg_max_debits against a fixed list
+# of categories. Fitting it on the single row of every request is wasted
+# work, so it is fitted once on reference rows and compiled to a lookup
+# table that only transforms. The compiled form is saved as plain JSON:
+#
+#   cd solution/app
+#   python python/frozen_encoder.py resources/encoder_pipeline.pkl \
+#       resources/encoder_frozen.json
+#
+# and loaded by pointing ENCODER_PIPELINE_PATH at the .json file.
+
+# Used when no reference rows are given; with a fixed category list the
+# fitted encoder does not depend on which rows it saw
+DEFAULT_REFERENCE_ROWS = [[42.82, 2048.64, 42.82, 123.45, 2048.64,
+                           'Entertainment', 682]]
+
+
+class FrozenEncoderError(Exception):
+    pass
+
+
+def _column_encoder(pipeline):
+    # The ColumnTransformer, whether wrapped in a one step Pipeline or not
+    steps = getattr(pipeline, 'steps', None)
+    if steps is not None:
+        if len(steps) != 1:
+            raise FrozenEncoderError("Only single step Pipelines compile")
+        pipeline = steps[0][1]
+    if not hasattr(pipeline, 'transformers_'):
+        raise FrozenEncoderError("%s is not a fitted ColumnTransformer" %
+                                 type(pipeline).__name__)
+    if getattr(pipeline, 'transformer_weights', None):
+        raise FrozenEncoderError("Transformer weights are not supported")
+    return pipeline
+
+
+def _compile_columns(column_encoder):
+    # One entry per output column, in output order:
+    # {"index": input column} or {"index": ..., "categories": [...]}
+    columns = []
+    for name, transformer, input_columns in column_encoder.transformers_:
+        if isinstance(input_columns, int):
+            input_columns = [input_columns]
+        if transformer == 'drop':
+            continue
+        if transformer == 'passthrough':
+            columns.extend({'index': int(index)} for index in input_columns)
+            continue
+        if type(transformer).__name__ == 'OrdinalEncoder':
+            for index, categories in zip(input_columns,
+                                         transformer.categories_):
+                columns.append({'index': int(index),
+                                'categories': list(categories)})
+            continue
+        raise FrozenEncoderError("Cannot compile transformer %s (%s)" % (
+            name, type(transformer).__name__))
+    return columns
+
+
+class FrozenEncoder(object):
+    # Transform only stand-in for the fitted encoder Pipeline. Category
+    # columns are looked up in a dict; an unknown category raises ValueError
+    # like the Pipeline does, unless an unknown_category fallback is set, in
+    # which case it is encoded as that category instead. source_path (relative
+    # to the saved file) and source_checksum name the pickled Pipeline it was
+    # compiled from, so a stale compiled encoder can be told apart.
+
+    def __init__(self, columns, unknown_category=None, source_checksum=None,
+                 source_path=None):
+        self.columns = columns
+        self.unknown_category = unknown_category
+        self.source_checksum = source_checksum
+        self.source_path = source_path
+        self._specs = []
+        for column in columns:
+            if 'categories' not in column:
+                self._specs.append((column['index'], None, None))
+                continue
+            lookup = dict((category, float(code)) for code, category
+                          in enumerate(column['categories']))
+            if unknown_category is not None and (
+                    unknown_category not in lookup):
+                raise FrozenEncoderError(
+                    "Fallback category %r is not a known category" %
+                    unknown_category)
+            self._specs.append((column['index'], lookup,
+                                lookup.get(unknown_category)))
+
+    @classmethod
+    def from_pipeline(cls, pipeline, reference_rows=None,
+                      unknown_category=None, source_checksum=None,
+                      source_path=None):
+        reference_rows = reference_rows or DEFAULT_REFERENCE_ROWS
+        try:
+            pipeline.fit(reference_rows)
+        except Exception as e:
+            raise FrozenEncoderError("Fitting on reference rows failed: %s" %
+                                     e)
+        frozen_encoder = cls(_compile_columns(_column_encoder(pipeline)),
+                             unknown_category=unknown_category,
+                             source_checksum=source_checksum,
+                             source_path=source_path)
+
+        # The compiled encoder has to reproduce the Pipeline exactly
+        expected = np.asarray(pipeline.transform(reference_rows), dtype=float)
+        if not np.array_equal(frozen_encoder.transform(reference_rows),
+                              expected):
+            raise FrozenEncoderError("Compiled encoder output differs")
+        return frozen_encoder
+
+    def _encode(self, lookup, unknown_code, value, index):
+        code = lookup.get(value)
+        if code is None:
+            if unknown_code is None:
+                raise ValueError("Found unknown category %r in column %d" %
+                                 (value, index))
+            code = unknown_code
+        return code
+
+    def transform(self, rows):
+        return np.array(
+            [[row[index] if lookup is None
+              else self._encode(lookup, unknown_code, row[index], index)
+              for index, lookup, unknown_code in self._specs]
+             for row in rows], dtype=float)
+
+    def to_json(self):
+        return {'columns': self.columns,
+                'unknown_category': self.unknown_category,
+                'source_checksum': self.source_checksum,
+                'source_path': self.source_path}
+
+    def save(self, path):
+        with open(path, 'w') as frozen_file:
+            json.dump(self.to_json(), frozen_file, indent=2,
+                      separators=(',', ': '), sort_keys=True)
+
+    @classmethod
+    def load(cls, path, unknown_category=None):
+        with open(path) as frozen_file:
+            frozen_json = json.load(frozen_file)
+        return cls(frozen_json['columns'],
+                   unknown_category=(unknown_category or
+                                     frozen_json.get('unknown_category')),
+                   source_checksum=frozen_json.get('source_checksum'),
+                   source_path=frozen_json.get('source_path'))
+
+    def stale_source(self, path):
+        # The source Pipeline of the encoder saved at path when it still
+        # exists but no longer matches the recorded checksum, else None
+        if not (self.source_checksum and self.source_path):
+            return None
+        source_path = os.path.join(os.path.dirname(path), self.source_path)
+        if os.path.isfile(source_path) and (
+                file_checksum(source_path) != self.source_checksum):
+            return source_path
+        return None
+
+
+def file_checksum(path):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as source_file:
+        for block in iter(lambda: source_file.read(1 << 20), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def parse_args(argv):
+    arg_parser = argparse.ArgumentParser(
+        description="Compile the fitted encoder Pipeline to a frozen "
+                    "lookup table")
+    arg_parser.add_argument('pipeline_path')
+    arg_parser.add_argument('output_path')
+    arg_parser.add_argument('--reference',
+                            help="JSON file with a list of feature rows to "
+                                 "fit on (default: one sample row)")
+    arg_parser.add_argument('--unknown-category', default=None,
+                            help="Known category that unknown categories "
+                                 "are encoded as (default: reject them)")
+    return arg_parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    from sklearn.externals import joblib
+
+    args = parse_args(sys.argv[1:])
+    reference_rows = None
+    if args.reference:
+        with open(args.reference) as reference_file:
+            reference_rows = json.load(reference_file)
+
+    frozen_encoder = FrozenEncoder.from_pipeline(
+        joblib.load(args.pipeline_path), reference_rows,
+        unknown_category=args.unknown_category,
+        source_checksum=file_checksum(args.pipeline_path),
+        source_path=os.path.relpath(
+            os.path.abspath(args.pipeline_path),
+            os.path.dirname(os.path.abspath(args.output_path))))
+    frozen_encoder.save(args.output_path)
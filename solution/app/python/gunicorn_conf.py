@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+# Gunicorn Settings for the Scoring Service
+#   gunicorn --config python/gunicorn_conf.py wsgi:app
+# Every setting can be overridden through the environment.
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Resource paths are relative to the App Directory
+chdir = APP_DIR
+pythonpath = os.path.join(APP_DIR, 'python')
+
+bind = '0.0.0.0:%s' % os.environ.get('PORT', '5000')
+
+# Every worker writes its metric counts here so /metrics can answer with the
+# totals of all of them (see metrics.py); a fresh directory per master
+# unless METRICS_DIR is given, removed again on exit
+created_metrics_dir = None
+if not os.environ.get('METRICS_DIR'):
+    created_metrics_dir = tempfile.mkdtemp(prefix='scoring-metrics-')
+    os.environ['METRICS_DIR'] = created_metrics_dir
+
+# Worker Processes each run a pool of threads, so one pod serves
+# WEB_WORKERS * WEB_THREADS requests at a time
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('WEB_THREADS', '4'))
+worker_class = 'gthread'
+
+# Load the app, and with it the Pipelines, before forking the workers
+preload_app = True
+
+# Connections are kept open between requests from the same client
+keepalive = int(os.environ.get('WEB_KEEPALIVE', '5'))
+
+# Seconds a silent worker gets before it is restarted, and seconds in-flight
+# requests get to finish after SIGTERM before the workers are stopped
+timeout = int(os.environ.get('WEB_TIMEOUT', '60'))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', '30'))
+
+# Recycling workers now and then bounds the effect of any slow leak
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', '0'))
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # POST /models/reload would only swap the worker that answers it, so
+    # with several workers rollouts go through the files on disk
+    if server.cfg.workers > 1:
+        import main
+        main.reload_endpoint_enabled = False
+
+
+# Scoring Job Runners
+# With SCORING_JOBS_RUNNER=process (the default) the master starts
+# SCORING_JOBS_CONCURRENCY runner processes next to the web workers, so
+# background jobs never hold up interactive requests, and stops them on exit.
+# Each of them keeps a runner child alive (scoring_jobs.supervise), so a
+# runner that crashes or is killed is replaced and the replacement resumes
+# its job.
+job_runner_processes = []
+
+
+def when_ready(server):
+    if os.environ.get('SCORING_JOBS_RUNNER', 'process') != 'process':
+        return
+    for _ in range(int(os.environ.get('SCORING_JOBS_CONCURRENCY', '1'))):
+        job_runner_processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(APP_DIR, 'python',
+                                          'scoring_jobs.py')],
+            cwd=APP_DIR))
+
+
+def on_exit(server):
+    # A signal sent to the whole process group may have stopped them already
+    for process in job_runner_processes:
+        if process.poll() is None:
+            try:
+                process.terminate()
+            except OSError:
+                pass
+    for process in job_runner_processes:
+        process.wait()
+    if created_metrics_dir:
+        shutil.rmtree(created_metrics_dir, ignore_errors=True)
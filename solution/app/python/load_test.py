@@ -0,0 +1,640 @@
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from itertools import islice
+
+try:
+    import httplib as http_client
+    import Queue as queue
+    from urlparse import urlparse
+except ImportError:
+    import http.client as http_client
+    import queue
+    from urllib.parse import urlparse
+
+from benchmarks import _percentile
+from record_io import iter_chunks, iter_file_records
+
+
+# Load Test
+# Sends generated or replayed applicants to /predictions at increasing load
+# and reports throughput, latency percentiles, error rate and the CPU and
+# memory of every gunicorn worker per step, and where the service saturates.
+#
+#   cd solution/app
+#   python python/load_test.py --start --workers 2 \
+#       --concurrency 1,2,4,8,16 --save load_report.json
+#   python python/load_test.py --url http://127.0.0.1:5000 --pid <master> \
+#       --mode open --rates 25,50,100,200 --replay applicants.ndjson
+#
+# closed: a fixed number of senders, each sending its next request as soon
+# as the previous one is answered (concurrency steps).
+# open: requests are sent on a fixed (or --poisson) schedule whatever the
+# service does (rate steps, requests per second). Latency counts from the
+# scheduled send time, so a backlog in front of the service shows up in it.
+#
+# --start runs gunicorn with python/gunicorn_conf.py on --port, without job
+# runners and with FEATURE_CACHE_SIZE=0 unless set, since repeated payloads
+# would otherwise be answered from the cache. Against a running service,
+# --pid of the gunicorn master enables the per-worker statistics.
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Transaction counts of the generated applicants and their weights
+DEFAULT_MIX = '10:60,100:30,1000:9,10000:1'
+
+REQUEST_HEADERS = {'Content-Type': 'application/json'}
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def parse_levels(value, level_type=int):
+    return [level_type(entry) for entry in value.split(',') if entry.strip()]
+
+
+def parse_mix(value):
+    # "10:60,100:30" -> [(10, 60.0), (100, 30.0)]
+    mix = []
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        count, _, weight = entry.partition(':')
+        mix.append((int(count), float(weight or 1)))
+    if not mix or any(count < 0 or weight <= 0 for count, weight in mix):
+        raise ValueError("An applicant mix looks like transactions:weight,"
+                         "..., not %r" % value)
+    return mix
+
+
+def _weighted_choice(generator, mix):
+    point = generator.uniform(0, sum(weight for _, weight in mix))
+    for count, weight in mix:
+        point -= weight
+        if point <= 0:
+            return count
+    return mix[-1][0]
+
+
+# Request Bodies
+# Bodies are serialized up front and sent in turn, so the driver spends its
+# time on the wire rather than on building payloads. Each entry is
+# (body, applicants in it).
+
+def generate_bodies(mix, batch_size=1, pool_size=200, seed=0):
+    # Loaded here so replaying does not import the service
+    from benchmarks import synthetic_applicant
+
+    generator = random.Random(seed)
+    bodies = []
+    for number in range(pool_size):
+        applicants = [
+            synthetic_applicant(
+                _weighted_choice(generator, mix),
+                seed=seed * 1000000 + number * batch_size + position)
+            for position in range(batch_size)]
+        bodies.append((json.dumps(applicants[0] if batch_size == 1
+                                  else applicants), batch_size))
+    return bodies
+
+
+def replay_bodies(paths, batch_size=1, limit=None):
+    bodies = []
+    for chunk in iter_chunks(islice(iter_file_records(paths), limit),
+                             batch_size):
+        bodies.append((json.dumps(chunk[0] if batch_size == 1 else chunk),
+                       len(chunk)))
+    if not bodies:
+        raise ValueError("No applicants in %s" % ', '.join(paths))
+    return bodies
+
+
+class Client(object):
+    # One keep-alive connection per sender
+
+    def __init__(self, url, timeout=30.0):
+        parsed_url = urlparse(url)
+        self.host = parsed_url.hostname
+        self.port = parsed_url.port or 80
+        self.path = parsed_url.path.rstrip('/') + '/predictions'
+        self.timeout = timeout
+        self.connection = None
+
+    def post(self, body):
+        # (status, response body); a connection the server has closed in the
+        # meantime is reopened once, scoring requests can be repeated
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http_client.HTTPConnection(
+                    self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request('POST', self.path, body,
+                                        REQUEST_HEADERS)
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (http_client.HTTPException, socket.error):
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def _send(client, body, applicants):
+    # (ok, applicants, applicants answered with an error)
+    try:
+        status, response_body = client.post(body)
+    except Exception:
+        return False, applicants, applicants
+    if status != 200:
+        return False, applicants, applicants
+    # Batches report bad applicants in their own slot
+    applicant_errors = (response_body.count(b'"error_code"')
+                        if applicants > 1 else 0)
+    return True, applicants, applicant_errors
+
+
+# Load Steps
+# Every sender keeps its own list of samples, (latency, ok, applicants,
+# applicant errors, finished at), for requests due after the warm-up. Each
+# step returns them with the start and end of its measuring window.
+
+def run_closed_step(url, bodies, concurrency, seconds, warmup_seconds=0,
+                    timeout=30.0):
+    started = time.time()
+    measure_from = started + warmup_seconds
+    stop_at = measure_from + seconds
+    samples = [[] for _ in range(concurrency)]
+
+    def sender(number):
+        client = Client(url, timeout)
+        position = number
+        while True:
+            sent_at = time.time()
+            if sent_at >= stop_at:
+                break
+            body, applicants = bodies[position % len(bodies)]
+            position += concurrency
+            result = _send(client, body, applicants)
+            if sent_at >= measure_from:
+                finished_at = time.time()
+                samples[number].append(
+                    (finished_at - sent_at, ) + result + (finished_at, ))
+        client.close()
+
+    _run_senders(sender, concurrency)
+    return ([sample for sender_samples in samples
+             for sample in sender_samples], measure_from, stop_at)
+
+
+def run_open_step(url, bodies, rate, seconds, warmup_seconds=0, timeout=30.0,
+                  max_in_flight=64, poisson=False, seed=0):
+    # A scheduler queues the send times and up to max_in_flight senders work
+    # through them. Requests still queued timeout seconds after their send
+    # time are counted as errors without being sent.
+    started = time.time()
+    measure_from = started + warmup_seconds
+    stop_at = measure_from + seconds
+    generator = random.Random(seed)
+    scheduled = queue.Queue()
+    samples = [[] for _ in range(max_in_flight)]
+
+    def scheduler():
+        send_at = started
+        position = 0
+        while send_at < stop_at:
+            delay = send_at - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            scheduled.put((send_at, bodies[position % len(bodies)]))
+            position += 1
+            send_at = (send_at + generator.expovariate(rate) if poisson
+                       else started + position / float(rate))
+        for _ in range(max_in_flight):
+            scheduled.put(None)
+
+    def sender(number):
+        client = Client(url, timeout)
+        while True:
+            item = scheduled.get()
+            if item is None:
+                break
+            send_at, (body, applicants) = item
+            if time.time() - send_at > timeout:
+                result = (False, applicants, applicants)
+            else:
+                result = _send(client, body, applicants)
+            if send_at >= measure_from:
+                finished_at = time.time()
+                samples[number].append(
+                    (finished_at - send_at, ) + result + (finished_at, ))
+        client.close()
+
+    scheduler_thread = threading.Thread(target=scheduler)
+    scheduler_thread.daemon = True
+    scheduler_thread.start()
+    _run_senders(sender, max_in_flight)
+    scheduler_thread.join()
+    return ([sample for sender_samples in samples
+             for sample in sender_samples], measure_from, stop_at)
+
+
+def _run_senders(sender, count):
+    threads = [threading.Thread(target=sender, args=(number, ))
+               for number in range(count)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def summarize_samples(samples, measure_from, stop_at):
+    # Throughput counts the requests answered within the window, so an open
+    # loop backlog that is only worked off afterwards does not count
+    seconds = float(stop_at - measure_from)
+    latencies = sorted(sample[0] for sample in samples)
+    requests = len(samples)
+    failed = sum(1 for sample in samples if not sample[1])
+    applicants = sum(sample[2] for sample in samples)
+    applicant_errors = sum(sample[3] for sample in samples)
+    answered = [sample for sample in samples
+                if sample[1] and sample[4] <= stop_at]
+    summary = {'requests': requests,
+               'throughput_rps': len(answered) / seconds,
+               'applicants_per_second': (sum(sample[2] for sample in answered)
+                                         / seconds),
+               'error_rate': failed / float(requests) if requests else 0.0,
+               'applicant_error_rate': (applicant_errors / float(applicants)
+                                        if applicants else 0.0)}
+    for name, percentile in [('p50_ms', 50), ('p90_ms', 90), ('p99_ms', 99),
+                             ('max_ms', 100)]:
+        summary[name] = (_percentile(latencies, percentile) * 1000
+                         if latencies else None)
+    return summary
+
+
+# Worker Statistics
+# CPU time and resident memory of the processes under the gunicorn master,
+# from /proc. CPU is the share of one core over the step; RSS is the peak
+# seen while sampling.
+
+def _child_pids(pid):
+    child_pids = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % name) as stat_file:
+                fields = stat_file.read().rsplit(')', 1)[1].split()
+        except (IOError, OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            child_pids.append(int(name))
+    return sorted(child_pids)
+
+
+def _cpu_seconds(pid):
+    try:
+        with open('/proc/%d/stat' % pid) as stat_file:
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+    except (IOError, OSError):
+        return None
+    # utime and stime, in clock ticks
+    return (int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS)
+
+
+def _rss_kb(pid):
+    try:
+        with open('/proc/%d/status' % pid) as status_file:
+            for line in status_file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return None
+
+
+class ProcessMonitor(object):
+
+    def __init__(self, master_pid, interval=0.5):
+        self.master_pid = master_pid
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.time()
+        self.driver_started = sum(os.times()[:2])
+        self.pids = _child_pids(self.master_pid) if self.master_pid else []
+        self.cpu_started = dict((pid, _cpu_seconds(pid)) for pid in self.pids)
+        self.peak_rss = dict((pid, _rss_kb(pid)) for pid in self.pids)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._sample)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            for pid in self.pids:
+                rss_kb = _rss_kb(pid)
+                if rss_kb is not None:
+                    self.peak_rss[pid] = max(self.peak_rss[pid] or 0, rss_kb)
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        seconds = time.time() - self.started
+        workers = []
+        for pid in self.pids:
+            cpu_seconds = _cpu_seconds(pid)
+            workers.append({
+                'pid': pid,
+                'cpu_percent': (
+                    100.0 * (cpu_seconds - self.cpu_started[pid]) / seconds
+                    if None not in (cpu_seconds, self.cpu_started[pid])
+                    else None),
+                'peak_rss_kb': self.peak_rss[pid]})
+        # The driver shares the host, so its own load is reported too
+        driver_cpu_percent = (100.0 * (sum(os.times()[:2]) -
+                                       self.driver_started) / seconds)
+        return workers, driver_cpu_percent
+
+
+def find_saturation(steps, min_gain=0.1, max_error_rate=0.01,
+                    max_p99_ms=None):
+    # The first step that fails, and the last one before it that did not:
+    # errors above max_error_rate, p99 above max_p99_ms, an open loop step
+    # that could not keep up with its rate, or a closed loop step whose
+    # throughput grew by less than min_gain over the best step so far
+    last_good = None
+    for index, step in enumerate(steps):
+        reason = None
+        if step['error_rate'] > max_error_rate:
+            reason = "%.1f%% of requests failed" % (100 * step['error_rate'])
+        elif max_p99_ms is not None and (step['p99_ms'] or 0) > max_p99_ms:
+            reason = "p99 latency %.1fms is above %.1fms" % (step['p99_ms'],
+                                                             max_p99_ms)
+        elif step.get('target_rps') and (
+                step['throughput_rps'] < 0.95 * step['target_rps']):
+            reason = "served %.1f of the %.1f requests per second sent" % (
+                step['throughput_rps'], step['target_rps'])
+        elif (not step.get('target_rps') and last_good is not None and
+              step['throughput_rps'] < (1 + min_gain) *
+              steps[last_good]['throughput_rps']):
+            reason = "throughput grew by less than %d%% over %s" % (
+                100 * min_gain, steps[last_good]['load'])
+        if reason:
+            return {'saturated_at': index, 'last_good': last_good,
+                    'reason': reason}
+        last_good = index
+    return {'saturated_at': None, 'last_good': last_good, 'reason': None}
+
+
+# Service under Test
+
+def start_service(port, workers, threads, model_path=None,
+                  log_path=os.devnull):
+    environment = dict(os.environ, PORT=str(port), WEB_WORKERS=str(workers),
+                       WEB_THREADS=str(threads), SCORING_JOBS_RUNNER='none')
+    environment.setdefault('FEATURE_CACHE_SIZE', '0')
+    if model_path:
+        environment['MODEL_PIPELINE_PATH'] = os.path.abspath(model_path)
+    gunicorn = os.path.join(os.path.dirname(sys.executable), 'gunicorn')
+    if not os.path.exists(gunicorn):
+        gunicorn = 'gunicorn'
+    with open(log_path, 'a') as log_file:
+        return subprocess.Popen(
+            [gunicorn, '--config', os.path.join('python', 'gunicorn_conf.py'),
+             'wsgi:app'],
+            cwd=APP_DIR, env=environment, stdout=log_file,
+            stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(url, process=None, workers=0, timeout=120.0):
+    # Until GET /ready passes (models loaded and warmed up) and the
+    # master has all workers
+    parsed_url = urlparse(url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError("The service exited with status %d" %
+                               process.returncode)
+        try:
+            connection = http_client.HTTPConnection(
+                parsed_url.hostname, parsed_url.port or 80, timeout=5)
+            connection.request('GET', parsed_url.path.rstrip('/') + '/ready')
+            ready = connection.getresponse().status == 200
+            connection.close()
+        except (http_client.HTTPException, socket.error):
+            ready = False
+        if ready and (process is None or
+                      len(_child_pids(process.pid)) >= workers):
+            return
+        time.sleep(0.5)
+    raise RuntimeError("The service was not ready after %ds" % timeout)
+
+
+def stop_service(process, timeout=30.0):
+    if process.poll() is not None:
+        return
+    # SIGINT is gunicorn's quick shutdown
+    process.send_signal(signal.SIGINT)
+    deadline = time.time() + timeout
+    while process.poll() is None and time.time() < deadline:
+        time.sleep(0.2)
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+def run_load_test(url, bodies, mode='closed', levels=(1, 2, 4, 8),
+                  step_seconds=20.0, warmup_seconds=3.0, master_pid=None,
+                  timeout=30.0, max_in_flight=64, poisson=False,
+                  keep_going=False, min_gain=0.1, max_error_rate=0.01,
+                  max_p99_ms=None):
+    steps = []
+    for level in levels:
+        monitor = ProcessMonitor(master_pid)
+        monitor.start()
+        if mode == 'closed':
+            samples, measure_from, stop_at = run_closed_step(
+                url, bodies, level, step_seconds, warmup_seconds, timeout)
+        else:
+            samples, measure_from, stop_at = run_open_step(
+                url, bodies, level, step_seconds, warmup_seconds, timeout,
+                max_in_flight, poisson)
+        workers, driver_cpu_percent = monitor.stop()
+
+        step = summarize_samples(samples, measure_from, stop_at)
+        step.update({'load': ('concurrency %d' % level if mode == 'closed'
+                              else '%g req/s' % level),
+                     'workers': workers,
+                     'driver_cpu_percent': driver_cpu_percent})
+        if mode == 'open':
+            step['target_rps'] = float(level)
+        steps.append(step)
+        write_step(step)
+
+        saturation = find_saturation(steps, min_gain, max_error_rate,
+                                     max_p99_ms)
+        if saturation['saturated_at'] is not None and not keep_going:
+            break
+
+    return {'url': url, 'mode': mode, 'step_seconds': step_seconds,
+            'steps': steps, 'saturation': find_saturation(
+                steps, min_gain, max_error_rate, max_p99_ms)}
+
+
+def _format_ms(value):
+    return '%9.1f' % value if value is not None else '%9s' % '-'
+
+
+def write_step(step):
+    cpu_percents = [worker['cpu_percent'] for worker in step['workers']
+                    if worker['cpu_percent'] is not None]
+    rss_kbs = [worker['peak_rss_kb'] for worker in step['workers']
+               if worker['peak_rss_kb'] is not None]
+    sys.stderr.write(
+        "%-16s %9.1f %9.1f %s %s %s %s %6.2f%% %12s %10s %7.0f%%\n" % (
+            step['load'], step['throughput_rps'],
+            step['applicants_per_second'], _format_ms(step['p50_ms']),
+            _format_ms(step['p90_ms']), _format_ms(step['p99_ms']),
+            _format_ms(step['max_ms']), 100 * step['error_rate'],
+            ('%.0f/%.0f%%' % (sum(cpu_percents) / len(cpu_percents),
+                              max(cpu_percents))
+             if cpu_percents else '-'),
+            '%.0f' % (max(rss_kbs) / 1024.0) if rss_kbs else '-',
+            step['driver_cpu_percent']))
+
+
+def write_header():
+    sys.stderr.write(
+        "%-16s %9s %9s %9s %9s %9s %9s %7s %12s %10s %8s\n" % (
+            'load', 'req/s', 'app/s', 'p50 ms', 'p90 ms', 'p99 ms',
+            'max ms', 'errors', 'worker cpu', 'rss MB', 'driver'))
+
+
+def write_saturation(report):
+    saturation = report['saturation']
+    steps = report['steps']
+    if saturation['last_good'] is not None:
+        best = steps[saturation['last_good']]
+        sys.stderr.write(
+            "Sustained: %s, %.1f req/s (%.1f applicants/s), p99 %.1fms\n" % (
+                best['load'], best['throughput_rps'],
+                best['applicants_per_second'], best['p99_ms'] or 0))
+    if saturation['saturated_at'] is None:
+        sys.stderr.write("Not saturated; try higher load levels\n")
+    else:
+        sys.stderr.write("Saturated at %s: %s\n" % (
+            steps[saturation['saturated_at']]['load'], saturation['reason']))
+    if any(step['driver_cpu_percent'] > 80 for step in steps):
+        sys.stderr.write("Warning: the driver used most of a core, so it may "
+                         "have limited the load itself\n")
+
+
+def parse_args(argv):
+    arg_parser = argparse.ArgumentParser(
+        description="Load test /predictions at increasing load and report "
+                    "where the service saturates")
+    target = arg_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help="Service to test, e.g. "
+                                      "http://127.0.0.1:5000")
+    target.add_argument('--start', action='store_true',
+                        help="Start gunicorn on --port and test it")
+    arg_parser.add_argument('--pid', type=int,
+                            help="gunicorn master of --url, for worker "
+                                 "statistics")
+    arg_parser.add_argument('--port', type=int, default=5055)
+    arg_parser.add_argument('--workers', type=int, default=2)
+    arg_parser.add_argument('--threads', type=int, default=4)
+    arg_parser.add_argument('--model-path', help="Model for --start")
+    arg_parser.add_argument('--server-log', default=os.devnull,
+                            help="Output of the started service")
+
+    arg_parser.add_argument('--mode', choices=['closed', 'open'],
+                            default='closed')
+    arg_parser.add_argument('--concurrency', default='1,2,4,8,16,32',
+                            help="Closed loop senders per step")
+    arg_parser.add_argument('--rates', default='10,20,40,80,160',
+                            help="Open loop requests per second per step")
+    arg_parser.add_argument('--poisson', action='store_true',
+                            help="Open loop arrivals at random intervals")
+    arg_parser.add_argument('--max-in-flight', type=int, default=64,
+                            help="Open loop senders (default: 64)")
+    arg_parser.add_argument('--step-seconds', type=float, default=20.0)
+    arg_parser.add_argument('--warmup-seconds', type=float, default=3.0)
+    arg_parser.add_argument('--timeout', type=float, default=30.0)
+
+    arg_parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help="Transactions:weight of generated "
+                                 "applicants (default: %s)" % DEFAULT_MIX)
+    arg_parser.add_argument('--replay', nargs='+',
+                            help="JSON or NDJSON applicant files to send "
+                                 "instead")
+    arg_parser.add_argument('--replay-limit', type=int, default=None)
+    arg_parser.add_argument('--batch-size', type=int, default=1,
+                            help="Applicants per request (default: 1)")
+    arg_parser.add_argument('--pool-size', type=int, default=200,
+                            help="Distinct generated request bodies")
+
+    arg_parser.add_argument('--keep-going', action='store_true',
+                            help="Run every step, also after saturation")
+    arg_parser.add_argument('--min-gain', type=float, default=0.1)
+    arg_parser.add_argument('--max-error-rate', type=float, default=0.01)
+    arg_parser.add_argument('--max-p99-ms', type=float, default=None)
+    arg_parser.add_argument('--save', help="Write the report to this JSON "
+                                           "file")
+    return arg_parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+
+    if args.replay:
+        bodies = replay_bodies(args.replay, args.batch_size,
+                               args.replay_limit)
+    else:
+        bodies = generate_bodies(parse_mix(args.mix), args.batch_size,
+                                 args.pool_size)
+
+    service = None
+    url = args.url
+    master_pid = args.pid
+    if args.start:
+        url = 'http://127.0.0.1:%d' % args.port
+        service = start_service(args.port, args.workers, args.threads,
+                                args.model_path, args.server_log)
+        master_pid = service.pid
+    try:
+        wait_until_ready(url, service, args.workers if service else 0)
+        write_header()
+        report = run_load_test(
+            url, bodies, args.mode,
+            parse_levels(args.concurrency) if args.mode == 'closed'
+            else parse_levels(args.rates, float),
+            args.step_seconds, args.warmup_seconds, master_pid, args.timeout,
+            args.max_in_flight, args.poisson, args.keep_going, args.min_gain,
+            args.max_error_rate, args.max_p99_ms)
+    finally:
+        if service is not None:
+            stop_service(service)
+
+    report.update({'batch_size': args.batch_size,
+                   'applicants': (args.replay if args.replay
+                                  else {'mix': args.mix,
+                                        'pool_size': args.pool_size})})
+    write_saturation(report)
+    if args.save:
+        with open(args.save, 'w') as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
@@ -1,21 +1,183 @@
+import os
+import hmac
 import json
-import pandas as pd
+import time
+import logging
 import datetime as dt
-from sklearn.externals import joblib
-from flask import Flask, request, abort, jsonify, make_response
+from flask import (Flask, Response, request, abort, jsonify, make_response,
+                   stream_with_context)
 
+from balance_state import (apply_transactions, create_balance_store,
+                           state_to_feature_json)
+from coalescer import CoalescerTimeout, PredictionCoalescer
+from feature_cache import FeatureCache, payload_cache_key
+from feature_engine import (ProcessingTimeExceeded, _get_date_only,
+                            _float_to_dollar, check_deadline, is_columnar,
+                            prefilter_window_rows, single_pass_feature_tuple,
+                            transaction_count)
+from metrics import (MetricsRegistry, server_timing_header, LATENCY_BUCKETS,
+                     BATCH_SIZE_BUCKETS, TRANSACTION_COUNT_BUCKETS)
+from model_registry import ModelRegistry, ModelLoadError
+from record_io import iter_ndjson_records, iter_chunks, to_ndjson
+from request_schema import SchemaValidator
+from response_writer import (RESPONSE_FORMATS, encode_json, format_records,
+                             format_response, prediction_texts)
+from scoring_jobs import (JobNotFound, JobQueueFull, JobRunner, JobStore,
+                          JobTooLarge)
+from shadow_scoring import ShadowScorer, parse_model_names, parse_named_models
+from startup import StartupTimer
+from window_features import (parse_aggregates, parse_windows,
+                             windowed_feature_tuple)
+import wire_format
 
-def _get_date_only(input_datetime=dt.datetime.today()):
-    return (input_datetime
-            .replace(hour=0, minute=0, second=0,
-                     microsecond=0, tzinfo=None))
 
+# Started once every module above is imported
+startup_timer = StartupTimer()
 
-def _float_to_dollar(input_float):
-    return float("%.2f" % input_float)
 
+# Feature Engine used on the request path:
+# - pandas: raw_data_to_feature_tuple (reference implementation)
+# - single_pass: feature_engine.single_pass_feature_tuple
+# - compare: runs both, serves pandas and logs any mismatch
+# - windows: window_features.windowed_feature_tuple, the single pass
+#   features plus FEATURE_AGGREGATES over every FEATURE_WINDOWS window
+FEATURE_ENGINES = ('pandas', 'single_pass', 'compare', 'windows')
+FEATURE_ENGINE = os.environ.get('FEATURE_ENGINE', 'pandas')
+if FEATURE_ENGINE not in FEATURE_ENGINES:
+    raise ValueError("FEATURE_ENGINE needs to be one of %s" %
+                     ', '.join(FEATURE_ENGINES))
 
-def raw_data_to_feature_tuple(raw_data_json):
+# Trailing windows (days) and aggregates of the windows engine, e.g.
+# FEATURE_WINDOWS=7,60,90 and FEATURE_AGGREGATES=debits_by_category; the 30
+# day balance aggregates the model uses are always included
+FEATURE_WINDOWS = parse_windows(os.environ.get('FEATURE_WINDOWS'))
+FEATURE_AGGREGATES = parse_aggregates(os.environ.get('FEATURE_AGGREGATES'))
+
+# Per applicant limits (0 disables them): histories with more transactions
+# are answered with 413 before any work, and feature building that runs
+# past MAX_FEATURE_SECONDS is given up with 422
+MAX_APPLICANT_TRANSACTIONS = int(os.environ.get('MAX_APPLICANT_TRANSACTIONS',
+                                                '0'))
+MAX_FEATURE_SECONDS = float(os.environ.get('MAX_FEATURE_SECONDS', '0'))
+
+# Scores a synthetic applicant with every loaded model in load_models, so
+# lazily initialised code runs before /ready passes rather than on the first
+# request
+WARMUP_ON_START = os.environ.get('WARMUP_ON_START', '0') == '1'
+
+# Scored payloads kept in memory for re-submissions (0 disables the cache)
+FEATURE_CACHE_SIZE = int(os.environ.get('FEATURE_CACHE_SIZE', '10000'))
+
+# Per-customer state for /predictions/incremental: none (disabled),
+# memory or sqlite (kept at BALANCE_STATE_PATH)
+BALANCE_STATE_STORE = os.environ.get('BALANCE_STATE_STORE', 'none')
+BALANCE_STATE_PATH = os.environ.get('BALANCE_STATE_PATH',
+                                    'balance_state.sqlite3')
+
+# Micro-batching of single predictions from concurrent requests: wait up to
+# COALESCE_MAX_WAIT_MS (0 disables) for up to COALESCE_MAX_BATCH_SIZE items
+COALESCE_MAX_WAIT_MS = float(os.environ.get('COALESCE_MAX_WAIT_MS', '0'))
+COALESCE_MAX_BATCH_SIZE = int(os.environ.get('COALESCE_MAX_BATCH_SIZE', '64'))
+# Seconds a request waits for its coalesced prediction before a 503
+COALESCE_TIMEOUT_SECONDS = float(os.environ.get('COALESCE_TIMEOUT_SECONDS',
+                                                '30'))
+
+# Applicants scored together by the streaming end point
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', '500'))
+
+# Response format when a request does not ask for one with ?format=
+# (default, numeric or compact, see response_writer.py)
+RESPONSE_FORMAT = os.environ.get('RESPONSE_FORMAT', 'default')
+if RESPONSE_FORMAT not in RESPONSE_FORMATS:
+    raise ValueError("RESPONSE_FORMAT needs to be one of %s" %
+                     ', '.join(RESPONSE_FORMATS))
+
+# Asynchronous Scoring Jobs are kept under SCORING_JOBS_DIR and run by
+# SCORING_JOBS_CONCURRENCY runners, either separate processes started by
+# gunicorn ('process'), threads in every web worker ('thread') or nothing
+# ('none', runners are started separately with python/scoring_jobs.py)
+SCORING_JOBS_DIR = os.environ.get('SCORING_JOBS_DIR', 'scoring_jobs')
+SCORING_JOBS_RUNNER = os.environ.get('SCORING_JOBS_RUNNER', 'process')
+SCORING_JOBS_CONCURRENCY = int(os.environ.get('SCORING_JOBS_CONCURRENCY',
+                                              '1'))
+SCORING_JOBS_MAX_QUEUED = int(os.environ.get('SCORING_JOBS_MAX_QUEUED',
+                                             '100'))
+SCORING_JOBS_MAX_RECORDS = int(os.environ.get('SCORING_JOBS_MAX_RECORDS',
+                                              '1000000'))
+SCORING_JOBS_RETENTION_HOURS = float(
+    os.environ.get('SCORING_JOBS_RETENTION_HOURS', '168'))
+SCORING_JOBS_PAGE_SIZE = 1000
+
+# Models besides the live one, as name=path pairs sharing the live encoder
+# (e.g. "candidate=resources/model_v2.pkl"). Requests can name one with
+# ?model=<name>, and the names in SHADOW_MODELS are also scored on a thread
+# pool for every live prediction and logged (to SHADOW_LOG_PATH as NDJSON,
+# or to the 'scoring.shadow' logger) for offline comparison.
+DEFAULT_MODEL_NAME = 'default'
+NAMED_MODELS = parse_named_models(os.environ.get('NAMED_MODELS'))
+SHADOW_MODELS = parse_model_names(os.environ.get('SHADOW_MODELS'))
+SHADOW_THREADS = int(os.environ.get('SHADOW_THREADS', '2'))
+SHADOW_MAX_PENDING = int(os.environ.get('SHADOW_MAX_PENDING', '1000'))
+SHADOW_LOG_PATH = os.environ.get('SHADOW_LOG_PATH') or None
+
+# Adds a Server-Timing header with the per-stage breakdown to every response
+# (clients can also ask for it per request with an X-Request-Timing header)
+TIMING_HEADER = os.environ.get('TIMING_HEADER', '0') == '1'
+
+# POST /models/reload is off unless a token is set, and then needs it as
+# "Authorization: Bearer <token>". It only ever reloads the configured
+# Pipeline paths; new models are rolled out by replacing those files.
+MODEL_RELOAD_TOKEN = os.environ.get('MODEL_RELOAD_TOKEN') or None
+
+# A reload only swaps the Pipelines of the process that handles it, so
+# gunicorn_conf.py turns the end point off when it runs several workers;
+# they pick up replaced files through MODEL_RELOAD_INTERVAL instead
+reload_endpoint_enabled = True
+
+# Directory every worker writes its counts to so that /metrics reports the
+# totals of all of them (gunicorn_conf.py creates one per master); without
+# it each process reports its own
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+
+logger = logging.getLogger('scoring')
+
+# Creating Metrics served on /metrics
+metrics = MetricsRegistry(METRICS_DIR)
+request_counter = metrics.counter(
+    'scoring_requests_total', "HTTP requests handled",
+    ['endpoint', 'status'])
+request_latency = metrics.histogram(
+    'scoring_request_duration_seconds', "HTTP request latency",
+    LATENCY_BUCKETS, ['endpoint'])
+stage_latency = metrics.histogram(
+    'scoring_stage_duration_seconds',
+    "Time spent per scoring stage (parse, validate, features, encode, "
+    "predict, serialize)", LATENCY_BUCKETS, ['stage'])
+batch_size_histogram = metrics.histogram(
+    'scoring_batch_size', "Applicants per batch request or stream chunk",
+    BATCH_SIZE_BUCKETS)
+transaction_count_histogram = metrics.histogram(
+    'scoring_transactions_per_applicant', "Transactions per applicant",
+    TRANSACTION_COUNT_BUCKETS)
+error_counter = metrics.counter(
+    'scoring_errors_total', "Applicants that could not be scored",
+    ['type'])
+
+
+def time_stage(stage):
+    return metrics.time_stage(stage_latency, stage)
+
+
+def _count_error(error):
+    error_counter.inc(type=(error if isinstance(error, str)
+                            else type(error).__name__))
+
+
+def raw_data_to_feature_tuple(raw_data_json, deadline=None):
+
+    # pandas is imported on first use, so processes that never build
+    # DataFrames (other feature engines, tools, job stores) skip it
+    import pandas as pd
 
     # Note on Code Style
     # We will be following the Early Exit (Return) Strategy here as
@@ -47,10 +209,23 @@ def raw_data_to_feature_tuple(raw_data_json):
         result_json['catg_max_debits'] = 'None'
         return result_json
 
+    # Pre-filtering to the Transactions in the Last 30 Days, keeping the
+    # Category with Maximum Debits over all of them on the way
+    window_rows, result_json['catg_max_debits'] = prefilter_window_rows(
+        raw_data_json['Transactions'], deadline)
+
+    # Checking for Transactions in Last 30 Days. If none, set appropriate result
+    if not window_rows:
+        result_json['max_bal_l30'] = result_json['current_balance']
+        result_json['min_bal_l30'] = result_json['current_balance']
+        result_json['sum_debit_l30'] = 0
+        result_json['sum_credit_l30'] = 0
+        return result_json
+
     # Picking up the Transactions as a Pandas DataFrame if Exists
     try:
         transactions_df = pd.DataFrame.from_records(
-            data=raw_data_json['Transactions'],
+            data=window_rows,
             exclude=["TransactionID"])
     except Exception:
         raise KeyError
@@ -62,19 +237,6 @@ def raw_data_to_feature_tuple(raw_data_json):
     except Exception:
         raise KeyError
 
-    # Category with Maximum Debits
-    category_debits = (
-        transactions_df
-        .loc[
-            (transactions_df['Type'] == 'debit'),
-            ['Category', 'Amount']])
-    try:
-        result_json['catg_max_debits'] = (
-            category_debits
-            .loc[category_debits.Amount.idxmax(), 'Category'])
-    except ValueError:
-        result_json['catg_max_debits'] = "None"
-
     # Filtering Down to Last 30 Days with Entries for each day
     last_30_days = pd.DataFrame(
         data=[_get_date_only() - dt.timedelta(days=date_offset)
@@ -84,19 +246,7 @@ def raw_data_to_feature_tuple(raw_data_json):
         last_30_days
         .merge(right=transactions_df, how='left',
                on='PostDate', sort=True))
-
-    # Checking for Transactions in Last 30 Days. If none, set appropriate result
-    if all(pd.isna(balance_df_l30.Type)):
-        try:
-            result_json['max_bal_l30'] = _float_to_dollar(
-                raw_data_json['CurrentBalance'])
-            result_json['min_bal_l30'] = _float_to_dollar(
-                raw_data_json['CurrentBalance'])
-        except Exception:
-            raise KeyError
-        result_json['sum_debit_l30'] = 0
-        result_json['sum_credit_l30'] = 0
-        return result_json
+    check_deadline(deadline)
 
     # Sorting by PostDate and Type
     balance_df_l30 = (balance_df_l30
@@ -154,7 +304,42 @@ def raw_data_to_feature_tuple(raw_data_json):
     return result_json
 
 
-def generate_prediction(raw_data_json):
+def feature_deadline():
+    # time.time() by which an applicant's features need to be built
+    return time.time() + MAX_FEATURE_SECONDS if MAX_FEATURE_SECONDS else None
+
+
+def build_feature_json(raw_data_json, feature_engine=None, deadline=None):
+    feature_engine = feature_engine or FEATURE_ENGINE
+
+    if feature_engine == 'windows':
+        return windowed_feature_tuple(raw_data_json, FEATURE_WINDOWS,
+                                      FEATURE_AGGREGATES, deadline)
+
+    # Columnar Transactions go straight into the single pass engine
+    if (feature_engine == 'single_pass' or
+            is_columnar(raw_data_json['Transactions'])):
+        return single_pass_feature_tuple(raw_data_json, deadline)
+
+    feature_json = raw_data_to_feature_tuple(raw_data_json, deadline)
+
+    if feature_engine == 'compare':
+        try:
+            single_pass_json = single_pass_feature_tuple(raw_data_json,
+                                                         deadline)
+        except ProcessingTimeExceeded:
+            raise
+        except Exception as e:
+            single_pass_json = repr(e)
+        if single_pass_json != feature_json:
+            logger.warning("Feature engine mismatch for UserID %s: %s != %s",
+                           raw_data_json.get('UserID'), feature_json,
+                           single_pass_json)
+
+    return feature_json
+
+
+def _feature_json_to_row(feature_json):
     # # current balance; current_balance
     # # maximum balance over last 30 days; max_bal_l30
     # # minimum balance over last 30 days; min_bal_l30
@@ -162,12 +347,7 @@ def generate_prediction(raw_data_json):
     # # sum of credits over last 30 days; sum_credit_l30
     # # category which had maximum debits (or the string "None" if there were no debits); catg_max_debits
     # # FICO score. fico_score
-
-    feature_json = raw_data_to_feature_tuple(raw_data_json)
-
-    encoding_pipeline = joblib.load("resources/encoder_pipeline.pkl")
-
-    encoded_features = encoding_pipeline.fit_transform([[
+    return [
         feature_json['current_balance'],
         feature_json['max_bal_l30'],
         feature_json['min_bal_l30'],
@@ -175,21 +355,285 @@ def generate_prediction(raw_data_json):
         feature_json['sum_credit_l30'],
         feature_json['catg_max_debits'],
         feature_json['fico_score']
-    ], ])
+    ]
+
+
+def lookup_feature_cache(raw_data_json):
+    # Returns (cache key, feature json, prediction) for a payload. Cached
+    # features are reused as is; a cached prediction only when it came from
+    # the model version that is currently loaded.
+    if not feature_cache.enabled:
+        return None, None, None
+
+    cache_key = payload_cache_key(raw_data_json)
+    cached_entry = feature_cache.get(cache_key)
+    if cached_entry is None:
+        return cache_key, None, None
+
+    feature_json, model_version, prediction = cached_entry
+    if model_version != model_registry.version:
+        prediction = None
+    return cache_key, feature_json, prediction
+
+
+def store_feature_cache(cache_key, feature_json, model_version, prediction):
+    if cache_key is not None:
+        feature_cache.put(cache_key, (feature_json, model_version, prediction))
 
-    prediction_pipeline = joblib.load("resources/model_pipeline.pkl")
 
-    prediction = prediction_pipeline.predict(encoded_features)[0]
+def model_registry_for(model_name):
+    # The live registry, or the one of a named model; KeyError if unknown
+    if not model_name or model_name == DEFAULT_MODEL_NAME:
+        return model_registry
+    return named_model_registries[model_name]
 
-    response = str(prediction)
+
+def generate_prediction(raw_data_json, model_name=None):
+
+    # Cached predictions, the coalescer and shadow scoring are only used for
+    # the live model; a named model still reuses cached features
+    registry = model_registry_for(model_name)
+    is_live = registry is model_registry
+
+    # Version is read before scoring, so a reload mid-request can only make
+    # the cached prediction look older than it is
+    model_version = model_registry.version
+    with time_stage('features'):
+        deadline = feature_deadline()
+        transaction_count_histogram.observe(
+            transaction_count(raw_data_json))
+        cache_key, feature_json, prediction = lookup_feature_cache(
+            raw_data_json)
+        if prediction is not None and is_live:
+            mirror_to_shadow_models([raw_data_json.get('UserID')],
+                                    [feature_json], [prediction])
+            return prediction
+
+        if feature_json is None:
+            feature_json = build_feature_json(raw_data_json,
+                                              deadline=deadline)
+
+    if not is_live:
+        prediction = generate_batch_predictions([feature_json], registry)[0]
+        if isinstance(prediction, Exception):
+            raise prediction
+        return prediction
+
+    if prediction_coalescer.enabled:
+        with time_stage('coalesced_predict'):
+            response = prediction_coalescer.submit(feature_json)
+    else:
+        encoding_pipeline, prediction_pipeline = model_registry.get()
+
+        with time_stage('encode'):
+            encoded_features = encoding_pipeline.transform([
+                _feature_json_to_row(feature_json), ])
+
+        with time_stage('predict'):
+            prediction = prediction_pipeline.predict(encoded_features)[0]
+
+        response = str(prediction)
+
+    store_feature_cache(cache_key, feature_json, model_version, response)
+    mirror_to_shadow_models([raw_data_json.get('UserID')], [feature_json],
+                            [response])
 
     return response
 
 
+def generate_batch_predictions(feature_jsons, registry=None,
+                               stage_prefix=''):
+    # Encodes all Feature Rows as one matrix and makes a single predict call.
+    # Returns one entry per Feature JSON: the prediction, or the Exception
+    # raised while scoring that row.
+    if not feature_jsons:
+        return []
+
+    encoding_pipeline, prediction_pipeline = (registry or
+                                              model_registry).get()
+    feature_rows = [_feature_json_to_row(feature_json)
+                    for feature_json in feature_jsons]
+
+    try:
+        with time_stage(stage_prefix + 'encode'):
+            encoded_features = encoding_pipeline.transform(feature_rows)
+        with time_stage(stage_prefix + 'predict'):
+            return prediction_texts(
+                prediction_pipeline.predict(encoded_features))
+    except Exception:
+        # A single bad row (e.g. an unknown category) fails the whole matrix,
+        # so fall back to scoring row by row to isolate it
+        pass
+
+    predictions = []
+    with time_stage(stage_prefix + 'predict_row_by_row'):
+        for feature_row in feature_rows:
+            try:
+                encoded_features = encoding_pipeline.transform([feature_row, ])
+                predictions.append(
+                    str(prediction_pipeline.predict(encoded_features)[0]))
+            except Exception as e:
+                predictions.append(e)
+    return predictions
+
+
+def score_shadow_model(model_name, feature_jsons):
+    return generate_batch_predictions(feature_jsons,
+                                      named_model_registries[model_name],
+                                      stage_prefix='shadow_')
+
+
+def mirror_to_shadow_models(user_ids, feature_jsons, predictions):
+    shadow_scorer.submit(DEFAULT_MODEL_NAME, user_ids, feature_jsons,
+                         predictions)
+
+
+# Pipelines are loaded once per process and shared by every request
+model_registry = ModelRegistry()
+
+# Named Models, loaded on first use like the live one and always paired
+# with the encoder the live registry serves
+named_model_registries = dict(
+    (name, ModelRegistry(model_path=model_path, encoder_source=model_registry))
+    for name, model_path in NAMED_MODELS.items())
+unknown_shadow_models = set(SHADOW_MODELS) - set(named_model_registries)
+if unknown_shadow_models:
+    raise ValueError("SHADOW_MODELS need to be NAMED_MODELS: %s" %
+                     ', '.join(sorted(unknown_shadow_models)))
+
+# Thread pool scoring the shadow models off the response path
+shadow_scorer = ShadowScorer(
+    lambda model_name, feature_jsons: score_shadow_model(model_name,
+                                                         feature_jsons),
+    SHADOW_MODELS, threads=SHADOW_THREADS, max_pending=SHADOW_MAX_PENDING,
+    log_path=SHADOW_LOG_PATH)
+
+# Payload checks, built once and run before any feature work
+schema_validator = SchemaValidator()
+
+# Features and Predictions of recently scored payloads
+feature_cache = FeatureCache(max_size=FEATURE_CACHE_SIZE)
+
+# Dispatcher scoring concurrent single requests as one batch
+prediction_coalescer = PredictionCoalescer(
+    generate_batch_predictions, max_wait_ms=COALESCE_MAX_WAIT_MS,
+    max_batch_size=COALESCE_MAX_BATCH_SIZE,
+    result_timeout=COALESCE_TIMEOUT_SECONDS)
+
+# Rolling 30 day state per UserID for incremental scoring
+balance_state_store = create_balance_store(BALANCE_STATE_STORE,
+                                           BALANCE_STATE_PATH)
+
+# Scoring Jobs on local disk and the runners working through them
+# (process_batch_request is defined with the request handlers below)
+job_store = JobStore(SCORING_JOBS_DIR, chunk_size=STREAM_CHUNK_SIZE,
+                     max_queued=SCORING_JOBS_MAX_QUEUED,
+                     max_records=SCORING_JOBS_MAX_RECORDS)
+job_runner = JobRunner(job_store,
+                       lambda records: process_batch_request(records),
+                       concurrency=SCORING_JOBS_CONCURRENCY,
+                       retention_seconds=SCORING_JOBS_RETENTION_HOURS * 3600)
+
+# Operational Gauges (and counts kept elsewhere), read when /metrics is
+# scraped
+metrics.gauge('scoring_model_version', "Version of the loaded Pipelines",
+              lambda: model_registry.version)
+metrics.counter('scoring_feature_cache_events_total',
+                "Feature cache hits, misses, evictions and expirations",
+                ['event'],
+                callback=lambda: dict(((event, ), feature_cache.stats()[event])
+                                      for event in ['hits', 'misses',
+                                                    'evictions',
+                                                    'expirations']))
+metrics.gauge('scoring_feature_cache_size', "Entries in the feature cache",
+              lambda: feature_cache.stats()['size'])
+metrics.gauge('scoring_coalescer_queue_depth',
+              "Single predictions waiting for the coalescer",
+              lambda: prediction_coalescer.stats()['queue_depth'])
+metrics.gauge('scoring_startup_seconds',
+              "Seconds each startup stage took, and to_ready from exec",
+              lambda: dict(((stage, ), seconds) for stage, seconds
+                           in list(startup_timer.stages.items()) +
+                           [('to_ready', startup_timer.seconds_to_ready())]
+                           if seconds is not None), ['stage'])
+
+
+def warmup_applicant():
+    # Two days of known categories inside the 30 day window
+    today = _get_date_only()
+    return {"UserID": "warm-up",
+            "CurrentBalance": 42.82,
+            "FICOScore": 682,
+            "Transactions": [
+                {"TransactionID": "warm-up-%d" % days_ago,
+                 "Amount": amount,
+                 "Category": category,
+                 "Type": transaction_type,
+                 "PostDate": (today - dt.timedelta(days=days_ago)).strftime(
+                     "%Y-%m-%d")}
+                for days_ago, amount, category, transaction_type in [
+                    (2, 123.45, "Entertainment", "debit"),
+                    (1, 2048.64, "Deposits", "credit")]]}
+
+
+def warm_up():
+    # Builds features with the configured engine and scores them with every
+    # model directly, so the feature cache, metrics and shadow models do not
+    # see the synthetic applicant. A model that cannot score it fails the
+    # startup instead of the first request.
+    feature_json = build_feature_json(warmup_applicant())
+    for registry in [model_registry] + list(named_model_registries.values()):
+        encoding_pipeline, prediction_pipeline = registry.get()
+        prediction_texts(prediction_pipeline.predict(
+            encoding_pipeline.transform([_feature_json_to_row(feature_json)])))
+    with app.test_request_context():
+        jsonify({"UserID": "warm-up", 'prediction': '0'})
+
+
+def load_models():
+    with startup_timer.stage('load_models'):
+        model_registry.load()
+        for registry in named_model_registries.values():
+            registry.load()
+
+    # Imported ahead of the fork, the DataFrame engine's pandas is shared by
+    # every worker instead of being imported by each on its first request
+    if FEATURE_ENGINE in ('pandas', 'compare'):
+        with startup_timer.stage('import_pandas'):
+            import pandas  # noqa: F401
+
+    if WARMUP_ON_START:
+        with startup_timer.stage('warm_up'):
+            warm_up()
+    startup_timer.mark_ready()
+
+
 # Creating Flask Instance
 app = Flask(__name__)
 
 
+@app.before_request
+def start_request_metrics():
+    request.started_at = time.time()
+    metrics.start_request_timing()
+    metrics.ensure_flushing()
+    if SCORING_JOBS_RUNNER == 'thread':
+        job_runner.ensure_started()
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    request_counter.inc(endpoint=endpoint, status=response.status_code)
+    request_latency.observe(time.time() - request.started_at,
+                            endpoint=endpoint)
+
+    stages = metrics.end_request_timing()
+    if stages and (TIMING_HEADER or request.headers.get('X-Request-Timing')):
+        response.headers['Server-Timing'] = server_timing_header(stages)
+    return response
+
+
 # Creating a Bad Request Handler
 def bad_request(message, include_body_sample=True):
     body_sample = {
@@ -222,43 +666,459 @@ def bad_request(message, include_body_sample=True):
     return abort(make_response((response, 400, [])))
 
 
-def process_request(request_json):
-    if not request_json.get('CurrentBalance'):
-        return bad_request("CurrentBalance is missing from Body")
+def error_response(error_code, message):
+    return abort(make_response((
+        jsonify({'error_code': error_code, 'error_message': message}),
+        error_code, [])))
 
-    if not request_json.get('FICOScore'):
-        return bad_request("FICOScore is missing from Body")
 
-    if (not request_json.get('Transactions')) and (request_json.get('Transactions') != []):
-        return bad_request("Transactions is missing from Body. If there are no transactions, add an empty element")
+def validate_request(request_json):
+    # Returns the error message for a malformed request, or None
+    return schema_validator.validate(request_json)
 
-    if not isinstance(request_json.get('Transactions'), list):
-        return bad_request("Transactions needs to be a list element")
 
+def check_transaction_limit(request_json):
+    # Returns the error message for a history over the limit, or None. Only
+    # counts, so it runs before validation; malformed Transactions are left
+    # to validate_request.
+    if not MAX_APPLICANT_TRANSACTIONS or not isinstance(request_json, dict):
+        return None
     try:
-        prediction = generate_prediction(request_json)
+        count = transaction_count(request_json)
+    except Exception:
+        return None
+    if count > MAX_APPLICANT_TRANSACTIONS:
+        return ("Applicants can have at most %d Transactions, this one has "
+                "%d" % (MAX_APPLICANT_TRANSACTIONS, count))
+    return None
+
+
+def process_request(request_json, model_name=None):
+    limit_message = check_transaction_limit(request_json)
+    if limit_message:
+        _count_error('too_many_transactions')
+        return error_response(413, limit_message)
+
+    with time_stage('validate'):
+        error_message = validate_request(request_json)
+    if error_message:
+        _count_error('validation')
+        return bad_request(error_message)
+
+    try:
+        prediction = generate_prediction(request_json, model_name)
+    except ProcessingTimeExceeded as e:
+        _count_error(e)
+        logger.warning("Generating Features Timed Out for UserID %s",
+                       request_json.get('UserID'))
+        return error_response(422, str(e))
+    except CoalescerTimeout as e:
+        _count_error(e)
+        logger.warning("Coalesced Prediction Timed Out for UserID %s",
+                       request_json.get('UserID'))
+        return error_response(503, str(e))
     except Exception as e:
-        print str(e)
+        _count_error(e)
+        logger.warning("Generating Predictions Failed: %r", e)
         return bad_request("Generating Predictions Failed", include_body_sample=False)
 
     return {"UserID": request_json.get('UserID'), 'prediction': prediction}
 
+
+def _batch_error(request_json, message, error_code=400):
+    user_id = (request_json.get('UserID')
+               if isinstance(request_json, dict) else None)
+    return {"UserID": user_id, 'error_code': error_code,
+            'error_message': message}
+
+
+def process_batch_request(request_jsons, model_name=None):
+    # Batch Mode: every record is validated and turned into features first,
+    # then all valid records are scored together. Responses keep the order
+    # of the request and failures are reported per record.
+    registry = model_registry_for(model_name)
+    is_live = registry is model_registry
+    responses = [None] * len(request_jsons)
+    feature_jsons = []
+    feature_positions = []
+    cache_keys = []
+    # Live predictions per applicant, mirrored to the shadow models
+    shadow_user_ids = []
+    shadow_feature_jsons = []
+    shadow_predictions = []
+    model_version = model_registry.version
+    batch_size_histogram.observe(len(request_jsons))
+
+    limit_messages = [check_transaction_limit(request_json)
+                      for request_json in request_jsons]
+    with time_stage('validate'):
+        error_messages = [limit_message or validate_request(request_json)
+                          for request_json, limit_message
+                          in zip(request_jsons, limit_messages)]
+
+    with time_stage('features'):
+        transaction_count_histogram.observe_many(
+            transaction_count(request_json)
+            for request_json, error_message
+            in zip(request_jsons, error_messages) if not error_message)
+
+        for position, request_json in enumerate(request_jsons):
+            if limit_messages[position]:
+                _count_error('too_many_transactions')
+                responses[position] = _batch_error(
+                    request_json, limit_messages[position], 413)
+                continue
+            if error_messages[position]:
+                _count_error('validation')
+                responses[position] = _batch_error(request_json,
+                                                   error_messages[position])
+                continue
+
+            try:
+                cache_key, feature_json, prediction = lookup_feature_cache(
+                    request_json)
+                if prediction is not None and is_live:
+                    responses[position] = {
+                        "UserID": request_json.get('UserID'),
+                        'prediction': prediction}
+                    shadow_user_ids.append(request_json.get('UserID'))
+                    shadow_feature_jsons.append(feature_json)
+                    shadow_predictions.append(prediction)
+                    continue
+                if feature_json is None:
+                    feature_json = build_feature_json(
+                        request_json, deadline=feature_deadline())
+            except ProcessingTimeExceeded as e:
+                _count_error(e)
+                logger.warning("Generating Features Timed Out for UserID %s",
+                               request_json.get('UserID'))
+                responses[position] = _batch_error(request_json, str(e), 422)
+                continue
+            except Exception as e:
+                _count_error(e)
+                logger.warning("Generating Features Failed: %r", e)
+                responses[position] = _batch_error(
+                    request_json, "Generating Predictions Failed")
+                continue
+            feature_jsons.append(feature_json)
+            feature_positions.append(position)
+            cache_keys.append(cache_key)
+
+    predictions = generate_batch_predictions(feature_jsons, registry)
+
+    for position, feature_json, cache_key, prediction in zip(
+            feature_positions, feature_jsons, cache_keys, predictions):
+        request_json = request_jsons[position]
+        if isinstance(prediction, Exception):
+            _count_error(prediction)
+            logger.warning("Generating Predictions Failed: %r", prediction)
+            responses[position] = _batch_error(
+                request_json, "Generating Predictions Failed")
+        else:
+            responses[position] = {"UserID": request_json.get('UserID'),
+                                   'prediction': prediction}
+            if is_live:
+                store_feature_cache(cache_key, feature_json, model_version,
+                                    prediction)
+                shadow_user_ids.append(request_json.get('UserID'))
+                shadow_feature_jsons.append(feature_json)
+                shadow_predictions.append(prediction)
+
+    if is_live:
+        mirror_to_shadow_models(shadow_user_ids, shadow_feature_jsons,
+                                shadow_predictions)
+    return responses
+
+
+def parse_request_body():
+    # JSON by default, MessagePack when the Content-Type says so
+    if not wire_format.is_msgpack(request.mimetype):
+        if not request.json:
+            return bad_request("Please add Data JSON to request Body")
+        return request.get_json(force=True, silent=True)
+
+    if not wire_format.msgpack_available():
+        return error_response(415, "MessagePack is not supported")
+
+    try:
+        return wire_format.unpack(request.get_data())
+    except Exception:
+        return bad_request("Body is not valid MessagePack")
+
+
+def requested_model_name():
+    # ?model=<name> scores with a named model instead of the live one
+    model_name = request.args.get('model')
+    try:
+        model_registry_for(model_name)
+    except KeyError:
+        return bad_request("Unknown model %s" % model_name,
+                           include_body_sample=False)
+    return model_name
+
+
+def requested_response_format():
+    response_format = request.args.get('format', RESPONSE_FORMAT)
+    if response_format not in RESPONSE_FORMATS:
+        return bad_request("format needs to be one of %s" %
+                           ', '.join(RESPONSE_FORMATS),
+                           include_body_sample=False)
+    return response_format
+
+
+def make_scoring_response(response_json, response_format='default'):
+    response_json = format_response(response_json, response_format)
+    if (wire_format.preferred_response_mimetype(request.accept_mimetypes)
+            in wire_format.MSGPACK_MIMETYPES):
+        return Response(wire_format.pack(response_json),
+                        mimetype='application/msgpack')
+    # The default format keeps jsonify's output byte for byte
+    if response_format == 'default':
+        return jsonify(response_json)
+    return Response(encode_json(response_json), mimetype='application/json')
+
+
 # Creating End Point
 @app.route('/predictions', methods=['POST'])
 def main():
-    if not request.json:
-        return bad_request("Please add Data JSON to request Body")
+    model_name = requested_model_name()
+    response_format = requested_response_format()
 
-    request_json = request.get_json(force=True, silent=True)
+    with time_stage('parse'):
+        request_json = parse_request_body()
 
     # If it is a single request
     if isinstance(request_json, dict):
-        return jsonify(process_request(request_json))
+        response_json = process_request(request_json, model_name)
     # If there are multiple Requests
     elif isinstance(request_json, list):
-        responses = [process_request(req_json) for req_json in request_json]
-        return jsonify(responses)
+        response_json = process_batch_request(request_json, model_name)
+    else:
+        return bad_request("Please add Data JSON to request Body")
+
+    with time_stage('serialize'):
+        return make_scoring_response(response_json, response_format)
+
+
+# Creating Streaming End Point
+# Takes newline-delimited JSON applicants and streams back one NDJSON result
+# line per applicant. The body is read and scored one chunk at a time, so
+# memory depends on STREAM_CHUNK_SIZE rather than on the upload size.
+@app.route('/predictions/stream', methods=['POST'])
+def stream_predictions():
+    model_name = requested_model_name()
+    response_format = requested_response_format()
+
+    def generate():
+        for chunk in iter_chunks(iter_ndjson_records(request.stream),
+                                 STREAM_CHUNK_SIZE):
+            yield to_ndjson(format_records(
+                process_batch_request(chunk, model_name), response_format))
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+# Creating Incremental End Point
+# Takes only the transactions that are new since the last call for this
+# UserID, folds them into the stored rolling state and scores from that
+@app.route('/predictions/incremental', methods=['POST'])
+def incremental_prediction():
+    if balance_state_store is None:
+        return bad_request("Incremental scoring is not enabled",
+                           include_body_sample=False)
+
+    request_json = request.get_json(force=True, silent=True)
+
+    limit_message = check_transaction_limit(request_json)
+    if limit_message:
+        _count_error('too_many_transactions')
+        return error_response(413, limit_message)
+
+    error_message = validate_request(request_json)
+    if not error_message and not request_json.get('UserID'):
+        error_message = "UserID is missing from Body"
+    if not error_message and is_columnar(request_json['Transactions']):
+        error_message = "Incremental scoring needs a list of Transactions"
+    if error_message:
+        return bad_request(error_message)
+
+    try:
+        state = balance_state_store.update(
+            request_json['UserID'],
+            lambda state: apply_transactions(state,
+                                             request_json['Transactions']))
+        feature_json = state_to_feature_json(state,
+                                             request_json['CurrentBalance'],
+                                             request_json['FICOScore'])
+        prediction = generate_batch_predictions([feature_json])[0]
+        if isinstance(prediction, Exception):
+            raise prediction
+    except Exception as e:
+        _count_error(e)
+        logger.warning("Generating Predictions Failed: %r", e)
+        return bad_request("Generating Predictions Failed",
+                           include_body_sample=False)
+
+    return jsonify({"UserID": request_json['UserID'],
+                    'prediction': prediction})
+
+
+# Creating Scoring Job End Points
+# A large batch is written to disk as a job and scored in the background;
+# the client polls the job and pages through the results as chunks finish
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    if request.mimetype == 'application/x-ndjson':
+        records = iter_ndjson_records(request.stream)
+    else:
+        request_json = parse_request_body()
+        if isinstance(request_json, dict):
+            request_json = [request_json]
+        if not isinstance(request_json, list):
+            return bad_request("Please add Data JSON to request Body")
+        records = request_json
+
+    try:
+        job_status = job_store.create(records)
+    except JobQueueFull as e:
+        return error_response(429, str(e))
+    except JobTooLarge as e:
+        return error_response(413, str(e))
+
+    response = jsonify(job_status)
+    response.status_code = 202
+    response.headers['Location'] = '/jobs/%s' % job_status['job_id']
+    return response
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def describe_job(job_id):
+    try:
+        return jsonify(job_store.status(job_id))
+    except JobNotFound:
+        return error_response(404, "Unknown job %s" % job_id)
+
+
+@app.route('/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    # Pages of results in request order, only from chunks already scored
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(SCORING_JOBS_PAGE_SIZE,
+                    max(1, int(request.args.get('limit',
+                                                SCORING_JOBS_PAGE_SIZE))))
+    except ValueError:
+        return bad_request("offset and limit need to be integers",
+                           include_body_sample=False)
+
+    try:
+        job_status, results = job_store.results(job_id, offset, limit)
+    except JobNotFound:
+        return error_response(404, "Unknown job %s" % job_id)
+
+    next_offset = offset + len(results)
+    return jsonify({'job_id': job_id, 'state': job_status['state'],
+                    'total': job_status['total'], 'offset': offset,
+                    'results': results,
+                    'next_offset': (next_offset
+                                    if next_offset < job_status['total']
+                                    else None)})
+
+
+def _to_bytes(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+
+def _reload_authorized():
+    # Constant time comparison, so the token cannot be guessed by timing
+    authorization = request.headers.get('Authorization', '')
+    scheme, _, token = authorization.partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(
+        _to_bytes(token.strip()), _to_bytes(MODEL_RELOAD_TOKEN))
+
+
+# Creating Model Reload End Point
+# Loads the configured Pipeline files next to the live ones and swaps them
+# in only once they pass validation, so in-flight requests are never dropped
+@app.route('/models/reload', methods=['POST'])
+def reload_models():
+    if MODEL_RELOAD_TOKEN is None:
+        return error_response(404, "Model reloads are disabled")
+    if not _reload_authorized():
+        return error_response(401, "Model reloads need the reload token")
+    if not reload_endpoint_enabled:
+        return error_response(409, "Reloading one of several workers would "
+                                   "split the models; replace the Pipeline "
+                                   "files and let MODEL_RELOAD_INTERVAL pick "
+                                   "them up")
+
+    reload_json = request.get_json(force=True, silent=True) or {}
+    if 'encoder_path' in reload_json or 'model_path' in reload_json:
+        # Unpickling a path chosen by the caller would run arbitrary code
+        return bad_request("Reloads only read the configured Pipeline "
+                           "paths; replace those files to roll out a model",
+                           include_body_sample=False)
+
+    try:
+        registry = model_registry_for(reload_json.get('model'))
+    except KeyError:
+        return bad_request("Unknown model %s" % reload_json.get('model'),
+                           include_body_sample=False)
+
+    try:
+        model_info = registry.load()
+    except ModelLoadError as e:
+        return bad_request(str(e), include_body_sample=False)
+
+    return jsonify(model_info)
+
+
+# Creating Readiness End Point
+# 200 once the models are loaded (and warmed up, with WARMUP_ON_START),
+# 503 before, with the startup timings either way
+@app.route('/ready', methods=['GET'])
+def readiness():
+    models_loaded = model_registry.is_loaded() and all(
+        registry.is_loaded() for registry in named_model_registries.values())
+    ready = models_loaded and startup_timer.is_ready
+    return make_response((jsonify({'ready': ready,
+                                   'models_loaded': models_loaded,
+                                   'model': model_registry.describe(),
+                                   'startup': startup_timer.describe()}),
+                          200 if ready else 503, []))
+
+
+@app.route('/models', methods=['GET'])
+def describe_models():
+    models_json = model_registry.describe()
+    models_json['named_models'] = dict(
+        (name, registry.describe())
+        for name, registry in named_model_registries.items())
+    models_json['shadow'] = shadow_scorer.stats()
+    return jsonify(models_json)
+
+
+@app.route('/cache/stats', methods=['GET'])
+def describe_feature_cache():
+    return jsonify(feature_cache.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def expose_metrics():
+    return Response(metrics.expose(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/coalescer/stats', methods=['GET'])
+def describe_prediction_coalescer():
+    return jsonify(prediction_coalescer.stats())
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    # Loading Pipelines before accepting traffic
+    load_models()
+    if SCORING_JOBS_RUNNER != 'none':
+        job_runner.ensure_started()
     app.run(host='0.0.0.0', debug=False)
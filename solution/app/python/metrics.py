@@ -0,0 +1,324 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+logger = logging.getLogger('scoring')
+
+# Metrics in the Prometheus text exposition format.
+# Each worker process keeps its own counts; observations are a dictionary
+# update under a lock, cheap enough to leave on in production.
+#
+# With a directory (METRICS_DIR, set up by gunicorn_conf.py), every process
+# also writes its counters and histograms to a file of its own there, about
+# once a second when they changed, and /metrics sums the files of every
+# process, so any worker answers with the totals of the whole pod. Files of
+# exited workers stay, so the totals never go backwards. Gauges are read in
+# the process that answers.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000,
+                      10000)
+TRANSACTION_COUNT_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000,
+                             50000, 100000)
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    # A callback returning a dict of label value tuples to counts can stand
+    # in for inc(), for counts kept elsewhere (e.g. the feature cache)
+
+    def __init__(self, name, help_text, label_names=(), callback=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        return self.values().get(key, 0)
+
+    def values(self):
+        if self.callback is not None:
+            return dict(self.callback())
+        with self._lock:
+            return dict(self._values)
+
+    def expose(self, values=None):
+        lines = ['# HELP %s %s' % (self.name, self.help_text),
+                 '# TYPE %s counter' % self.name]
+        if values is None:
+            values = self.values()
+        for key, value in sorted(values.items()):
+            lines.append('%s%s %s' % (
+                self.name, _format_labels(self.label_names, key),
+                _format_value(value)))
+        return lines
+
+
+class Histogram(object):
+
+    def __init__(self, name, help_text, buckets, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets) + (float('inf'), )
+        self.label_names = tuple(label_names)
+        # Per label set: [count per bucket..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe_many(self, values, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            for value in values:
+                for index, upper_bound in enumerate(self.buckets):
+                    if value <= upper_bound:
+                        series[index] += 1
+                        break
+                series[-2] += value
+                series[-1] += 1
+
+    def observe(self, value, **labels):
+        self.observe_many((value, ), **labels)
+
+    def count(self, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        series = self._values.get(key)
+        return series[-1] if series else 0
+
+    def values(self):
+        with self._lock:
+            return dict((key, list(series))
+                        for key, series in self._values.items())
+
+    def expose(self, values=None):
+        lines = ['# HELP %s %s' % (self.name, self.help_text),
+                 '# TYPE %s histogram' % self.name]
+        if values is None:
+            values = self.values()
+        for key, series in sorted(values.items()):
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                lines.append('%s_bucket%s %d' % (
+                    self.name,
+                    _format_labels(self.label_names, key,
+                                   [('le', _format_value(upper_bound))]),
+                    cumulative))
+            labels = _format_labels(self.label_names, key)
+            lines.append('%s_sum%s %s' % (self.name, labels,
+                                          _format_value(series[-2])))
+            lines.append('%s_count%s %d' % (self.name, labels, series[-1]))
+        return lines
+
+
+class Gauge(object):
+    # Read at scrape time from a callback returning a number, or a dict of
+    # label value tuples to numbers
+
+    def __init__(self, name, help_text, callback, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.label_names = tuple(label_names)
+
+    def expose(self):
+        lines = ['# HELP %s %s' % (self.name, self.help_text),
+                 '# TYPE %s gauge' % self.name]
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append('%s%s %s' % (
+                self.name, _format_labels(self.label_names, key),
+                _format_value(value)))
+        return lines
+
+
+class MetricsRegistry(object):
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._request_timings = threading.local()
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_pid = None
+        self._snapshot_path = None
+        self._last_snapshot = None
+        self._flusher_pid = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=(), callback=None):
+        return self.register(Counter(name, help_text, label_names, callback))
+
+    def histogram(self, name, help_text, buckets, label_names=()):
+        return self.register(Histogram(name, help_text, buckets, label_names))
+
+    def gauge(self, name, help_text, callback, label_names=()):
+        return self.register(Gauge(name, help_text, callback, label_names))
+
+    def expose(self):
+        merged = None
+        if self.directory:
+            self.write_snapshot()
+            merged = self.merged_values()
+        lines = []
+        for metric in self._metrics:
+            if merged is not None and metric.name in merged:
+                lines.extend(metric.expose(merged[metric.name]))
+            else:
+                lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+    # Sharing Counts between Processes
+
+    def _shared_metrics(self):
+        return [metric for metric in self._metrics
+                if not isinstance(metric, Gauge)]
+
+    def write_snapshot(self):
+        # One file per process; a fresh name per pid, so a worker that
+        # reuses the pid of an exited one does not replace its counts
+        with self._snapshot_lock:
+            if self._snapshot_pid != os.getpid():
+                self._snapshot_pid = os.getpid()
+                self._snapshot_path = os.path.join(
+                    self.directory, 'metrics-%d-%s.json' % (
+                        os.getpid(), uuid.uuid4().hex[:8]))
+                self._last_snapshot = None
+            snapshot = json.dumps(dict(
+                (metric.name, sorted([list(key), value] for key, value
+                                     in metric.values().items()))
+                for metric in self._shared_metrics()), sort_keys=True)
+            if snapshot == self._last_snapshot:
+                return
+            temporary_path = self._snapshot_path + '.tmp'
+            with open(temporary_path, 'w') as snapshot_file:
+                snapshot_file.write(snapshot)
+            os.rename(temporary_path, self._snapshot_path)
+            self._last_snapshot = snapshot
+
+    def merged_values(self):
+        # Counters add up per label set, histograms per bucket
+        merged = dict((metric.name, {}) for metric in self._shared_metrics())
+        for file_name in os.listdir(self.directory):
+            if not (file_name.startswith('metrics-') and
+                    file_name.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self.directory,
+                                       file_name)) as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except (IOError, OSError, ValueError):
+                continue
+            for name, entries in snapshot.items():
+                values = merged.get(name)
+                if values is None:
+                    continue
+                for key, value in entries:
+                    key = tuple(key)
+                    current = values.get(key)
+                    if current is None:
+                        values[key] = value
+                    elif isinstance(value, list):
+                        values[key] = [total + count for total, count
+                                       in zip(current, value)]
+                    else:
+                        values[key] = current + value
+        return merged
+
+    def ensure_flushing(self):
+        # Started lazily and once per process, so forked workers each write
+        # their own file, idle ones included
+        if not self.directory or self._flusher_pid == os.getpid():
+            return
+        with self._snapshot_lock:
+            if self._flusher_pid != os.getpid():
+                flusher = threading.Thread(target=self._flush_forever,
+                                           name='metrics-flusher')
+                flusher.daemon = True
+                flusher.start()
+                self._flusher_pid = os.getpid()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.write_snapshot()
+            except (IOError, OSError) as e:
+                logger.warning("Could not write metrics: %s", e)
+
+    # Per-Request Timing Breakdown
+    # Stage durations of the request handled by the current thread are
+    # collected here so they can be returned in a response header.
+
+    def start_request_timing(self):
+        self._request_timings.stages = []
+
+    def request_timings(self):
+        return getattr(self._request_timings, 'stages', None) or []
+
+    def end_request_timing(self):
+        stages = self.request_timings()
+        self._request_timings.stages = None
+        return stages
+
+    @contextmanager
+    def time_stage(self, histogram, stage):
+        started = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - started
+            histogram.observe(duration, stage=stage)
+            stages = getattr(self._request_timings, 'stages', None)
+            if stages is not None:
+                stages.append((stage, duration))
+
+
+def server_timing_header(stages):
+    # Server-Timing header value, durations in milliseconds. A stage that ran
+    # more than once in the request is reported as its total.
+    totals = []
+    durations = {}
+    for stage, duration in stages:
+        if stage not in durations:
+            totals.append(stage)
+            durations[stage] = 0.0
+        durations[stage] += duration
+    return ', '.join('%s;dur=%.3f' % (stage, durations[stage] * 1000)
+                     for stage in totals)
@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from frozen_encoder import file_checksum
+
+
+# Memory-Mapped Model Artifact
+# A directory holding the fitted model as an uncompressed joblib pickle, with
+# every numpy array stored raw and aligned, and a manifest with its checksum
+# and format version. Loading maps the arrays read-only instead of copying
+# them, so all processes on a node share one copy of the pages and a worker
+# only pulls in the pages it touches.
+#
+#   cd solution/app
+#   python python/model_artifact.py export resources/model_pipeline.pkl \
+#       resources/model_artifact
+#   python python/model_artifact.py measure resources/model_pipeline.pkl \
+#       resources/model_artifact --workers 4
+#
+# MODEL_PIPELINE_PATH can then point at the artifact directory.
+
+ARTIFACT_FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+MODEL_FILE_NAME = 'model.joblib'
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def is_artifact(path):
+    return os.path.isfile(os.path.join(path, MANIFEST_NAME))
+
+
+def _replace_file(path, write):
+    # Written next to the target and renamed over it: processes that still
+    # map the old file keep the old inode, and readers never see half a file
+    temporary_path = '%s.tmp-%d' % (path, os.getpid())
+    try:
+        write(temporary_path)
+        os.rename(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def _write_json(json_object):
+    def write(path):
+        with open(path, 'w') as json_file:
+            json.dump(json_object, json_file, indent=2,
+                      separators=(',', ': '), sort_keys=True)
+    return write
+
+
+def export_artifact(pipeline, artifact_dir, source_checksum=None):
+    import sklearn
+    from sklearn.externals import joblib
+
+    if not os.path.isdir(artifact_dir):
+        os.makedirs(artifact_dir)
+    model_path = os.path.join(artifact_dir, MODEL_FILE_NAME)
+
+    # compress=0 keeps the arrays raw, which is what allows mapping them
+    _replace_file(model_path,
+                  lambda path: joblib.dump(pipeline, path, compress=0))
+
+    # The manifest goes last, so a reload never sees a new manifest
+    # describing an old model file
+    manifest = {'format_version': ARTIFACT_FORMAT_VERSION,
+                'created_at': time.time(),
+                'sklearn_version': sklearn.__version__,
+                'numpy_version': np.__version__,
+                'source_checksum': source_checksum,
+                'files': {MODEL_FILE_NAME: {
+                    'sha256': file_checksum(model_path),
+                    'size': os.path.getsize(model_path)}}}
+    _replace_file(os.path.join(artifact_dir, MANIFEST_NAME),
+                  _write_json(manifest))
+    return manifest
+
+
+def read_manifest(artifact_dir):
+    try:
+        with open(os.path.join(artifact_dir, MANIFEST_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (IOError, OSError, ValueError) as e:
+        raise ArtifactError("Could not read the manifest: %s" % e)
+
+    if manifest.get('format_version') != ARTIFACT_FORMAT_VERSION:
+        raise ArtifactError("Unsupported artifact format version %r" %
+                            manifest.get('format_version'))
+    return manifest
+
+
+def load_artifact(artifact_dir, verify_checksum=True):
+    from sklearn.externals import joblib
+
+    manifest = read_manifest(artifact_dir)
+    model_path = os.path.join(artifact_dir, MODEL_FILE_NAME)
+    expected = manifest['files'][MODEL_FILE_NAME]
+
+    # The size check is free; the checksum reads the whole file once
+    if not os.path.isfile(model_path) or (
+            os.path.getsize(model_path) != expected['size']):
+        raise ArtifactError("%s is missing or has the wrong size" %
+                            model_path)
+    if verify_checksum and file_checksum(model_path) != expected['sha256']:
+        raise ArtifactError("%s does not match its manifest checksum" %
+                            model_path)
+
+    return joblib.load(model_path, mmap_mode='r')
+
+
+# Cold Start and Memory Measurement
+# Each probe is a fresh interpreter that loads the model through the
+# registry (including its validation prediction) and reports the load time
+# and its memory; all probes of a run stay alive until every one has
+# reported, so the proportional set size (PSS) shows what they share.
+
+def _memory_kb():
+    memory = {}
+    for path, fields in [('/proc/self/status', ('VmRSS', 'RssAnon',
+                                                'RssFile')),
+                         ('/proc/self/smaps_rollup', ('Pss', ))]:
+        try:
+            with open(path) as proc_file:
+                for line in proc_file:
+                    name, _, value = line.partition(':')
+                    if name in fields:
+                        memory[name] = int(value.split()[0])
+        except (IOError, OSError):
+            pass
+    return {'rss_kb': memory.get('VmRSS'),
+            'rss_anon_kb': memory.get('RssAnon'),
+            'rss_file_kb': memory.get('RssFile'),
+            'pss_kb': memory.get('Pss')}
+
+
+def probe(model_path):
+    from model_registry import ModelRegistry
+
+    started = time.time()
+    registry = ModelRegistry(model_path=model_path)
+    registry.load()
+    result = {'load_seconds': time.time() - started}
+    result.update(_memory_kb())
+    sys.stdout.write(json.dumps(result) + '\n')
+    sys.stdout.flush()
+    # The registry keeps the Pipelines resident until the parent has heard
+    # from every probe
+    sys.stdin.readline()
+
+
+def _median(values):
+    values = sorted(value for value in values if value is not None)
+    return values[len(values) // 2] if values else None
+
+
+def measure(model_path, workers=4, runs=3):
+    samples = []
+    for _ in range(runs):
+        processes = [subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'probe', model_path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            for _ in range(workers)]
+        try:
+            for process in processes:
+                line = process.stdout.readline()
+                if not line:
+                    raise ArtifactError("Probe of %s failed" % model_path)
+                samples.append(json.loads(line.decode('utf-8')))
+        finally:
+            for process in processes:
+                process.stdin.close()
+                process.wait()
+
+    summary = {'model_path': model_path, 'workers': workers, 'runs': runs}
+    for key in ['load_seconds', 'rss_kb', 'rss_anon_kb', 'rss_file_kb',
+                'pss_kb']:
+        summary[key] = _median(sample[key] for sample in samples)
+    return summary
+
+
+def parse_args(argv):
+    arg_parser = argparse.ArgumentParser(
+        description="Export the model Pipeline as a memory-mapped artifact "
+                    "and measure its cold start")
+    commands = arg_parser.add_subparsers(dest='command')
+
+    export_parser = commands.add_parser('export')
+    export_parser.add_argument('pipeline_path')
+    export_parser.add_argument('artifact_dir')
+
+    measure_parser = commands.add_parser('measure')
+    measure_parser.add_argument('model_paths', nargs='+',
+                                help="Pickles and/or artifact directories")
+    measure_parser.add_argument('--workers', type=int, default=4,
+                                help="Probes alive at once (default: 4)")
+    measure_parser.add_argument('--runs', type=int, default=3)
+
+    probe_parser = commands.add_parser('probe')
+    probe_parser.add_argument('model_path')
+    return arg_parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    from sklearn.externals import joblib
+
+    args = parse_args(sys.argv[1:])
+
+    if args.command == 'export':
+        manifest = export_artifact(
+            joblib.load(args.pipeline_path), args.artifact_dir,
+            source_checksum=file_checksum(args.pipeline_path))
+        sys.stderr.write("Exported %s (%d bytes)\n" % (
+            args.artifact_dir, manifest['files'][MODEL_FILE_NAME]['size']))
+    elif args.command == 'probe':
+        probe(args.model_path)
+    else:
+        sys.stderr.write("%-40s %10s %10s %10s %10s %10s\n" % (
+            'model', 'load s', 'rss kB', 'anon kB', 'file kB', 'pss kB'))
+        for model_path in args.model_paths:
+            summary = measure(model_path, args.workers, args.runs)
+            sys.stderr.write("%-40s %10.4f %10s %10s %10s %10s\n" % (
+                model_path, summary['load_seconds'], summary['rss_kb'],
+                summary['rss_anon_kb'], summary['rss_file_kb'],
+                summary['pss_kb']))
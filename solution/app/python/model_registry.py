@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+
+from frozen_encoder import FrozenEncoder, FrozenEncoderError
+from model_artifact import MANIFEST_NAME, is_artifact, load_artifact
+
+
+logger = logging.getLogger('scoring')
+
+# Default Locations of the Pipelines (relative to the App Directory)
+ENCODER_PIPELINE_PATH = os.environ.get(
+    'ENCODER_PIPELINE_PATH', 'resources/encoder_pipeline.pkl')
+MODEL_PIPELINE_PATH = os.environ.get(
+    'MODEL_PIPELINE_PATH', 'resources/model_pipeline.pkl')
+
+# Known category that unknown catg_max_debits values are encoded as
+# (empty: unknown categories fail the prediction, as the Pipeline does)
+ENCODER_UNKNOWN_CATEGORY = os.environ.get('ENCODER_UNKNOWN_CATEGORY') or None
+
+# Whether the checksum of a memory-mapped model artifact is checked on load
+MODEL_ARTIFACT_VERIFY = os.environ.get('MODEL_ARTIFACT_VERIFY', '1') != '0'
+
+# Seconds between checks for updated Pipeline files on disk (0 disables)
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', '0'))
+
+# Feature Row used to smoke test freshly loaded Pipelines before they go live
+VALIDATION_FEATURE_ROW = [42.82, 2048.64, 42.82, 123.45, 2048.64,
+                          'Entertainment', 682]
+
+
+class ModelLoadError(Exception):
+    pass
+
+
+def _load_pipeline(path, required_methods):
+    # A directory is a memory-mapped model artifact, anything else a pickle.
+    # sklearn is imported here rather than with the module: the pickles need
+    # it anyway, and whatever only imports the service does not pay for it.
+    from sklearn.externals import joblib
+
+    try:
+        if is_artifact(path):
+            pipeline = load_artifact(path, MODEL_ARTIFACT_VERIFY)
+        else:
+            pipeline = joblib.load(path)
+    except Exception as e:
+        raise ModelLoadError("Could not load %s: %s" % (path, e))
+
+    for method in required_methods:
+        if not callable(getattr(pipeline, method, None)):
+            raise ModelLoadError("%s does not provide %s()" % (path, method))
+
+    return pipeline
+
+
+def _load_encoder(path, unknown_category):
+    # A frozen encoder (.json) is used as is. A pickled Pipeline is fitted
+    # once here and compiled to a frozen encoder when it can be, otherwise
+    # the fitted Pipeline itself serves transform().
+    if path.endswith('.json'):
+        try:
+            frozen_encoder = FrozenEncoder.load(
+                path, unknown_category=unknown_category)
+            stale_source = frozen_encoder.stale_source(path)
+        except Exception as e:
+            raise ModelLoadError("Could not load %s: %s" % (path, e))
+        # Categories compiled from an older Pipeline would silently encode
+        # differently from the one next to it
+        if stale_source:
+            raise ModelLoadError("%s was compiled from an older %s; "
+                                 "regenerate it" % (path, stale_source))
+        return frozen_encoder
+
+    encoding_pipeline = _load_pipeline(path, ['fit', 'transform'])
+    try:
+        return FrozenEncoder.from_pipeline(encoding_pipeline,
+                                           unknown_category=unknown_category)
+    except FrozenEncoderError as e:
+        logger.warning("Serving %s without compiling it: %s", path, e)
+
+    try:
+        encoding_pipeline.fit([VALIDATION_FEATURE_ROW, ])
+    except Exception as e:
+        raise ModelLoadError("Could not fit %s: %s" % (path, e))
+    return encoding_pipeline
+
+
+def _validate_pipelines(encoding_pipeline, prediction_pipeline):
+    try:
+        encoded_features = encoding_pipeline.transform(
+            [VALIDATION_FEATURE_ROW, ])
+        prediction_pipeline.predict(encoded_features)
+    except Exception as e:
+        raise ModelLoadError("Pipelines failed validation: %s" % e)
+
+
+def _modified_time(path):
+    # An artifact counts as replaced when its manifest is, which is written
+    # after the model file
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST_NAME)
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+class ModelRegistry(object):
+    # Keeps the Encoder and Model Pipelines resident in memory.
+    # Both are swapped together as one tuple, so a request always sees a
+    # consistent pair. Requests never take the lock; it only serialises
+    # loads, and the old Pipelines keep serving until the swap.
+    #
+    # With an encoder_source (the live registry, for named models) only the
+    # model is loaded here and every get() pairs it with the encoder the
+    # source serves at that moment, so features are encoded the same way
+    # for every model, reloads of the live Pipelines included.
+
+    def __init__(self, encoder_path=ENCODER_PIPELINE_PATH,
+                 model_path=MODEL_PIPELINE_PATH,
+                 reload_interval=MODEL_RELOAD_INTERVAL,
+                 unknown_category=ENCODER_UNKNOWN_CATEGORY,
+                 encoder_source=None):
+        self.encoder_path = encoder_path
+        self.model_path = model_path
+        self.reload_interval = reload_interval
+        self.unknown_category = unknown_category
+        self.encoder_source = encoder_source
+        self.version = 0
+        self.loaded_at = None
+        self._pipelines = None
+        self._modified_times = None
+        self._last_checked = 0
+        self._lock = threading.RLock()
+
+    def is_loaded(self):
+        return self._pipelines is not None
+
+    def load(self, encoder_path=None, model_path=None):
+        with self._lock:
+            encoder_path = encoder_path or self.encoder_path
+            model_path = model_path or self.model_path
+
+            if self.encoder_source is not None:
+                encoding_pipeline = self.encoder_source.get()[0]
+                encoder_path = self.encoder_source.encoder_path
+            else:
+                encoding_pipeline = _load_encoder(encoder_path,
+                                                  self.unknown_category)
+            prediction_pipeline = _load_pipeline(model_path, ['predict'])
+            _validate_pipelines(encoding_pipeline, prediction_pipeline)
+
+            self.encoder_path = encoder_path
+            self.model_path = model_path
+            self._pipelines = (encoding_pipeline, prediction_pipeline)
+            self._modified_times = (_modified_time(encoder_path),
+                                    _modified_time(model_path))
+            self._last_checked = time.time()
+            self.loaded_at = self._last_checked
+            self.version += 1
+
+        return self.describe()
+
+    def reload_if_changed(self):
+        # Picks up Pipeline files replaced on disk. Each worker process
+        # checks on its own, so every worker eventually swaps.
+        now = time.time()
+        if now - self._last_checked < self.reload_interval:
+            return False
+        self._last_checked = now
+
+        modified_times = (_modified_time(self.encoder_path),
+                          _modified_time(self.model_path))
+        if modified_times == self._modified_times:
+            return False
+
+        try:
+            self.load()
+        except ModelLoadError as e:
+            # Keep serving with the Pipelines already in memory
+            logger.warning("Model reload skipped: %s", e)
+            return False
+        return True
+
+    def get(self):
+        if self._pipelines is None:
+            with self._lock:
+                if self._pipelines is None:
+                    self.load()
+        elif self.reload_interval > 0:
+            self.reload_if_changed()
+
+        if self.encoder_source is not None:
+            return self.encoder_source.get()[0], self._pipelines[1]
+        return self._pipelines
+
+    def describe(self):
+        return {'encoder_path': (self.encoder_source.encoder_path
+                                 if self.encoder_source is not None
+                                 else self.encoder_path),
+                'model_path': self.model_path,
+                'version': self.version,
+                'loaded_at': self.loaded_at}
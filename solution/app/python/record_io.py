@@ -0,0 +1,45 @@
+import json
+from itertools import islice
+
+
+def iter_ndjson_records(lines):
+    # One applicant per line; blank lines are skipped. A line that is not
+    # valid JSON is passed through as the raw string so it can be reported
+    # as a bad record in its position instead of failing the whole stream.
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield line
+
+
+def iter_file_records(paths):
+    # JSON (a list or a single object) or NDJSON files of applicants
+    for path in paths:
+        with open(path) as input_file:
+            if path.endswith('.json'):
+                records = json.load(input_file)
+                for record in (records if isinstance(records, list)
+                               else [records]):
+                    yield record
+            else:
+                for record in iter_ndjson_records(input_file):
+                    yield record
+
+
+def iter_chunks(records, chunk_size):
+    # Only one chunk of records is held in memory at a time
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def to_ndjson(response_jsons):
+    return ''.join(json.dumps(response_json) + '\n'
+                   for response_json in response_jsons)
@@ -0,0 +1,229 @@
+import datetime as dt
+import re
+
+from feature_engine import EPOCH, _parse_post_date, is_columnar
+
+
+# Applicant Payload Schema
+# Every field the feature engine reads is checked in one pass before any
+# feature work, so a bad applicant fails fast with the path of the offending
+# field (e.g. "Transactions[3].PostDate is not a valid date") instead of a
+# KeyError from deep inside the feature engine. The checks are built once at
+# import, and per request each distinct PostDate string is checked once.
+
+try:
+    STRING_TYPES = (basestring, )
+    INTEGER_TYPES = (int, long)
+except NameError:
+    STRING_TYPES = (str, )
+    INTEGER_TYPES = (int, )
+NUMBER_TYPES = INTEGER_TYPES + (float, )
+# Exact types, which leaves out bool
+EXACT_NUMBER_TYPES = frozenset(NUMBER_TYPES)
+
+# Accepted ranges; NaN and infinities fall outside every range
+FICO_SCORE_RANGE = (0, 850)
+CURRENT_BALANCE_RANGE = (-1e12, 1e12)
+AMOUNT_RANGE = (0, 1e12)
+TRANSACTION_TYPES = frozenset(['debit', 'credit'])
+
+# Columnar PostDates that datetime can represent
+DAY_NUMBER_RANGE = ((dt.datetime.min - EPOCH).days,
+                    (dt.datetime.max - EPOCH).days)
+
+ISO_DATE_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})$')
+
+COLUMNAR_COLUMNS = ['Amount', 'Category', 'Type', 'PostDate']
+
+
+# Field Checks
+# Each returns what is wrong with the value, or None. valid_dates holds the
+# PostDate strings already accepted in this request.
+
+def _is_number(value):
+    # bool is an int subclass, but true is not a balance
+    return isinstance(value, NUMBER_TYPES) and not isinstance(value, bool)
+
+
+def number_check(value_range):
+    minimum, maximum = value_range
+    problem = "needs to be a number between %s and %s" % (
+        '{:g}'.format(minimum), '{:g}'.format(maximum))
+
+    def check(value, valid_dates):
+        if not _is_number(value) or not minimum <= value <= maximum:
+            return problem
+        return None
+    return check
+
+
+def string_check(allowed=None):
+    problem = ("needs to be one of %s" % ', '.join(sorted(allowed))
+               if allowed else "needs to be a string")
+
+    def check(value, valid_dates):
+        if not isinstance(value, STRING_TYPES):
+            return problem
+        # Types are matched case-insensitively, as the feature engine does
+        if allowed and value.lower() not in allowed:
+            return problem
+        return None
+    return check
+
+
+def post_date_check(value, valid_dates):
+    # YYYY-MM-DD is checked without strptime; other formats the feature
+    # engine accepts go through its parser
+    if not isinstance(value, STRING_TYPES):
+        return "needs to be a date string (YYYY-MM-DD)"
+    if value in valid_dates:
+        return None
+    try:
+        match = ISO_DATE_PATTERN.match(value)
+        if match:
+            dt.date(*[int(part) for part in match.groups()])
+        else:
+            _parse_post_date(value, {})
+    except Exception:
+        return "is not a valid date"
+    valid_dates.add(value)
+    return None
+
+
+def integer_check(value_range):
+    minimum, maximum = value_range
+    problem = "needs to be an integer between %d and %d" % value_range
+
+    def check(value, valid_dates):
+        if (not isinstance(value, INTEGER_TYPES) or isinstance(value, bool) or
+                not minimum <= value <= maximum):
+            return problem
+        return None
+    return check
+
+
+APPLICANT_FIELDS = [('CurrentBalance', number_check(CURRENT_BALANCE_RANGE)),
+                    ('FICOScore', number_check(FICO_SCORE_RANGE))]
+
+TRANSACTION_FIELDS = [('Amount', number_check(AMOUNT_RANGE)),
+                      ('Type', string_check(TRANSACTION_TYPES)),
+                      ('Category', string_check()),
+                      ('PostDate', post_date_check)]
+
+
+class SchemaValidator(object):
+
+    def __init__(self):
+        self.amount_check = dict(TRANSACTION_FIELDS)['Amount']
+        self.day_number_check = integer_check(DAY_NUMBER_RANGE)
+        self.value_checks = dict(
+            (column, check) for column, check in TRANSACTION_FIELDS
+            if column in ('Type', 'Category'))
+
+    def validate(self, request_json):
+        # Returns the error message for a malformed applicant, or None
+        if not isinstance(request_json, dict):
+            return "Each request needs to be a JSON object"
+
+        valid_dates = set()
+        for field, check in APPLICANT_FIELDS:
+            value = request_json.get(field)
+            if value is None:
+                return "%s is missing from Body" % field
+            problem = check(value, valid_dates)
+            if problem:
+                return "%s %s" % (field, problem)
+
+        transactions = request_json.get('Transactions')
+        if transactions is None:
+            return ("Transactions is missing from Body. If there are no "
+                    "transactions, add an empty element")
+        if is_columnar(transactions):
+            return self._validate_columnar(transactions, valid_dates)
+        if not isinstance(transactions, list):
+            return "Transactions needs to be a list element"
+        return self._validate_rows(transactions, valid_dates)
+
+    def _validate_rows(self, transactions, valid_dates):
+        # Fast path: a transaction whose Amount is a plain number in range and
+        # whose Type, Category and PostDate were already accepted costs one
+        # type test and three lookups. Anything else goes through the field
+        # checks, which also explain what is wrong.
+        amount_types = EXACT_NUMBER_TYPES
+        amount_minimum, amount_maximum = AMOUNT_RANGE
+        known_types = set()
+        known_categories = set()
+        for index, transaction in enumerate(transactions):
+            try:
+                amount = transaction['Amount']
+                if (type(amount) in amount_types and
+                        amount_minimum <= amount <= amount_maximum and
+                        transaction['Type'] in known_types and
+                        transaction['Category'] in known_categories and
+                        transaction['PostDate'] in valid_dates):
+                    continue
+            except (KeyError, TypeError, IndexError):
+                pass
+
+            if not isinstance(transaction, dict):
+                return "Transactions[%d] needs to be a JSON object" % index
+            for field, check in TRANSACTION_FIELDS:
+                value = transaction.get(field)
+                if value is None:
+                    return "Transactions[%d].%s is missing" % (index, field)
+                problem = check(value, valid_dates)
+                if problem:
+                    return "Transactions[%d].%s %s" % (index, field, problem)
+            known_types.add(transaction['Type'])
+            known_categories.add(transaction['Category'])
+        return None
+
+    def _validate_columnar(self, transactions, valid_dates):
+        if not all(column in transactions for column in COLUMNAR_COLUMNS):
+            return ("Columnar Transactions need Amount, Category, Type and "
+                    "PostDate columns")
+
+        amounts = transactions['Amount']
+        if not isinstance(amounts, list):
+            return "Transactions.Amount needs to be a list"
+        problem = (self._validate_column('Transactions.Amount', amounts,
+                                         self.amount_check, valid_dates) or
+                   self._validate_column('Transactions.PostDate',
+                                         transactions['PostDate'],
+                                         self.day_number_check, valid_dates,
+                                         len(amounts)))
+        if problem:
+            return problem
+
+        for column in ['Type', 'Category']:
+            problem = self._validate_coded_column(
+                column, transactions[column], len(amounts), valid_dates)
+            if problem:
+                return problem
+        return None
+
+    def _validate_column(self, path, values, check, valid_dates,
+                         length=None):
+        if not isinstance(values, list):
+            return "%s needs to be a list" % path
+        if length is not None and len(values) != length:
+            return "%s needs one value per Amount" % path
+        for index, value in enumerate(values):
+            problem = check(value, valid_dates)
+            if problem:
+                return "%s[%d] %s" % (path, index, problem)
+        return None
+
+    def _validate_coded_column(self, column, coded, length, valid_dates):
+        path = 'Transactions.%s' % column
+        if not isinstance(coded, dict) or not isinstance(
+                coded.get('values'), list):
+            return "%s needs values and codes lists" % path
+
+        code_check = integer_check((0, len(coded['values']) - 1))
+        return (self._validate_column(path + '.values', coded['values'],
+                                      self.value_checks[column],
+                                      valid_dates) or
+                self._validate_column(path + '.codes', coded.get('codes'),
+                                      code_check,
+                                      valid_dates, length))
@@ -0,0 +1,103 @@
+import json
+
+
+# Response Formats
+# Chosen per request with ?format= (or for all requests with
+# RESPONSE_FORMAT):
+# - default: one object per applicant with the prediction as a string,
+#   serialized by jsonify exactly as the service always has
+# - numeric: the same objects with numeric predictions, serialized by the
+#   plain C JSON encoder (no key sorting, no indentation)
+# - compact: batches as parallel arrays, with the failed applicants listed
+#   separately:
+#     {"UserID": ["a", "b"], "prediction": [1, null],
+#      "errors": [{"index": 1, "error_code": 400, "error_message": "..."}]}
+#   A single applicant gets the numeric object.
+RESPONSE_FORMATS = ('default', 'numeric', 'compact')
+
+COMPACT_SEPARATORS = (',', ':')
+
+
+def prediction_texts(predictions):
+    # str() of every prediction in a predict() result. Integer and boolean
+    # labels go through tolist() first, which gives the same text several
+    # times faster than str() of each numpy scalar; floats keep numpy's own
+    # formatting, which Python 2's str(float) would round.
+    if predictions.dtype.kind in 'iub':
+        return [str(prediction) for prediction in predictions.tolist()]
+    return [str(prediction) for prediction in predictions]
+
+
+def numeric_prediction(text, parsed):
+    # Predictions are carried as text through the cache, the coalescer and
+    # the job results; each distinct text is converted once per response.
+    # Labels that are not numbers stay strings.
+    try:
+        return parsed[text]
+    except KeyError:
+        pass
+    try:
+        value = int(text)
+    except (TypeError, ValueError):
+        try:
+            value = float(text)
+        except (TypeError, ValueError):
+            value = text
+    parsed[text] = value
+    return value
+
+
+def numeric_response(response_json, parsed=None):
+    if 'prediction' not in response_json:
+        return response_json
+    numeric_json = dict(response_json)
+    numeric_json['prediction'] = numeric_prediction(
+        response_json['prediction'], {} if parsed is None else parsed)
+    return numeric_json
+
+
+def numeric_responses(response_jsons):
+    parsed = {}
+    return [numeric_response(response_json, parsed)
+            for response_json in response_jsons]
+
+
+def compact_responses(response_jsons):
+    parsed = {}
+    user_ids = []
+    predictions = []
+    errors = []
+    for index, response_json in enumerate(response_jsons):
+        user_ids.append(response_json.get('UserID'))
+        if 'prediction' in response_json:
+            predictions.append(numeric_prediction(
+                response_json['prediction'], parsed))
+        else:
+            predictions.append(None)
+            errors.append({'index': index,
+                           'error_code': response_json.get('error_code'),
+                           'error_message': response_json.get(
+                               'error_message')})
+    return {'UserID': user_ids, 'prediction': predictions, 'errors': errors}
+
+
+def format_response(response_json, response_format):
+    # A single response (dict) or a batch (list) in the given format
+    if response_format == 'default':
+        return response_json
+    if isinstance(response_json, dict):
+        return numeric_response(response_json)
+    if response_format == 'compact':
+        return compact_responses(response_json)
+    return numeric_responses(response_json)
+
+
+def format_records(response_jsons, response_format):
+    # One object per applicant, for NDJSON streams
+    if response_format == 'default':
+        return response_jsons
+    return numeric_responses(response_jsons)
+
+
+def encode_json(payload):
+    return json.dumps(payload, separators=COMPACT_SEPARATORS)
@@ -0,0 +1,426 @@
+import errno
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from record_io import iter_chunks, iter_ndjson_records, to_ndjson
+
+
+logger = logging.getLogger('scoring')
+
+# Asynchronous Scoring Jobs
+# A job is a directory on local disk:
+#   status.json           state, progress and timestamps
+#   input-000000.ndjson   the submitted applicants, one file per chunk
+#   result-000000.ndjson  one result line per applicant, one file per chunk
+#   claim                 owner (host:pid) of a running job
+#   status.lock           held while status.json is read and rewritten
+# Every file is written to a temporary name and renamed, so a runner killed
+# halfway leaves whole chunks behind. A job whose owner has died is picked
+# up again and resumes at its first chunk without results.
+#
+# Runners either run in their own processes (python python/scoring_jobs.py,
+# started by gunicorn_conf.py, each restarting its runner whenever it dies)
+# or as threads in the web workers.
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class JobNotFound(Exception):
+    pass
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobTooLarge(Exception):
+    pass
+
+
+def _write_file(path, data):
+    temporary_path = '%s.tmp-%d-%d' % (path, os.getpid(),
+                                       threading.current_thread().ident)
+    with open(temporary_path, 'w') as output_file:
+        output_file.write(data)
+    os.rename(temporary_path, path)
+
+
+def _process_alive(owner):
+    host, _, pid = owner.partition(':')
+    if host != socket.gethostname():
+        # Only owners on this host can be checked
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    except ValueError:
+        return False
+    return True
+
+
+class JobStore(object):
+
+    def __init__(self, root, chunk_size=500, max_queued=100,
+                 max_records=1000000):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.max_queued = max_queued
+        self.max_records = max_records
+
+    def _job_dir(self, job_id):
+        if not JOB_ID_PATTERN.match(job_id or ''):
+            raise JobNotFound(job_id)
+        return os.path.join(self.root, job_id)
+
+    def _chunk_path(self, job_id, kind, number):
+        return os.path.join(self._job_dir(job_id),
+                            '%s-%06d.ndjson' % (kind, number))
+
+    def job_ids(self):
+        if not os.path.isdir(self.root):
+            return []
+        return [name for name in os.listdir(self.root)
+                if JOB_ID_PATTERN.match(name)]
+
+    def status(self, job_id):
+        try:
+            with open(os.path.join(self._job_dir(job_id),
+                                   'status.json')) as status_file:
+                return json.load(status_file)
+        except (IOError, OSError, ValueError):
+            raise JobNotFound(job_id)
+
+    def _save_status(self, job_id, status):
+        _write_file(os.path.join(self._job_dir(job_id), 'status.json'),
+                    json.dumps(status))
+
+    @contextmanager
+    def _status_lock(self, job_id):
+        # Every read-modify-write of status.json holds an exclusive lock, so
+        # progress from the running runner and a requeue by recover() in
+        # another process cannot overwrite each other
+        try:
+            lock_fd = os.open(os.path.join(self._job_dir(job_id),
+                                           'status.lock'),
+                              os.O_CREAT | os.O_RDWR)
+        except OSError:
+            raise JobNotFound(job_id)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(lock_fd)
+
+    def update_status(self, job_id, **changes):
+        with self._status_lock(job_id):
+            status = self.status(job_id)
+            status.update(changes)
+            self._save_status(job_id, status)
+        return status
+
+    def active_count(self):
+        count = 0
+        for job_id in self.job_ids():
+            try:
+                if self.status(job_id)['state'] in (QUEUED, RUNNING):
+                    count += 1
+            except JobNotFound:
+                pass
+        return count
+
+    def create(self, records):
+        # The applicants are written to disk chunk by chunk as they are read,
+        # and the job only becomes visible once all of them are there
+        if self.active_count() >= self.max_queued:
+            raise JobQueueFull("%d jobs are already queued or running" %
+                               self.max_queued)
+
+        job_id = uuid.uuid4().hex
+        partial_dir = os.path.join(self.root, '.partial-' + job_id)
+        os.makedirs(partial_dir)
+        try:
+            total = 0
+            chunks = 0
+            for chunk in iter_chunks(records, self.chunk_size):
+                total += len(chunk)
+                if total > self.max_records:
+                    raise JobTooLarge("Jobs take at most %d applicants" %
+                                      self.max_records)
+                _write_file(os.path.join(partial_dir,
+                                         'input-%06d.ndjson' % chunks),
+                            to_ndjson(chunk))
+                chunks += 1
+
+            status = {'job_id': job_id, 'state': QUEUED, 'total': total,
+                      'completed': 0, 'chunks': chunks,
+                      'chunk_size': self.chunk_size,
+                      'created_at': time.time(), 'started_at': None,
+                      'finished_at': None, 'error': None}
+            _write_file(os.path.join(partial_dir, 'status.json'),
+                        json.dumps(status))
+            os.rename(partial_dir, os.path.join(self.root, job_id))
+        except BaseException:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            raise
+        return status
+
+    def read_chunk(self, job_id, kind, number):
+        with open(self._chunk_path(job_id, kind, number)) as chunk_file:
+            return list(iter_ndjson_records(chunk_file))
+
+    def write_results(self, job_id, number, response_jsons):
+        _write_file(self._chunk_path(job_id, 'result', number),
+                    to_ndjson(response_jsons))
+
+    def has_results(self, job_id, number):
+        return os.path.exists(self._chunk_path(job_id, 'result', number))
+
+    def results(self, job_id, offset, limit):
+        # Results of completed chunks only; a page never waits for a chunk
+        status = self.status(job_id)
+        chunk_size = status['chunk_size']
+        page = []
+        number = offset // chunk_size
+        skip = offset % chunk_size
+        while len(page) < limit and number < status['chunks'] and (
+                self.has_results(job_id, number)):
+            chunk = self.read_chunk(job_id, 'result', number)
+            page.extend(chunk[skip:skip + limit - len(page)])
+            number += 1
+            skip = 0
+        return status, page
+
+    # Claims
+    # Creating the claim file with O_EXCL is atomic, so only one runner, in
+    # any process on the host, gets to run a job.
+
+    def claim(self, job_id, owner):
+        try:
+            claim_fd = os.open(os.path.join(self._job_dir(job_id), 'claim'),
+                               os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return False
+            raise
+        os.write(claim_fd, owner.encode('utf-8'))
+        os.close(claim_fd)
+        return True
+
+    def release(self, job_id):
+        try:
+            os.remove(os.path.join(self._job_dir(job_id), 'claim'))
+        except OSError:
+            pass
+
+    def claim_owner(self, job_id):
+        try:
+            with open(os.path.join(self._job_dir(job_id),
+                                   'claim')) as claim_file:
+                return claim_file.read()
+        except (IOError, OSError):
+            return None
+
+    def recover(self):
+        # Jobs of runners that are gone queue up again and resume where they
+        # stopped. The owner is checked again under the status lock, and
+        # only a dead owner's claim is dropped: a live runner's claim cannot
+        # be replaced while it exists, so its job is never requeued.
+        for job_id in self.job_ids():
+            owner = self.claim_owner(job_id)
+            if owner is not None and _process_alive(owner):
+                continue
+            try:
+                with self._status_lock(job_id):
+                    owner = self.claim_owner(job_id)
+                    if owner is not None and _process_alive(owner):
+                        continue
+                    status = self.status(job_id)
+                    if owner is None and status['state'] != RUNNING:
+                        continue
+
+                    logger.warning("Requeueing scoring job %s of runner %s",
+                                   job_id, owner)
+                    status['state'] = QUEUED
+                    self._save_status(job_id, status)
+                    if owner is not None:
+                        self.release(job_id)
+            except JobNotFound:
+                continue
+
+    def expire(self, max_age):
+        now = time.time()
+        for job_id in self.job_ids():
+            try:
+                status = self.status(job_id)
+            except JobNotFound:
+                continue
+            if status['state'] in (DONE, FAILED) and (
+                    now - (status['finished_at'] or now) > max_age):
+                shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+
+    def queued_job_ids(self):
+        statuses = []
+        for job_id in self.job_ids():
+            try:
+                statuses.append(self.status(job_id))
+            except JobNotFound:
+                continue
+        return [status['job_id'] for status in sorted(
+            statuses, key=lambda status: status['created_at'])
+            if status['state'] == QUEUED]
+
+
+class JobRunner(object):
+    # Takes queued jobs oldest first and scores them a chunk at a time with
+    # score_batch (main.process_batch_request), which returns one response
+    # per applicant and reports bad applicants in their own slot
+
+    def __init__(self, store, score_batch, concurrency=1, poll_interval=1.0,
+                 retention_seconds=7 * 24 * 3600):
+        self.store = store
+        self.score_batch = score_batch
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._worker_pid = None
+
+    @property
+    def owner(self):
+        return '%s:%d' % (socket.gethostname(), os.getpid())
+
+    def run_job(self, job_id):
+        status = self.store.update_status(job_id, state=RUNNING,
+                                          started_at=time.time())
+        try:
+            for number in range(status['chunks']):
+                if self.store.has_results(job_id, number):
+                    continue
+                response_jsons = self.score_batch(
+                    self.store.read_chunk(job_id, 'input', number))
+                self.store.write_results(job_id, number, response_jsons)
+                status = self.store.update_status(
+                    job_id, completed=min(status['total'],
+                                          (number + 1) * status['chunk_size']))
+            self.store.update_status(job_id, state=DONE,
+                                     finished_at=time.time())
+        except Exception as e:
+            logger.exception("Scoring job %s failed", job_id)
+            self.store.update_status(job_id, state=FAILED, error=str(e),
+                                     finished_at=time.time())
+        finally:
+            self.store.release(job_id)
+
+    def run_once(self):
+        # Runs the oldest job this runner can claim; False when there is none
+        self.store.recover()
+        for job_id in self.store.queued_job_ids():
+            if self.store.claim(job_id, self.owner):
+                self.run_job(job_id)
+                return True
+        return False
+
+    def run_forever(self):
+        while True:
+            try:
+                if not self.run_once():
+                    self.store.expire(self.retention_seconds)
+                    time.sleep(self.poll_interval)
+            except Exception:
+                logger.exception("Scoring job runner error")
+                time.sleep(self.poll_interval)
+
+    def ensure_started(self):
+        # Runner threads are started lazily and once per process, so forked
+        # web workers each get their own
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid != os.getpid():
+                for number in range(self.concurrency):
+                    worker = threading.Thread(
+                        target=self.run_forever,
+                        name='scoring-job-runner-%d' % number)
+                    worker.daemon = True
+                    worker.start()
+                self._worker_pid = os.getpid()
+
+
+def supervise(run, restart_delay=5.0):
+    # Runs run() in a forked child and starts another whenever it exits
+    # (crash, OOM kill), until SIGTERM or SIGINT, which is passed on. The
+    # supervisor itself imports nothing heavy, so it is not what the OOM
+    # killer picks; the new child requeues the dead one's job on its own.
+    state = {'pid': None, 'stopping': False}
+
+    def stop(signum, frame):
+        state['stopping'] = True
+        if state['pid'] is not None:
+            try:
+                os.kill(state['pid'], signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while not state['stopping']:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                run()
+            except BaseException:
+                logger.exception("Scoring job runner stopped")
+            finally:
+                os._exit(1)
+
+        state['pid'] = pid
+        # A signal between the fork and here found no child to pass on to
+        if state['stopping']:
+            os.kill(pid, signal.SIGTERM)
+        while True:
+            try:
+                _, exit_status = os.waitpid(pid, 0)
+                break
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+        state['pid'] = None
+
+        if not state['stopping']:
+            logger.warning("Scoring job runner %d exited (status %d), "
+                           "starting another", pid, exit_status)
+            time.sleep(restart_delay)
+
+
+def run_runner_process():
+    # Standalone runner; runs one job at a time
+    import main
+
+    main.model_registry.load()
+    sys.stderr.write("Scoring job runner %s watching %s\n" % (
+        main.job_runner.owner, main.job_store.root))
+    main.job_runner.run_forever()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    supervise(run_runner_process)
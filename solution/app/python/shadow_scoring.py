@@ -0,0 +1,147 @@
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+shadow_logger = logging.getLogger('scoring.shadow')
+
+
+def parse_named_models(value):
+    # "candidate=resources/model_v2.pkl,challenger=resources/model_artifact"
+    named_models = collections.OrderedDict()
+    for entry in (value or '').split(','):
+        if not entry.strip():
+            continue
+        name, _, path = entry.partition('=')
+        if not name.strip() or not path.strip():
+            raise ValueError("Named models look like name=path, not %r" %
+                             entry)
+        named_models[name.strip()] = path.strip()
+    return named_models
+
+
+def parse_model_names(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+class ShadowScorer(object):
+    # Mirrors live traffic to shadow models. The Feature JSONs already built
+    # for the live model are handed over as they are, so features are never
+    # computed twice, and scored on a thread pool after the response has been
+    # prepared. One record per applicant and shadow model is written to
+    # log_path (NDJSON) or, without one, to the 'scoring.shadow' logger.
+    # score_batch(model_name, feature_jsons) returns one prediction (or
+    # Exception) per Feature JSON, like main.generate_batch_predictions.
+    # Beyond max_pending waiting applicants new work is dropped and counted,
+    # so shadow models can never slow the live path down.
+
+    def __init__(self, score_batch, model_names, threads=2, max_pending=1000,
+                 log_path=None):
+        self.score_batch = score_batch
+        self.model_names = list(model_names)
+        self.threads = threads
+        self.max_pending = max_pending
+        self.log_path = log_path
+        self.submitted = 0
+        self.dropped = 0
+        self.failed = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._all_done = threading.Condition(self._lock)
+        self._log_lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    @property
+    def enabled(self):
+        return bool(self.model_names)
+
+    def _get_executor(self):
+        # Created lazily and once per process, so forked workers each get
+        # their own threads
+        if self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.threads)
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def submit(self, live_model, user_ids, feature_jsons, predictions):
+        if not self.enabled or not feature_jsons:
+            return False
+        with self._lock:
+            if self._pending + len(feature_jsons) > self.max_pending:
+                self.dropped += len(feature_jsons)
+                return False
+            self._pending += len(feature_jsons)
+            self.submitted += len(feature_jsons)
+            executor = self._get_executor()
+        executor.submit(self._score, live_model, list(user_ids),
+                        list(feature_jsons), list(predictions))
+        return True
+
+    def _score(self, live_model, user_ids, feature_jsons, live_predictions):
+        try:
+            records = []
+            for model_name in self.model_names:
+                try:
+                    shadow_predictions = self.score_batch(model_name,
+                                                          feature_jsons)
+                except Exception as e:
+                    shadow_predictions = [e] * len(feature_jsons)
+                for user_id, feature_json, live_prediction, prediction in zip(
+                        user_ids, feature_jsons, live_predictions,
+                        shadow_predictions):
+                    record = {'timestamp': time.time(), 'UserID': user_id,
+                              'features': feature_json,
+                              'live_model': live_model,
+                              'live_prediction': live_prediction,
+                              'shadow_model': model_name}
+                    if isinstance(prediction, Exception):
+                        record['error'] = repr(prediction)
+                        with self._lock:
+                            self.failed += 1
+                    else:
+                        record['prediction'] = prediction
+                    records.append(record)
+            self._write(records)
+        except Exception:
+            shadow_logger.exception("Shadow scoring failed")
+        finally:
+            with self._lock:
+                self._pending -= len(feature_jsons)
+                self._all_done.notify_all()
+
+    def _write(self, records):
+        lines = ''.join(json.dumps(record) + '\n' for record in records)
+        if not self.log_path:
+            for line in lines.splitlines():
+                shadow_logger.info(line)
+            return
+        # One append per batch, so lines of concurrent writers do not mix
+        with self._log_lock:
+            with open(self.log_path, 'a') as log_file:
+                log_file.write(lines)
+
+    def drain(self, timeout=None):
+        # Waits until all submitted work is logged; False on timeout
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while self._pending:
+                remaining = (None if deadline is None
+                             else deadline - time.time())
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._all_done.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {'shadow_models': self.model_names,
+                    'pending': self._pending,
+                    'submitted': self.submitted,
+                    'dropped': self.dropped,
+                    'failed': self.failed}
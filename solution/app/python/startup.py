@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# Startup Timing
+# How long a process took from exec to importing the service, loading the
+# models and warming up, served on GET /ready and /metrics. Under gunicorn
+# the master does all of this before forking, so the workers report the
+# master's startup.
+#
+# Cold Start Measurement
+# Each run is a fresh interpreter that imports the service, loads the models
+# (with the warm-up when WARMUP_ON_START is set) and sends two requests
+# through the app; the medians can be saved and compared like benchmarks:
+#
+#   cd solution/app
+#   python python/startup.py --runs 5 --save startup_baseline.json
+#   python python/startup.py --runs 5 --compare startup_baseline.json
+
+def process_started_at():
+    # exec time of this process from /proc (to 10ms), or None elsewhere
+    try:
+        with open('/proc/self/stat') as stat_file:
+            start_ticks = int(stat_file.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return time.time() - (uptime - start_ticks /
+                          float(os.sysconf('SC_CLK_TCK')))
+
+
+class StartupTimer(object):
+    # Created at the end of main's imports, so 'import' covers the
+    # interpreter start and every module import before it
+
+    def __init__(self):
+        self.started_at = process_started_at()
+        self.stages = OrderedDict()
+        self.ready_at = None
+        if self.started_at is not None:
+            self.stages['import'] = time.time() - self.started_at
+
+    @contextmanager
+    def stage(self, name):
+        stage_started = time.time()
+        yield
+        self.stages[name] = time.time() - stage_started
+
+    def mark_ready(self):
+        self.ready_at = time.time()
+
+    @property
+    def is_ready(self):
+        return self.ready_at is not None
+
+    def seconds_to_ready(self):
+        if self.ready_at is None or self.started_at is None:
+            return None
+        return self.ready_at - self.started_at
+
+    def describe(self):
+        return {'started_at': self.started_at,
+                'ready_at': self.ready_at,
+                'seconds_to_ready': self.seconds_to_ready(),
+                'stages': dict(self.stages)}
+
+
+def probe():
+    import_started = time.time()
+    import main
+    result = {'import_seconds': time.time() - import_started}
+
+    load_started = time.time()
+    main.load_models()
+    result['load_models_seconds'] = time.time() - load_started
+    result['seconds_to_ready'] = main.startup_timer.seconds_to_ready()
+
+    # Two different applicants, so the second is not a feature cache hit
+    client = main.app.test_client()
+    for fico_score, name in [(682, 'first_request_seconds'),
+                             (683, 'second_request_seconds')]:
+        request_body = json.dumps(dict(main.warmup_applicant(),
+                                       FICOScore=fico_score))
+        request_started = time.time()
+        response = client.post('/predictions', data=request_body,
+                               content_type='application/json')
+        result[name] = time.time() - request_started
+        if response.status_code != 200:
+            raise RuntimeError("Probe request failed: %s" % response.data)
+    sys.stdout.write(json.dumps(result) + '\n')
+
+
+def _median(values):
+    values = sorted(value for value in values if value is not None)
+    return values[len(values) // 2] if values else None
+
+
+def measure(runs=5):
+    # One probe at a time, so they do not compete for the CPU
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-W', 'ignore', os.path.abspath(__file__),
+             '--probe'])
+        samples.append(json.loads(output.decode('utf-8').splitlines()[-1]))
+
+    # Same layout as the benchmark results, so baselines compare alike
+    results = {}
+    for name, key in [('to_ready', 'seconds_to_ready'),
+                      ('import', 'import_seconds'),
+                      ('load_models', 'load_models_seconds'),
+                      ('first_request', 'first_request_seconds'),
+                      ('second_request', 'second_request_seconds')]:
+        median = _median(sample[key] for sample in samples)
+        if median is not None:
+            results[name] = {'p50_ms': median * 1000, 'runs': len(samples)}
+    return results
+
+
+def parse_args(argv):
+    arg_parser = argparse.ArgumentParser(
+        description="Measure the cold start of the scoring service")
+    arg_parser.add_argument('--runs', type=int, default=5)
+    arg_parser.add_argument('--save', help="Write results to this JSON file")
+    arg_parser.add_argument('--compare',
+                            help="Baseline JSON file to check against")
+    arg_parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Allowed slow down (default: 0.2)")
+    arg_parser.add_argument('--probe', action='store_true',
+                            help=argparse.SUPPRESS)
+    return arg_parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    if args.probe:
+        probe()
+        sys.exit(0)
+
+    results = measure(args.runs)
+    for name in ['to_ready', 'import', 'load_models', 'first_request',
+                 'second_request']:
+        if name in results:
+            sys.stderr.write("%-20s %10.1fms\n" % (
+                name, results[name]['p50_ms']))
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        from benchmarks import compare_to_baseline
+
+        with open(args.compare) as baseline_file:
+            regressions = compare_to_baseline(
+                results, json.load(baseline_file), args.tolerance)
+        for name, ratio in sorted(regressions.items()):
+            sys.stderr.write("REGRESSION %s: %.2fx the baseline\n" % (
+                name, ratio))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from balance_state import (InMemoryBalanceStore, SQLiteBalanceStore,
+                           apply_transactions, state_to_feature_json)
+from main import raw_data_to_feature_tuple
+from test_feature_engine import SCENARIOS, _transaction
+
+
+@pytest.mark.parametrize('request_json', SCENARIOS,
+                         ids=[s['UserID'] for s in SCENARIOS])
+def test_incremental_features_match_full_history(request_json):
+    transactions = request_json['Transactions']
+    split = len(transactions) // 2
+
+    state = apply_transactions(None, transactions[:split])
+    state = apply_transactions(state, transactions[split:])
+
+    assert (state_to_feature_json(state, request_json['CurrentBalance'],
+                                  request_json['FICOScore']) ==
+            raw_data_to_feature_tuple(request_json))
+
+
+def test_apply_transactions_skips_resent_and_prunes_old_days():
+    new_transaction = _transaction(10.0, "XXX-02", "debit", 1)
+    new_transaction['TransactionID'] = "new"
+    old_transaction = _transaction(20.0, "XXX-03", "debit", 45)
+    old_transaction['TransactionID'] = "old"
+
+    state = apply_transactions(None, [new_transaction, old_transaction])
+    state = apply_transactions(state, [new_transaction])
+
+    assert len(state['days']) == 1
+    assert list(state['days'].values())[0]['types'] == {
+        'debit': [10.0, 10.0]}
+    assert state['max_debit'] == [20.0, "XXX-03"]
+
+
+@pytest.mark.parametrize('store_type', ['memory', 'sqlite'])
+def test_balance_stores_persist_updates(store_type, tmpdir):
+    store = (InMemoryBalanceStore() if store_type == 'memory' else
+             SQLiteBalanceStore(str(tmpdir.join('state.sqlite3'))))
+    transactions = [_transaction(10.0, "XXX-02", "debit", 1)]
+
+    store.update("user-0", lambda state: apply_transactions(state,
+                                                            transactions))
+
+    assert (store.get("user-0") ==
+            json.loads(json.dumps(apply_transactions(None, transactions))))
+    assert store.get("user-1") is None
+
+
+def test_predictions_incremental_scores_from_stored_state(client, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'balance_state_store', InMemoryBalanceStore())
+    request_json = SCENARIOS[0]
+    first_call = dict(request_json,
+                      Transactions=request_json['Transactions'][:2])
+    second_call = dict(request_json,
+                       Transactions=request_json['Transactions'][2:])
+
+    client.post('/predictions/incremental', data=json.dumps(first_call),
+                content_type='application/json')
+    incremental_response = client.post('/predictions/incremental',
+                                       data=json.dumps(second_call),
+                                       content_type='application/json')
+    full_response = client.post('/predictions',
+                                data=json.dumps(request_json),
+                                content_type='application/json')
+
+    assert incremental_response.status_code == 200
+    assert (json.loads(incremental_response.data) ==
+            json.loads(full_response.data))
@@ -0,0 +1,33 @@
+from benchmarks import compare_to_baseline, synthetic_applicant, time_case
+from main import validate_request
+from feature_engine import single_pass_feature_tuple
+
+
+def test_synthetic_applicant_is_a_valid_request():
+    applicant = synthetic_applicant(50, category_count=3, date_spread_days=10)
+
+    assert validate_request(applicant) is None
+    assert len(applicant['Transactions']) == 50
+    assert len(set(t['Category'] for t in applicant['Transactions'])) <= 3
+    assert synthetic_applicant(50, category_count=3,
+                               date_spread_days=10) == applicant
+    assert single_pass_feature_tuple(applicant)['fico_score'] == (
+        applicant['FICOScore'])
+
+
+def test_time_case_reports_latency_percentiles():
+    result = time_case(lambda: None, records_per_call=10, min_runs=5,
+                       max_runs=20, max_seconds=0.01)
+
+    assert 5 <= result['runs'] <= 20
+    assert result['p50_ms'] <= result['p95_ms'] <= result['p99_ms']
+    assert result['records_per_second'] > 0
+
+
+def test_compare_to_baseline_flags_slower_cases():
+    baseline = {'fast': {'p50_ms': 10.0}, 'slow': {'p50_ms': 10.0},
+                'removed': {'p50_ms': 10.0}}
+    results = {'fast': {'p50_ms': 11.0}, 'slow': {'p50_ms': 15.0}}
+
+    assert compare_to_baseline(results, baseline, tolerance=0.2) == {
+        'slow': 1.5}
@@ -0,0 +1,36 @@
+import json
+
+import main
+from bulk_score import bulk_score, parse_args
+from test_main import _sample_request
+
+
+def test_bulk_score_writes_results_in_input_order(model_paths, tmpdir):
+    encoder_path, model_path = model_paths
+
+    json_path = tmpdir.join('applicants.json')
+    json_path.write(json.dumps([_sample_request("user-0"),
+                                _sample_request("user-1")]))
+    ndjson_path = tmpdir.join('applicants.ndjson')
+    ndjson_path.write('\n'.join(json.dumps(_sample_request("user-%d" % i))
+                                for i in range(2, 7)))
+    output_path = tmpdir.join('results.ndjson')
+
+    summary = bulk_score([str(json_path), str(ndjson_path)], str(output_path),
+                         processes=2, chunk_size=2,
+                         encoder_path=encoder_path, model_path=model_path)
+    results = [json.loads(line) for line in output_path.readlines()]
+
+    assert summary['records'] == 7
+    assert summary['errors'] == 0
+    assert summary['records_per_second'] > 0
+    assert [result['UserID'] for result in results] == [
+        "user-%d" % i for i in range(7)]
+    assert all('prediction' in result for result in results)
+
+
+def test_bulk_score_takes_every_feature_engine_of_the_service():
+    for feature_engine in main.FEATURE_ENGINES:
+        args = parse_args(['applicants.ndjson', '--output', 'results.ndjson',
+                           '--feature-engine', feature_engine])
+        assert args.feature_engine == feature_engine
@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from coalescer import CoalescerTimeout, PredictionCoalescer
+
+
+def _submit_concurrently(coalescer, feature_jsons):
+    results = [None] * len(feature_jsons)
+
+    def submit(position):
+        try:
+            results[position] = coalescer.submit(feature_jsons[position])
+        except Exception as e:
+            results[position] = e
+
+    threads = [threading.Thread(target=submit, args=(position, ))
+               for position in range(len(feature_jsons))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_prediction_coalescer_batches_concurrent_requests():
+    scored_batches = []
+
+    def score_batch(feature_jsons):
+        scored_batches.append(len(feature_jsons))
+        return [str(feature_json['fico_score'])
+                for feature_json in feature_jsons]
+
+    coalescer = PredictionCoalescer(score_batch, max_wait_ms=200,
+                                    max_batch_size=4)
+    results = _submit_concurrently(
+        coalescer, [{'fico_score': score} for score in range(8)])
+
+    assert results == [str(score) for score in range(8)]
+    assert sum(scored_batches) == 8
+    assert max(scored_batches) <= 4
+    assert len(scored_batches) < 8
+    assert coalescer.stats()['batches'] == len(scored_batches)
+
+
+def test_prediction_coalescer_returns_errors_to_their_caller():
+    def score_batch(feature_jsons):
+        return [ValueError("bad row") if feature_json['fico_score'] < 0
+                else 'ok' for feature_json in feature_jsons]
+
+    coalescer = PredictionCoalescer(score_batch, max_wait_ms=50,
+                                    max_batch_size=8)
+
+    assert coalescer.submit({'fico_score': 1}) == 'ok'
+    with pytest.raises(ValueError):
+        coalescer.submit({'fico_score': -1})
+
+
+def test_prediction_coalescer_fails_short_batches_and_keeps_running():
+    def score_batch(feature_jsons):
+        if feature_jsons[0]['fico_score'] < 0:
+            return []
+        return ['ok'] * len(feature_jsons)
+
+    coalescer = PredictionCoalescer(score_batch, max_wait_ms=1,
+                                    max_batch_size=8, result_timeout=5)
+
+    with pytest.raises(ValueError):
+        coalescer.submit({'fico_score': -1})
+    assert coalescer.submit({'fico_score': 1}) == 'ok'
+
+
+def test_prediction_coalescer_times_out_waiting_callers():
+    release = threading.Event()
+
+    def score_batch(feature_jsons):
+        release.wait()
+        return ['late'] * len(feature_jsons)
+
+    coalescer = PredictionCoalescer(score_batch, max_wait_ms=1,
+                                    max_batch_size=8, result_timeout=0.05)
+
+    with pytest.raises(CoalescerTimeout):
+        coalescer.submit({'fico_score': 1})
+    release.set()
@@ -0,0 +1,61 @@
+import copy
+import datetime as dt
+import json
+
+from feature_cache import FeatureCache, payload_cache_key
+from test_main import _sample_request
+
+
+def test_payload_cache_key_ignores_transaction_and_user_ids():
+    request_json = _sample_request("user-0")
+    resubmitted_json = copy.deepcopy(request_json)
+    resubmitted_json['UserID'] = "user-1"
+    resubmitted_json['Transactions'][0]['TransactionID'] = "another-id"
+    changed_json = copy.deepcopy(request_json)
+    changed_json['Transactions'][0]['Amount'] = 1.0
+
+    assert (payload_cache_key(request_json) ==
+            payload_cache_key(resubmitted_json))
+    assert (payload_cache_key(request_json) !=
+            payload_cache_key(changed_json))
+
+
+def test_feature_cache_evicts_least_recently_used():
+    feature_cache = FeatureCache(max_size=2)
+    feature_cache.put('a', 1)
+    feature_cache.put('b', 2)
+    feature_cache.get('a')
+    feature_cache.put('c', 3)
+
+    assert feature_cache.get('b') is None
+    assert feature_cache.get('a') == 1
+    assert feature_cache.get('c') == 3
+    assert feature_cache.stats()['evictions'] == 1
+    assert feature_cache.stats()['hits'] == 3
+    assert feature_cache.stats()['misses'] == 1
+
+
+def test_feature_cache_expires_when_window_moves():
+    feature_cache = FeatureCache()
+    feature_cache.put('a', 1)
+
+    # Pretend the entry was stored yesterday
+    value, expires_at = feature_cache._entries['a']
+    feature_cache._entries['a'] = (value, expires_at - dt.timedelta(days=1))
+
+    assert feature_cache.get('a') is None
+    assert feature_cache.stats()['expirations'] == 1
+
+
+def test_predictions_are_served_from_cache(client):
+    request_body = json.dumps(_sample_request("user-0"))
+
+    first_response = client.post('/predictions', data=request_body,
+                                 content_type='application/json')
+    second_response = client.post('/predictions', data=request_body,
+                                  content_type='application/json')
+    cache_stats = json.loads(client.get('/cache/stats').data)
+
+    assert first_response.data == second_response.data
+    assert cache_stats['hits'] == 1
+    assert cache_stats['misses'] == 1
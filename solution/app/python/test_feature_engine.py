@@ -0,0 +1,109 @@
+import datetime as dt
+import random
+import uuid
+
+import pytest
+
+from feature_engine import (ProcessingTimeExceeded, prefilter_window_rows,
+                            single_pass_feature_tuple,
+                            to_columnar_transactions)
+from main import raw_data_to_feature_tuple, _get_date_only
+
+
+def _days_ago(days):
+    return (_get_date_only() - dt.timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def _transaction(amount, category, transaction_type, days_ago):
+    return {"TransactionID": str(uuid.uuid4()),
+            "Amount":        amount,
+            "Category":      category,
+            "Type":          transaction_type,
+            "PostDate":      _days_ago(days_ago)}
+
+
+def _random_request(seed):
+    generator = random.Random(seed)
+    transactions = [
+        _transaction(round(generator.uniform(0.01, 5000), 2),
+                     generator.choice(["Deposits", "Entertainment",
+                                       "XXX-02", "XXX-44"]),
+                     generator.choice(["debit", "credit", "Debit"]),
+                     generator.randint(-2, 60))
+        for _ in range(generator.randint(1, 80))]
+    return {"UserID": "user-%d" % seed,
+            "CurrentBalance": round(generator.uniform(-1000, 10000), 2),
+            "FICOScore": generator.randint(300, 850),
+            "Transactions": transactions}
+
+
+SCENARIOS = [
+    # Great Data
+    {"UserID": "great-data", "CurrentBalance": 9270.02, "FICOScore": 476,
+     "Transactions": [_transaction(123.45, "Entertainment", "debit", 33),
+                      _transaction(2048.64, "Deposits", "credit", 28),
+                      _transaction(121.11, "Deposits", "credit", 28),
+                      _transaction(127.34, "XXX-44", "debit", 3)]},
+    # No Transactions
+    {"UserID": "no-transactions", "CurrentBalance": 9270.02,
+     "FICOScore": 476, "Transactions": []},
+    # No Transactions in Last 30 Days
+    {"UserID": "old-transactions", "CurrentBalance": 9270.02,
+     "FICOScore": 476,
+     "Transactions": [_transaction(123.45, "Entertainment", "debit", 33),
+                      _transaction(2048.64, "Deposits", "credit", 35),
+                      _transaction(127.34, "XXX-44", "debit", 43)]},
+    # Transactions on the first and last day of the window only
+    {"UserID": "window-edges", "CurrentBalance": 10.0, "FICOScore": 700,
+     "Transactions": [_transaction(50.0, "XXX-02", "debit", 29),
+                      _transaction(20.0, "Deposits", "credit", 29),
+                      _transaction(5.0, "XXX-03", "debit", 0),
+                      _transaction(1.0, "XXX-04", "debit", -1)]},
+] + [_random_request(seed) for seed in range(25)]
+
+
+@pytest.mark.parametrize('request_json', SCENARIOS,
+                         ids=[s['UserID'] for s in SCENARIOS])
+def test_single_pass_feature_tuple_matches_pandas(request_json):
+    assert (single_pass_feature_tuple(request_json) ==
+            raw_data_to_feature_tuple(request_json))
+
+
+@pytest.mark.parametrize('request_json', SCENARIOS,
+                         ids=[s['UserID'] for s in SCENARIOS])
+def test_single_pass_feature_tuple_with_columnar_transactions(request_json):
+    columnar_json = dict(request_json, Transactions=to_columnar_transactions(
+        request_json['Transactions']))
+
+    assert (single_pass_feature_tuple(columnar_json) ==
+            raw_data_to_feature_tuple(request_json))
+
+
+def test_single_pass_feature_tuple_with_missing_fields():
+    with pytest.raises(KeyError):
+        single_pass_feature_tuple({"CurrentBalance": 1.0, "Transactions": []})
+
+    with pytest.raises(KeyError):
+        single_pass_feature_tuple(
+            {"CurrentBalance": 1.0, "FICOScore": 700,
+             "Transactions": [{"Amount": 1.0, "Type": "debit"}]})
+
+
+def test_prefilter_window_rows_keeps_the_window_and_the_largest_debit():
+    transactions = [_transaction(900.0, "Rent", "debit", 45),
+                    _transaction(10.0, "Food", "Debit", 3),
+                    _transaction(50.0, "Deposits", "credit", 0),
+                    _transaction(20.0, "Food", "debit", 30)]
+
+    window_rows, catg_max_debits = prefilter_window_rows(transactions)
+
+    assert window_rows == transactions[1:3]
+    assert catg_max_debits == "Rent"
+
+
+def test_feature_engines_stop_past_the_deadline():
+    with pytest.raises(ProcessingTimeExceeded):
+        single_pass_feature_tuple(SCENARIOS[0], deadline=0)
+
+    with pytest.raises(ProcessingTimeExceeded):
+        raw_data_to_feature_tuple(SCENARIOS[0], deadline=0)
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from sklearn.externals import joblib
+
+from benchmarks import CATEGORIES
+from conftest import ENCODER_PIPELINE_PATH
+from frozen_encoder import FrozenEncoder
+
+
+def _feature_rows():
+    return [[100.0 + code, 150.5, -20.25, 75.0, 10, category, 600 + code]
+            for code, category in enumerate(CATEGORIES + ['None'])]
+
+
+def test_frozen_encoder_matches_fitted_pipeline(tmpdir):
+    encoding_pipeline = joblib.load(ENCODER_PIPELINE_PATH)
+    frozen_encoder = FrozenEncoder.from_pipeline(encoding_pipeline)
+
+    frozen_path = str(tmpdir.join('encoder_frozen.json'))
+    frozen_encoder.save(frozen_path)
+    reloaded_encoder = FrozenEncoder.load(frozen_path)
+
+    expected = np.asarray(encoding_pipeline.transform(_feature_rows()),
+                          dtype=float)
+    assert np.array_equal(frozen_encoder.transform(_feature_rows()), expected)
+    assert np.array_equal(reloaded_encoder.transform(_feature_rows()),
+                          expected)
+
+
+def test_frozen_encoder_unknown_category_fallback():
+    encoding_pipeline = joblib.load(ENCODER_PIPELINE_PATH)
+    unknown_row = [[1.0, 2.0, 3.0, 4.0, 5.0, 'Not A Category', 700]]
+
+    with pytest.raises(ValueError):
+        FrozenEncoder.from_pipeline(encoding_pipeline).transform(unknown_row)
+
+    fallback_encoder = FrozenEncoder.from_pipeline(encoding_pipeline,
+                                                   unknown_category='None')
+    assert fallback_encoder.transform(unknown_row).tolist() == [
+        [1.0, 2.0, 3.0, 4.0, 5.0, 0.0, 700.0]]
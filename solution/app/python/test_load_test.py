@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from load_test import (ProcessMonitor, find_saturation, generate_bodies,
+                       parse_mix, replay_bodies, run_closed_step,
+                       run_open_step, summarize_samples)
+from test_main import _sample_request
+
+
+def _step(load, throughput_rps, error_rate=0.0, p99_ms=10.0, **extra):
+    return dict(load=load, throughput_rps=throughput_rps,
+                error_rate=error_rate, p99_ms=p99_ms, **extra)
+
+
+def test_find_saturation():
+    closed_steps = [_step('1', 10.0), _step('2', 19.0), _step('4', 20.0)]
+    assert find_saturation(closed_steps) == {
+        'saturated_at': 2, 'last_good': 1,
+        'reason': "throughput grew by less than 10% over 2"}
+
+    assert find_saturation([_step('1', 10.0, error_rate=0.5)])[
+        'saturated_at'] == 0
+    assert find_saturation([_step('1', 10.0, p99_ms=900.0)],
+                           max_p99_ms=500)['saturated_at'] == 0
+
+    open_steps = [_step('10', 10.0, target_rps=10.0),
+                  _step('20', 20.0, target_rps=20.0),
+                  _step('40', 30.0, target_rps=40.0)]
+    assert find_saturation(open_steps)['saturated_at'] == 2
+    assert find_saturation(open_steps[:2]) == {
+        'saturated_at': None, 'last_good': 1, 'reason': None}
+
+
+def test_applicant_bodies(tmpdir):
+    with pytest.raises(ValueError):
+        parse_mix('10:0')
+    bodies = generate_bodies(parse_mix('0:1,5:1'), batch_size=3,
+                             pool_size=4)
+    assert len(bodies) == 4
+    assert all(len(json.loads(body)) == applicants == 3
+               for body, applicants in bodies)
+
+    replay_path = str(tmpdir.join('applicants.ndjson'))
+    with open(replay_path, 'w') as replay_file:
+        replay_file.write('\n'.join(json.dumps(_sample_request("u-%d" % i))
+                                    for i in range(5)))
+    assert [applicants for _, applicants in replay_bodies(
+        [replay_path], batch_size=2)] == [2, 2, 1]
+
+
+def test_closed_and_open_steps_against_the_service(client):
+    import main
+    server = make_server('127.0.0.1', 0, main.app, threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    url = 'http://127.0.0.1:%d' % server.server_port
+    bodies = [(json.dumps(_sample_request("u-0")), 1),
+              (json.dumps([_sample_request("u-1"), {}]), 2)]
+
+    try:
+        closed = summarize_samples(*run_closed_step(url, bodies, 2, 0.5))
+        open_loop = summarize_samples(*run_open_step(url, bodies, 20, 0.5,
+                                                     max_in_flight=4))
+    finally:
+        server.shutdown()
+
+    assert closed['requests'] > 0 and closed['error_rate'] == 0
+    assert 0 < closed['applicant_error_rate'] < 1
+    assert open_loop['requests'] == 10
+    assert open_loop['p50_ms'] <= open_loop['p99_ms']
+
+
+def test_process_monitor_reports_children():
+    monitor = ProcessMonitor(os.getppid(), interval=0.01)
+    monitor.start()
+    workers, driver_cpu_percent = monitor.stop()
+
+    assert os.getpid() in [worker['pid'] for worker in workers]
+    assert driver_cpu_percent >= 0
@@ -1,5 +1,6 @@
 import datetime as dt
 import json
+import time
 
 import pytest
 
@@ -307,3 +308,217 @@ def test_raw_data_to_feature_tuple_with_no_credits_in_last_30_days():
          'max_bal_l30': 11567.11, 'min_bal_l30': 9270.02,
          'sum_credit_l30': 0, 'sum_debit_l30': 2297.09,
          'catg_max_debits': 'XXX-33'})
+
+
+def _sample_request(user_id, fico_score=682, category="Entertainment"):
+    return {
+        "UserID": user_id,
+        "CurrentBalance": 42.82,
+        "FICOScore": fico_score,
+        "Transactions": [
+            {"TransactionID": "ABCDEF12-3456-78AB-CDEF12345678",
+             "Amount":        123.45,
+             "Category":      category,
+             "Type":          "debit",
+             "PostDate":      (_get_date_only() -
+                               dt.timedelta(days=2)).strftime("%Y-%m-%d")
+             }
+        ]
+    }
+
+
+def test_predictions_batch_matches_single_requests(client):
+    request_jsons = [_sample_request("user-%d" % i, fico_score=500 + 50 * i)
+                     for i in range(4)]
+
+    batch_response = client.post('/predictions',
+                                 data=json.dumps(request_jsons),
+                                 content_type='application/json')
+    single_responses = [
+        json.loads(client.post('/predictions',
+                               data=json.dumps(request_json),
+                               content_type='application/json').data)
+        for request_json in request_jsons]
+
+    assert batch_response.status_code == 200
+    assert json.loads(batch_response.data) == single_responses
+
+
+def test_predictions_batch_reports_errors_per_record(client):
+    missing_fico = _sample_request("user-1")
+    del missing_fico['FICOScore']
+    request_jsons = [_sample_request("user-0"),
+                     missing_fico,
+                     _sample_request("user-2", category="Unknown Category"),
+                     _sample_request("user-3")]
+
+    response = client.post('/predictions',
+                           data=json.dumps(request_jsons),
+                           content_type='application/json')
+    responses = json.loads(response.data)
+
+    assert response.status_code == 200
+    assert [r['UserID'] for r in responses] == [
+        "user-0", "user-1", "user-2", "user-3"]
+    assert 'prediction' in responses[0]
+    assert responses[1]['error_message'] == "FICOScore is missing from Body"
+    assert responses[2]['error_message'] == "Generating Predictions Failed"
+    assert 'prediction' in responses[3]
+
+
+def test_predictions_batch_rejects_bad_transactions_before_scoring(client):
+    bad_date = _sample_request("user-1", fico_score=0)
+    bad_date['Transactions'][0]['PostDate'] = "yesterday-ish"
+    request_jsons = [_sample_request("user-0", fico_score=0), bad_date]
+
+    responses = json.loads(client.post('/predictions',
+                                       data=json.dumps(request_jsons),
+                                       content_type='application/json').data)
+
+    assert 'prediction' in responses[0]
+    assert responses[1]['error_message'] == (
+        "Transactions[0].PostDate is not a valid date")
+
+
+def test_predictions_stream_returns_one_line_per_applicant(client, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'STREAM_CHUNK_SIZE', 2)
+
+    request_jsons = [_sample_request("user-%d" % i) for i in range(5)]
+    request_body = '\n'.join(
+        [json.dumps(request_json) for request_json in request_jsons] +
+        ['', 'not json'])
+
+    response = client.post('/predictions/stream', data=request_body,
+                           content_type='application/x-ndjson')
+    response_lines = [json.loads(line)
+                      for line in response.data.splitlines()]
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert len(response_lines) == 6
+    assert [line['UserID'] for line in response_lines[:5]] == [
+        "user-%d" % i for i in range(5)]
+    assert all('prediction' in line for line in response_lines[:5])
+    assert response_lines[5]['error_code'] == 400
+
+
+def test_predictions_reject_histories_over_the_transaction_limit(
+        client, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'MAX_APPLICANT_TRANSACTIONS', 1)
+    long_history = _sample_request("user-1")
+    long_history['Transactions'] *= 2
+
+    response = client.post('/predictions', data=json.dumps(long_history),
+                           content_type='application/json')
+    batch_responses = json.loads(client.post(
+        '/predictions', data=json.dumps([_sample_request("user-0"),
+                                         long_history]),
+        content_type='application/json').data)
+
+    assert response.status_code == 413
+    assert json.loads(response.data)['error_message'] == (
+        "Applicants can have at most 1 Transactions, this one has 2")
+    assert 'prediction' in batch_responses[0]
+    assert batch_responses[1]['error_code'] == 413
+
+
+def test_predictions_give_up_on_features_past_the_deadline(
+        client, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'feature_deadline', lambda: time.time() - 1)
+
+    response = client.post('/predictions',
+                           data=json.dumps(_sample_request("user-0")),
+                           content_type='application/json')
+    batch_responses = json.loads(client.post(
+        '/predictions', data=json.dumps([_sample_request("user-1")]),
+        content_type='application/json').data)
+
+    assert response.status_code == 422
+    assert batch_responses[0]['error_code'] == 422
+
+
+def test_ready_once_models_are_loaded_and_warmed_up(client, monkeypatch):
+    import main
+    from startup import StartupTimer
+    monkeypatch.setattr(main, 'startup_timer', StartupTimer())
+    monkeypatch.setattr(main, 'WARMUP_ON_START', True)
+
+    before = client.get('/ready')
+    main.load_models()
+    after = client.get('/ready')
+
+    assert before.status_code == 503
+    assert json.loads(before.data)['models_loaded'] is False
+    assert after.status_code == 200
+    assert json.loads(after.data)['ready'] is True
+    assert set(['load_models', 'import_pandas', 'warm_up']) <= set(
+        json.loads(after.data)['startup']['stages'])
+    assert main.feature_cache.stats()['size'] == 0
+
+
+def test_importing_the_service_leaves_pandas_and_sklearn_unloaded():
+    import os
+    import subprocess
+    import sys
+
+    loaded = subprocess.check_output(
+        [sys.executable, '-c',
+         "import sys, main; "
+         "print([m for m in ('pandas', 'sklearn') if m in sys.modules])"],
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    assert loaded.strip() == b'[]'
+
+
+def test_model_reload_needs_the_token_and_ignores_client_paths(
+        client, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'MODEL_RELOAD_TOKEN', 's3cret')
+    authorized = {'Authorization': 'Bearer s3cret'}
+
+    unauthorized = client.post('/models/reload', headers={
+        'Authorization': 'Bearer guess'})
+    with_path = client.post('/models/reload', headers=authorized,
+                            data=json.dumps({'model_path': '/tmp/evil.pkl'}),
+                            content_type='application/json')
+    reloaded = client.post('/models/reload', headers=authorized)
+
+    assert unauthorized.status_code == 401
+    assert with_path.status_code == 400
+    assert reloaded.status_code == 200
+    assert json.loads(reloaded.data)['model_path'] == (
+        main.model_registry.model_path)
+
+    monkeypatch.setattr(main, 'MODEL_RELOAD_TOKEN', None)
+    assert client.post('/models/reload',
+                       headers=authorized).status_code == 404
+
+
+def test_predictions_answer_503_when_the_coalescer_times_out(
+        client, monkeypatch):
+    import main
+    from coalescer import PredictionCoalescer
+    monkeypatch.setattr(main, 'prediction_coalescer', PredictionCoalescer(
+        lambda feature_jsons: time.sleep(1), max_wait_ms=1,
+        result_timeout=0.05))
+
+    response = client.post('/predictions',
+                           data=json.dumps(_sample_request("user-0")),
+                           content_type='application/json')
+
+    assert response.status_code == 503
+
+
+def test_model_reload_is_refused_with_several_workers(client, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'MODEL_RELOAD_TOKEN', 's3cret')
+    monkeypatch.setattr(main, 'reload_endpoint_enabled', False)
+
+    response = client.post('/models/reload',
+                           headers={'Authorization': 'Bearer s3cret'})
+
+    assert response.status_code == 409
+    assert main.model_registry.version == 0
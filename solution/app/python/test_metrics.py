@@ -0,0 +1,82 @@
+import json
+
+from metrics import MetricsRegistry, server_timing_header
+from test_main import _sample_request
+
+
+def test_metrics_registry_exposes_prometheus_text():
+    metrics = MetricsRegistry()
+    counter = metrics.counter('requests_total', "Requests", ['status'])
+    histogram = metrics.histogram('latency_seconds', "Latency", (0.1, 1.0))
+    metrics.gauge('cache_size', "Size", lambda: 3)
+
+    counter.inc(status=200)
+    counter.inc(status=200)
+    histogram.observe_many([0.05, 0.5, 5.0])
+
+    assert metrics.expose().splitlines() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{status="200"} 2',
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_sum 5.55',
+        'latency_seconds_count 3',
+        '# HELP cache_size Size',
+        '# TYPE cache_size gauge',
+        'cache_size 3']
+
+
+def test_metrics_registries_sharing_a_directory_report_their_totals(tmpdir):
+    # Each registry stands in for one worker process
+    workers = [MetricsRegistry(str(tmpdir)) for _ in range(2)]
+    counters = [worker.counter('requests_total', "Requests", ['status'])
+                for worker in workers]
+    histograms = [worker.histogram('latency_seconds', "Latency", (0.1, ))
+                  for worker in workers]
+    for worker in workers:
+        worker.counter('cache_events_total', "Cache", ['event'],
+                       callback=lambda: {('hits', ): 4})
+
+    counters[0].inc(status=200)
+    counters[1].inc(2, status=200)
+    counters[1].inc(status=500)
+    histograms[0].observe(0.05)
+    histograms[1].observe(0.5)
+    workers[1].write_snapshot()
+
+    exposed = workers[0].expose().splitlines()
+
+    assert 'requests_total{status="200"} 3' in exposed
+    assert 'requests_total{status="500"} 1' in exposed
+    assert 'latency_seconds_bucket{le="0.1"} 1' in exposed
+    assert 'latency_seconds_count 2' in exposed
+    assert 'cache_events_total{event="hits"} 8' in exposed
+    assert '# TYPE cache_events_total counter' in exposed
+
+
+def test_server_timing_header_totals_repeated_stages():
+    assert (server_timing_header([('parse', 0.001), ('features', 0.002),
+                                  ('features', 0.003)]) ==
+            'parse;dur=1.000, features;dur=5.000')
+
+
+def test_metrics_endpoint_counts_requests_and_stages(client):
+    import main
+    request_jsons = [_sample_request("user-0"), {"UserID": "user-1"}]
+
+    response = client.post('/predictions', data=json.dumps(request_jsons),
+                           content_type='application/json',
+                           headers={'X-Request-Timing': '1'})
+    exposition = client.get('/metrics').data.decode('utf-8')
+
+    assert 'features;dur=' in response.headers['Server-Timing']
+    assert 'predict;dur=' in response.headers['Server-Timing']
+    assert ('scoring_requests_total{endpoint="main",status="200"}'
+            in exposition)
+    assert 'scoring_stage_duration_seconds_count{stage="encode"}' in (
+        exposition)
+    assert main.error_counter.value(type='validation') >= 1
@@ -0,0 +1,67 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from sklearn.externals import joblib
+
+from conftest import _fit_sample_model
+from model_artifact import (MANIFEST_NAME, MODEL_FILE_NAME, ArtifactError,
+                            export_artifact, load_artifact)
+from model_registry import ModelRegistry
+
+
+ENCODED_ROWS = [[42.82, 2048.64, 42.82, 123.45, 2048.64, 1, 682],
+                [5.0, 500.0, 5.0, 495.0, 0.0, 56, 550]]
+
+
+def test_artifact_predicts_like_the_pickle_from_mapped_arrays(tmpdir):
+    model = _fit_sample_model()
+    artifact_dir = str(tmpdir.join('artifact'))
+    manifest = export_artifact(model, artifact_dir)
+
+    mapped_model = load_artifact(artifact_dir)
+
+    assert manifest['format_version'] == 1
+    assert isinstance(mapped_model.coef_, np.memmap)
+    assert not mapped_model.coef_.flags.writeable
+    assert np.array_equal(mapped_model.predict_proba(ENCODED_ROWS),
+                          model.predict_proba(ENCODED_ROWS))
+
+
+def test_artifact_with_changed_model_file_is_rejected(tmpdir):
+    artifact_dir = str(tmpdir.join('artifact'))
+    export_artifact(_fit_sample_model(), artifact_dir)
+    model_path = os.path.join(artifact_dir, MODEL_FILE_NAME)
+    with open(model_path, 'r+b') as model_file:
+        model_file.seek(-1, os.SEEK_END)
+        last_byte = model_file.read(1)
+        model_file.seek(-1, os.SEEK_END)
+        model_file.write(b'\x00' if last_byte != b'\x00' else b'\x01')
+
+    with pytest.raises(ArtifactError):
+        load_artifact(artifact_dir)
+
+
+def test_artifact_with_unknown_format_version_is_rejected(tmpdir):
+    artifact_dir = str(tmpdir.join('artifact'))
+    manifest = export_artifact(_fit_sample_model(), artifact_dir)
+    manifest['format_version'] = 99
+    with open(os.path.join(artifact_dir, MANIFEST_NAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+
+    with pytest.raises(ArtifactError):
+        load_artifact(artifact_dir)
+
+
+def test_model_registry_loads_an_artifact_directory(model_paths, tmpdir):
+    encoder_path, model_path = model_paths
+    artifact_dir = str(tmpdir.join('artifact'))
+    export_artifact(joblib.load(model_path), artifact_dir)
+
+    registry = ModelRegistry(encoder_path, artifact_dir)
+    encoding_pipeline, prediction_pipeline = registry.get()
+
+    assert registry.version == 1
+    assert isinstance(prediction_pipeline.coef_, np.memmap)
+    assert not registry.reload_if_changed()
@@ -0,0 +1,83 @@
+import pytest
+from sklearn.externals import joblib
+
+from frozen_encoder import FrozenEncoder, file_checksum
+from model_registry import ModelRegistry, ModelLoadError
+
+
+def test_model_registry_loads_pipelines_once(model_paths):
+    encoder_path, model_path = model_paths
+    registry = ModelRegistry(encoder_path, model_path)
+
+    assert not registry.is_loaded()
+
+    first_pipelines = registry.get()
+    second_pipelines = registry.get()
+
+    assert registry.is_loaded()
+    assert registry.version == 1
+    assert first_pipelines is second_pipelines
+
+
+def test_model_registry_swaps_pipelines_on_load(model_paths):
+    encoder_path, model_path = model_paths
+    registry = ModelRegistry(encoder_path, model_path)
+
+    old_encoder, old_model = registry.get()
+    model_info = registry.load()
+    new_encoder, new_model = registry.get()
+
+    assert model_info['version'] == 2
+    assert new_model is not old_model
+
+
+def test_model_registry_keeps_pipelines_on_failed_load(model_paths, tmpdir):
+    encoder_path, model_path = model_paths
+    registry = ModelRegistry(encoder_path, model_path)
+    pipelines = registry.get()
+
+    invalid_model_path = str(tmpdir.join('not_a_model.pkl'))
+    joblib.dump({'not': 'a model'}, invalid_model_path)
+
+    with pytest.raises(ModelLoadError):
+        registry.load(model_path=invalid_model_path)
+
+    assert registry.get() is pipelines
+    assert registry.model_path == model_path
+    assert registry.version == 1
+
+
+def test_model_registry_rejects_a_frozen_encoder_of_an_older_pipeline(
+        model_paths, tmpdir):
+    encoder_path, model_path = model_paths
+    source_path = tmpdir.join('encoder_pipeline.pkl')
+    source_path.write_binary(open(encoder_path, 'rb').read())
+    frozen_encoder = FrozenEncoder.from_pipeline(
+        joblib.load(str(source_path)),
+        source_checksum=file_checksum(str(source_path)),
+        source_path='encoder_pipeline.pkl')
+    frozen_path = str(tmpdir.join('encoder_frozen.json'))
+    frozen_encoder.save(frozen_path)
+
+    assert ModelRegistry(frozen_path, model_path).load()['version'] == 1
+
+    source_path.write_binary(source_path.read_binary() + b'\0')
+    with pytest.raises(ModelLoadError):
+        ModelRegistry(frozen_path, model_path).load()
+
+
+def test_named_model_registry_follows_the_live_encoder(model_paths):
+    encoder_path, model_path = model_paths
+    live_registry = ModelRegistry(encoder_path, model_path)
+    named_registry = ModelRegistry(model_path=model_path,
+                                   encoder_source=live_registry)
+
+    named_encoder, named_model = named_registry.get()
+    assert named_encoder is live_registry.get()[0]
+
+    live_registry.load()
+
+    assert named_registry.get()[0] is live_registry.get()[0]
+    assert named_registry.get()[0] is not named_encoder
+    assert named_registry.get()[1] is named_model
+    assert named_registry.describe()['encoder_path'] == encoder_path
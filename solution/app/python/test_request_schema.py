@@ -0,0 +1,77 @@
+import pytest
+
+from feature_engine import to_columnar_transactions
+from request_schema import SchemaValidator
+
+
+validator = SchemaValidator()
+
+
+def _applicant(**fields):
+    applicant = {
+        "UserID": "user-0",
+        "CurrentBalance": 42.82,
+        "FICOScore": 682,
+        "Transactions": [
+            {"TransactionID": "t-0", "Amount": 123.45,
+             "Category": "Entertainment", "Type": "debit",
+             "PostDate": "2018-06-01"},
+            {"TransactionID": "t-1", "Amount": 2048.64,
+             "Category": "Deposits", "Type": "Credit",
+             "PostDate": "2018-06-02"}]}
+    applicant.update(fields)
+    return applicant
+
+
+def test_zero_balance_and_fico_score_are_valid():
+    assert validator.validate(_applicant()) is None
+    assert validator.validate(
+        _applicant(CurrentBalance=0, FICOScore=0, Transactions=[])) is None
+
+
+@pytest.mark.parametrize('fields, message', [
+    ({'FICOScore': None}, "FICOScore is missing from Body"),
+    ({'FICOScore': '682'},
+     "FICOScore needs to be a number between 0 and 850"),
+    ({'FICOScore': 900}, "FICOScore needs to be a number between 0 and 850"),
+    ({'CurrentBalance': True},
+     "CurrentBalance needs to be a number between -1e+12 and 1e+12"),
+    ({'CurrentBalance': float('nan')},
+     "CurrentBalance needs to be a number between -1e+12 and 1e+12"),
+    ({'Transactions': 'none'}, "Transactions needs to be a list element"),
+])
+def test_applicant_fields_are_checked(fields, message):
+    assert validator.validate(_applicant(**fields)) == message
+
+
+@pytest.mark.parametrize('field, value, message', [
+    ('Amount', None, "Transactions[1].Amount is missing"),
+    ('Amount', -5, "Transactions[1].Amount needs to be a number between 0 "
+                   "and 1e+12"),
+    ('Type', 'refund', "Transactions[1].Type needs to be one of credit, "
+                       "debit"),
+    ('Category', 7, "Transactions[1].Category needs to be a string"),
+    ('PostDate', '2018-02-30', "Transactions[1].PostDate is not a valid date"),
+    ('PostDate', 17683, "Transactions[1].PostDate needs to be a date string "
+                        "(YYYY-MM-DD)"),
+])
+def test_transaction_errors_name_the_field(field, value, message):
+    applicant = _applicant()
+    applicant['Transactions'][1][field] = value
+
+    assert validator.validate(applicant) == message
+
+
+def test_columnar_transactions_are_checked():
+    applicant = _applicant()
+    applicant['Transactions'] = to_columnar_transactions(
+        applicant['Transactions'])
+    assert validator.validate(applicant) is None
+
+    applicant['Transactions']['Type']['codes'][1] = 2
+    assert validator.validate(applicant) == (
+        "Transactions.Type.codes[1] needs to be an integer between 0 and 1")
+
+    applicant['Transactions']['Type']['codes'] = [0]
+    assert validator.validate(applicant) == (
+        "Transactions.Type.codes needs one value per Amount")
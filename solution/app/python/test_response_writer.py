@@ -0,0 +1,56 @@
+import json
+
+import numpy as np
+
+from response_writer import (compact_responses, format_response,
+                             numeric_responses, prediction_texts)
+from test_main import _sample_request
+
+
+RESPONSES = [{'UserID': 'u-0', 'prediction': '1'},
+             {'UserID': 'u-1', 'error_code': 413, 'error_message': 'Too big'},
+             {'UserID': 'u-2', 'prediction': '0.25'},
+             {'UserID': 'u-3', 'prediction': 'approve'}]
+
+
+def test_prediction_texts_match_str_of_each_prediction():
+    for predictions in [np.array([0, 1, 1]), np.array([True, False]),
+                        np.array([0.1, 1.0 / 3]), np.array(['a', 'b'])]:
+        assert prediction_texts(predictions) == [
+            str(prediction) for prediction in predictions]
+
+
+def test_numeric_and_compact_responses():
+    assert [r.get('prediction') for r in numeric_responses(RESPONSES)] == [
+        1, None, 0.25, 'approve']
+    assert compact_responses(RESPONSES) == {
+        'UserID': ['u-0', 'u-1', 'u-2', 'u-3'],
+        'prediction': [1, None, 0.25, 'approve'],
+        'errors': [{'index': 1, 'error_code': 413,
+                    'error_message': 'Too big'}]}
+    assert format_response(RESPONSES[0], 'compact') == {'UserID': 'u-0',
+                                                        'prediction': 1}
+    assert format_response(RESPONSES, 'default') is RESPONSES
+
+
+def test_predictions_in_every_format(client):
+    request_body = json.dumps([_sample_request("user-0"),
+                               _sample_request("user-1")])
+
+    default = json.loads(client.post('/predictions', data=request_body,
+                                     content_type='application/json').data)
+    numeric = json.loads(client.post('/predictions?format=numeric',
+                                     data=request_body,
+                                     content_type='application/json').data)
+    compact = json.loads(client.post('/predictions?format=compact',
+                                     data=request_body,
+                                     content_type='application/json').data)
+    unknown = client.post('/predictions?format=xml', data=request_body,
+                          content_type='application/json')
+
+    assert [r['prediction'] for r in numeric] == [
+        int(r['prediction']) for r in default]
+    assert compact == {'UserID': ['user-0', 'user-1'],
+                       'prediction': [r['prediction'] for r in numeric],
+                       'errors': []}
+    assert unknown.status_code == 400
@@ -0,0 +1,143 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from scoring_jobs import (DONE, QUEUED, RUNNING, JobQueueFull, JobRunner,
+                          JobStore, JobTooLarge)
+
+
+def _score_batch(records):
+    return [{"UserID": record['UserID'], 'prediction': '1'}
+            for record in records]
+
+
+def _records(count):
+    return [{"UserID": "user-%d" % number} for number in range(count)]
+
+
+def test_job_runs_chunk_by_chunk_and_pages_results(tmpdir):
+    store = JobStore(str(tmpdir), chunk_size=2)
+    job_status = store.create(iter(_records(5)))
+    runner = JobRunner(store, _score_batch)
+
+    assert job_status['state'] == QUEUED
+    assert job_status['chunks'] == 3
+    assert runner.run_once()
+    assert not runner.run_once()
+
+    job_status, page = store.results(job_status['job_id'], 1, 3)
+    assert job_status['state'] == DONE
+    assert job_status['completed'] == 5
+    assert [result['UserID'] for result in page] == [
+        "user-1", "user-2", "user-3"]
+    assert len(store.results(job_status['job_id'], 4, 10)[1]) == 1
+
+
+def test_job_of_dead_runner_resumes_at_first_missing_chunk(tmpdir):
+    store = JobStore(str(tmpdir), chunk_size=2)
+    job_id = store.create(_records(5))['job_id']
+    store.write_results(job_id, 0, [{"UserID": "from-dead-runner"}] * 2)
+
+    # A runner process that has exited still holds the claim
+    dead_process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead_process.wait()
+    runner = JobRunner(store, _score_batch)
+    store.claim(job_id, '%s:%d' % (runner.owner.split(':')[0],
+                                   dead_process.pid))
+    store.update_status(job_id, state='running')
+
+    assert runner.run_once()
+
+    job_status, page = store.results(job_id, 0, 10)
+    assert job_status['state'] == DONE
+    assert [result['UserID'] for result in page] == [
+        "from-dead-runner", "from-dead-runner",
+        "user-2", "user-3", "user-4"]
+
+
+def test_recover_leaves_jobs_of_live_runners_alone(tmpdir):
+    store = JobStore(str(tmpdir), chunk_size=2)
+    job_id = store.create(_records(3))['job_id']
+    runner = JobRunner(store, _score_batch)
+    store.claim(job_id, runner.owner)
+    store.update_status(job_id, state=RUNNING, completed=2)
+
+    store.recover()
+
+    assert store.status(job_id)['state'] == RUNNING
+    assert store.status(job_id)['completed'] == 2
+    assert store.claim_owner(job_id) == runner.owner
+
+
+def test_supervise_restarts_the_runner_until_stopped(tmpdir):
+    starts_path = str(tmpdir.join('starts'))
+    script = (
+        "import sys, time\n"
+        "sys.path.insert(0, %r)\n"
+        "from scoring_jobs import supervise\n"
+        "def run():\n"
+        "    with open(%r, 'a') as starts:\n"
+        "        starts.write('x')\n"
+        "    if len(open(%r).read()) >= 3:\n"
+        "        time.sleep(60)\n"
+        "supervise(run, restart_delay=0.01)\n" % (
+            os.path.dirname(os.path.abspath(__file__)), starts_path,
+            starts_path))
+    supervisor = subprocess.Popen([sys.executable, '-c', script])
+
+    deadline = time.time() + 20
+    while time.time() < deadline and not (
+            os.path.exists(starts_path) and
+            len(open(starts_path).read()) >= 3):
+        time.sleep(0.05)
+    supervisor.send_signal(signal.SIGTERM)
+    while time.time() < deadline and supervisor.poll() is None:
+        time.sleep(0.05)
+
+    assert len(open(starts_path).read()) == 3
+    assert supervisor.poll() is not None
+
+
+def test_job_store_limits_queue_and_job_size(tmpdir):
+    store = JobStore(str(tmpdir), chunk_size=2, max_queued=1, max_records=3)
+
+    with pytest.raises(JobTooLarge):
+        store.create(_records(4))
+    store.create(_records(3))
+    with pytest.raises(JobQueueFull):
+        store.create(_records(1))
+    assert len(store.job_ids()) == 1
+
+
+def test_jobs_end_points(client, monkeypatch, tmpdir):
+    import main
+    from test_main import _sample_request
+
+    job_store = JobStore(str(tmpdir), chunk_size=2)
+    monkeypatch.setattr(main, 'job_store', job_store)
+    request_jsons = [_sample_request("user-%d" % number)
+                     for number in range(3)] + ["not an applicant"]
+
+    response = client.post('/jobs', data=json.dumps(request_jsons),
+                           content_type='application/json')
+    job_id = json.loads(response.data)['job_id']
+    assert response.status_code == 202
+    assert response.headers['Location'].endswith('/jobs/%s' % job_id)
+
+    JobRunner(job_store, main.process_batch_request).run_once()
+
+    assert json.loads(client.get('/jobs/%s' % job_id).data)['state'] == DONE
+    page = json.loads(client.get('/jobs/%s/results?limit=3' % job_id).data)
+    assert [result['UserID'] for result in page['results']] == [
+        "user-0", "user-1", "user-2"]
+    assert page['next_offset'] == 3
+    last_page = json.loads(client.get(
+        '/jobs/%s/results?offset=3' % job_id).data)
+    assert last_page['results'][0]['error_code'] == 400
+    assert last_page['next_offset'] is None
+    assert client.get('/jobs/%s' % ('0' * 32)).status_code == 404
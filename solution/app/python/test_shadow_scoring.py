@@ -0,0 +1,96 @@
+import json
+import threading
+
+import pytest
+from sklearn.dummy import DummyClassifier
+from sklearn.externals import joblib
+
+from shadow_scoring import ShadowScorer, parse_named_models
+
+
+def test_parse_named_models_keeps_order():
+    assert list(parse_named_models(
+        " candidate=resources/v2.pkl, challenger=resources/v3 ,").items()) == [
+            ('candidate', 'resources/v2.pkl'), ('challenger', 'resources/v3')]
+    with pytest.raises(ValueError):
+        parse_named_models("candidate")
+
+
+def test_shadow_scorer_logs_every_model_and_drops_when_full(tmpdir):
+    log_path = str(tmpdir.join('shadow.ndjson'))
+    release = threading.Event()
+
+    def score_batch(model_name, feature_jsons):
+        release.wait(5)
+        if model_name == 'broken':
+            raise ValueError("no model")
+        return ['0.5'] * len(feature_jsons)
+
+    scorer = ShadowScorer(score_batch, ['candidate', 'broken'],
+                          max_pending=2, log_path=log_path)
+    assert scorer.submit('default', ['u-0', 'u-1'], [{'f': 0}, {'f': 1}],
+                         ['1', '0'])
+    assert not scorer.submit('default', ['u-2'], [{'f': 2}], ['1'])
+    release.set()
+    assert scorer.drain(5)
+
+    with open(log_path) as log_file:
+        records = [json.loads(line) for line in log_file]
+    candidate = [r for r in records if r['shadow_model'] == 'candidate']
+    broken = [r for r in records if r['shadow_model'] == 'broken']
+    assert [r['UserID'] for r in candidate] == ['u-0', 'u-1']
+    assert candidate[0]['live_prediction'] == '1'
+    assert candidate[0]['prediction'] == '0.5'
+    assert candidate[0]['features'] == {'f': 0}
+    assert all('error' in r for r in broken)
+    assert len(broken) == 2
+    assert scorer.stats()['dropped'] == 1
+    assert scorer.stats()['failed'] == 2
+
+
+def test_named_and_shadow_models_share_the_live_features(client, monkeypatch,
+                                                         tmpdir):
+    import main
+    from conftest import ENCODER_PIPELINE_PATH
+    from model_registry import ModelRegistry
+    from test_main import _sample_request
+
+    candidate_path = str(tmpdir.join('candidate.pkl'))
+    joblib.dump(DummyClassifier(strategy='constant', constant=7).fit(
+        [[0] * 7, [1] * 7], [7, 3]), candidate_path)
+    monkeypatch.setattr(main, 'named_model_registries', {
+        'candidate': ModelRegistry(ENCODER_PIPELINE_PATH, candidate_path)})
+    log_path = str(tmpdir.join('shadow.ndjson'))
+    scorer = ShadowScorer(main.score_shadow_model, ['candidate'],
+                          log_path=log_path)
+    monkeypatch.setattr(main, 'shadow_scorer', scorer)
+    built_features = []
+    build_feature_json = main.build_feature_json
+    monkeypatch.setattr(main, 'build_feature_json',
+                        lambda raw_data_json, **kwargs: (
+                            built_features.append(1) or
+                            build_feature_json(raw_data_json, **kwargs)))
+
+    live = json.loads(client.post(
+        '/predictions', data=json.dumps(_sample_request("user-0")),
+        content_type='application/json').data)
+    assert scorer.drain(5)
+    named = json.loads(client.post(
+        '/predictions?model=candidate',
+        data=json.dumps([_sample_request("user-1")]),
+        content_type='application/json').data)
+    unknown = client.post('/predictions?model=missing',
+                          data=json.dumps(_sample_request("user-2")),
+                          content_type='application/json')
+
+    with open(log_path) as log_file:
+        records = [json.loads(line) for line in log_file]
+    # Both applicants have the same payload, so the features of the first
+    # (also used by the shadow model) were reused for the named model
+    assert len(built_features) == 1
+    assert named[0]['prediction'] == '7'
+    assert records == [dict(records[0], UserID="user-0",
+                            live_model='default',
+                            live_prediction=live['prediction'],
+                            shadow_model='candidate', prediction='7')]
+    assert unknown.status_code == 400
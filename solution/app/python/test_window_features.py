@@ -0,0 +1,105 @@
+import pytest
+
+import feature_engine
+import main
+from feature_engine import single_pass_feature_tuple, to_columnar_transactions
+from test_feature_engine import SCENARIOS, _transaction
+from window_features import (AGGREGATES, parse_aggregates, parse_windows,
+                             windowed_feature_tuple)
+
+
+WINDOWS = [7, 30, 60, 90]
+
+
+@pytest.mark.parametrize('request_json', SCENARIOS,
+                         ids=[s['UserID'] for s in SCENARIOS])
+def test_windowed_feature_tuple_keeps_the_base_features(request_json):
+    single_pass_json = single_pass_feature_tuple(request_json)
+    windowed_json = windowed_feature_tuple(request_json, WINDOWS, AGGREGATES)
+
+    assert dict((key, windowed_json[key])
+                for key in single_pass_json) == single_pass_json
+
+    columnar_json = dict(request_json, Transactions=to_columnar_transactions(
+        request_json['Transactions']))
+    assert windowed_feature_tuple(columnar_json, WINDOWS,
+                                  AGGREGATES) == windowed_json
+
+
+@pytest.mark.parametrize('window_days', [1, 7, 60])
+@pytest.mark.parametrize('request_json', SCENARIOS[:12],
+                         ids=[s['UserID'] for s in SCENARIOS[:12]])
+def test_windowed_feature_tuple_matches_single_pass_windows(
+        monkeypatch, request_json, window_days):
+    windowed_json = windowed_feature_tuple(request_json, WINDOWS + [1])
+
+    monkeypatch.setattr(feature_engine, 'WINDOW_DAYS', window_days)
+    single_pass_json = single_pass_feature_tuple(request_json)
+
+    for aggregate in ['max_bal', 'min_bal', 'sum_debit', 'sum_credit']:
+        assert (windowed_json['%s_l%d' % (aggregate, window_days)] ==
+                single_pass_json[aggregate + '_l30'])
+
+
+def test_debits_by_category():
+    request_json = {"CurrentBalance": 100.0, "FICOScore": 700,
+                    "Transactions": [
+                        _transaction(10.25, "Food", "debit", 1),
+                        _transaction(5.5, "Food", "debit", 20),
+                        _transaction(99.0, "Rent", "debit", 45),
+                        _transaction(50.0, "Deposits", "credit", 2)]}
+
+    windowed_json = windowed_feature_tuple(request_json, [7, 30, 60],
+                                           AGGREGATES)
+
+    assert windowed_json['debits_by_category_l7'] == {"Food": 10.25}
+    assert windowed_json['debits_by_category_l30'] == {"Food": 15.75}
+    assert windowed_json['debits_by_category_l60'] == {"Food": 15.75,
+                                                       "Rent": 99.0}
+    assert windowed_json['catg_max_debits'] == "Rent"
+
+
+def test_windowed_feature_tuple_without_transactions():
+    windowed_json = windowed_feature_tuple(
+        {"CurrentBalance": 12.5, "FICOScore": 700, "Transactions": []},
+        [7, 30], AGGREGATES)
+
+    assert windowed_json['max_bal_l7'] == windowed_json['min_bal_l7'] == 12.5
+    assert windowed_json['sum_debit_l7'] == windowed_json['sum_credit_l7'] == 0
+    assert windowed_json['debits_by_category_l7'] == {}
+    assert windowed_json['catg_max_debits'] == 'None'
+
+
+def test_windowed_feature_tuple_with_missing_fields():
+    with pytest.raises(KeyError):
+        windowed_feature_tuple({"CurrentBalance": 1.0, "Transactions": []})
+
+    with pytest.raises(KeyError):
+        windowed_feature_tuple(
+            {"CurrentBalance": 1.0, "FICOScore": 700,
+             "Transactions": [{"Amount": 1.0, "Type": "debit"}]})
+
+
+def test_parse_windows_and_aggregates():
+    assert parse_windows(None) == [30]
+    assert parse_windows('90, 7,30') == [7, 30, 90]
+    with pytest.raises(ValueError):
+        parse_windows('0')
+
+    assert parse_aggregates('') == ['max_bal', 'min_bal', 'sum_debit',
+                                    'sum_credit']
+    assert parse_aggregates('debits_by_category')[-1] == 'debits_by_category'
+    with pytest.raises(ValueError):
+        parse_aggregates('median_bal')
+
+
+def test_build_feature_json_with_the_windows_engine(monkeypatch):
+    monkeypatch.setattr(main, 'FEATURE_WINDOWS', [7, 30])
+    monkeypatch.setattr(main, 'FEATURE_AGGREGATES', AGGREGATES)
+
+    feature_json = main.build_feature_json(SCENARIOS[0], 'windows')
+
+    assert 'sum_debit_l7' in feature_json
+    assert 'debits_by_category_l30' in feature_json
+    assert (main._feature_json_to_row(feature_json) ==
+            main._feature_json_to_row(single_pass_feature_tuple(SCENARIOS[0])))
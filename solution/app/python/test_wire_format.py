@@ -0,0 +1,38 @@
+import json
+
+import msgpack
+
+from feature_engine import to_columnar_transactions
+from test_main import _sample_request
+
+
+def test_predictions_accept_and_return_msgpack(client):
+    request_jsons = [_sample_request("user-0"), _sample_request("user-1")]
+    columnar_jsons = [
+        dict(request_json, Transactions=to_columnar_transactions(
+            request_json['Transactions']))
+        for request_json in request_jsons]
+
+    json_response = client.post('/predictions',
+                                data=json.dumps(request_jsons),
+                                content_type='application/json')
+    msgpack_response = client.post(
+        '/predictions', data=msgpack.packb(columnar_jsons, use_bin_type=True),
+        content_type='application/msgpack',
+        headers={'Accept': 'application/msgpack'})
+
+    assert msgpack_response.status_code == 200
+    assert msgpack_response.mimetype == 'application/msgpack'
+    assert (msgpack.unpackb(msgpack_response.data, raw=False) ==
+            json.loads(json_response.data))
+
+
+def test_predictions_reject_incomplete_columnar_transactions(client):
+    request_json = _sample_request("user-0")
+    request_json['Transactions'] = {'Amount': [1.0]}
+
+    response = client.post('/predictions', data=json.dumps(request_json),
+                           content_type='application/json')
+
+    assert response.status_code == 400
+    assert 'Columnar' in json.loads(response.data)['error_message']
@@ -0,0 +1,224 @@
+import datetime as dt
+
+from feature_engine import (DEADLINE_CHECK_ROWS, ProcessingTimeExceeded,
+                            _get_date_only, _float_to_dollar,
+                            _iter_columnar_transactions,
+                            _iter_row_transactions, check_deadline,
+                            is_columnar)
+
+
+# Window Feature Engine
+# Balance and debit/credit features over any number of trailing windows,
+# e.g. FEATURE_WINDOWS="7,60,90" adds max_bal_l7, ..., sum_credit_l90 next to
+# the usual 30 day features. The Transactions are read and bucketed per day
+# once, for the longest window; one sweep over those days then answers every
+# window from suffix sums and suffix extremes, so more windows cost next to
+# nothing rather than another pass over the Transactions each.
+#
+# The balance of a window follows raw_data_to_feature_tuple: one point per
+# transaction in the window (credits before debits on a day) and one per day
+# without any, anchored so the last point is the current balance.
+
+# Default Window of the features the live model uses
+BASE_WINDOW_DAYS = 30
+
+AGGREGATES = ['max_bal', 'min_bal', 'sum_debit', 'sum_credit',
+              'debits_by_category']
+DEFAULT_AGGREGATES = ['max_bal', 'min_bal', 'sum_debit', 'sum_credit']
+
+MAX_WINDOW_DAYS = 3660
+
+
+def parse_windows(value):
+    # "7,60,90" -> [7, 30, 60, 90]; the base window is always included
+    windows = set([BASE_WINDOW_DAYS])
+    for entry in (value or '').split(','):
+        if not entry.strip():
+            continue
+        days = int(entry)
+        if not 0 < days <= MAX_WINDOW_DAYS:
+            raise ValueError("Feature windows need 1 to %d days, not %d" %
+                             (MAX_WINDOW_DAYS, days))
+        windows.add(days)
+    return sorted(windows)
+
+
+def parse_aggregates(value):
+    aggregates = [entry.strip() for entry in (value or '').split(',')
+                  if entry.strip()] or list(DEFAULT_AGGREGATES)
+    unknown = [aggregate for aggregate in aggregates
+               if aggregate not in AGGREGATES]
+    if unknown:
+        raise ValueError("Unknown feature aggregates: %s (known: %s)" % (
+            ', '.join(unknown), ', '.join(AGGREGATES)))
+    # The base features need the four balance aggregates
+    return DEFAULT_AGGREGATES + [aggregate for aggregate in aggregates
+                                 if aggregate not in DEFAULT_AGGREGATES]
+
+
+class DailySeries(object):
+    # Per day of the longest window, oldest first:
+    # - opening[d]: sum of the signed amounts of the days before d
+    # - high[d] / low[d]: highest and lowest balance point of day d relative
+    #   to its opening (0 on a day without transactions, whose one point is
+    #   the opening balance)
+    # - credits[d] / debits[d], credit_counts[d] / debit_counts[d] and, when
+    #   asked for, category_debits[d]
+    # plus the category of the largest debit over the whole history.
+
+    def __init__(self, transactions, days, today=None,
+                 with_categories=False, deadline=None):
+        today = today or _get_date_only()
+        self.days = days
+        window_start = today - dt.timedelta(days=days - 1)
+
+        day_rows = [None] * days
+        max_debit_amount = None
+        self.catg_max_debits = 'None'
+        try:
+            for number, (transaction_type, amount, category, post_date) in (
+                    enumerate(_iter_columnar_transactions(transactions)
+                              if is_columnar(transactions)
+                              else _iter_row_transactions(transactions))):
+                if deadline is not None and not number % DEADLINE_CHECK_ROWS:
+                    check_deadline(deadline)
+
+                # First of equal maximums wins, as with idxmax
+                if transaction_type == 'debit' and (
+                        max_debit_amount is None or
+                        amount > max_debit_amount):
+                    max_debit_amount = amount
+                    self.catg_max_debits = category
+
+                # Only midnight timestamps line up with the calendar days
+                offset = post_date - window_start
+                if (0 <= offset.days < days and
+                        not offset.seconds and not offset.microseconds):
+                    rows = day_rows[offset.days]
+                    if rows is None:
+                        rows = day_rows[offset.days] = []
+                    rows.append((transaction_type, amount, category))
+        except ProcessingTimeExceeded:
+            raise
+        except Exception:
+            raise KeyError
+
+        self.opening = [0.0] * (days + 1)
+        self.high = [0.0] * days
+        self.low = [0.0] * days
+        self.credits = [0.0] * days
+        self.debits = [0.0] * days
+        self.credit_counts = [0] * days
+        self.debit_counts = [0] * days
+        self.category_debits = [None] * days if with_categories else None
+
+        cum_sum_amount = 0.0
+        for day, rows in enumerate(day_rows):
+            if rows:
+                # Credits before Debits, in posting order within a type
+                rows.sort(key=lambda row: row[0])
+                running = 0.0
+                points = []
+                for transaction_type, amount, category in rows:
+                    if transaction_type == 'credit':
+                        running += amount
+                        self.credits[day] += amount
+                        self.credit_counts[day] += 1
+                    else:
+                        running += -amount
+                        self.debits[day] += amount
+                        self.debit_counts[day] += 1
+                        if with_categories:
+                            if self.category_debits[day] is None:
+                                self.category_debits[day] = {}
+                            category_debits = self.category_debits[day]
+                            category_debits[category] = (
+                                category_debits.get(category, 0) + amount)
+                    points.append(running)
+                self.high[day] = max(points)
+                self.low[day] = min(points)
+                cum_sum_amount += running
+            self.opening[day + 1] = cum_sum_amount
+
+
+def window_feature_json(series, windows, current_balance,
+                        aggregates=DEFAULT_AGGREGATES):
+    # One sweep from the newest day to the oldest keeps suffix extremes and
+    # totals; when it reaches the first day of a window, that window's
+    # features are read off. windows need to fit the series.
+    result_json = {}
+    window_starts = dict((series.days - window_days, window_days)
+                         for window_days in windows)
+
+    highest = lowest = None
+    credits = debits = 0.0
+    credit_count = debit_count = 0
+    category_debits = {}
+    for day in range(series.days - 1, -1, -1):
+        day_opening = series.opening[day]
+        highest = (day_opening + series.high[day] if highest is None
+                   else max(highest, day_opening + series.high[day]))
+        lowest = (day_opening + series.low[day] if lowest is None
+                  else min(lowest, day_opening + series.low[day]))
+        credits += series.credits[day]
+        debits += series.debits[day]
+        credit_count += series.credit_counts[day]
+        debit_count += series.debit_counts[day]
+        if series.category_debits is not None and series.category_debits[day]:
+            for category, amount in series.category_debits[day].items():
+                category_debits[category] = (
+                    category_debits.get(category, 0) + amount)
+
+        if day not in window_starts:
+            continue
+        suffix = '_l%d' % window_starts[day]
+        has_transactions = credit_count or debit_count
+
+        # Balance = running sum from the window start + initial balance
+        initial_balance = current_balance - (series.opening[series.days] -
+                                             day_opening)
+        for aggregate in aggregates:
+            if aggregate == 'max_bal':
+                value = (_float_to_dollar(highest - day_opening +
+                                          initial_balance)
+                         if has_transactions else current_balance)
+            elif aggregate == 'min_bal':
+                value = (_float_to_dollar(lowest - day_opening +
+                                          initial_balance)
+                         if has_transactions else current_balance)
+            elif aggregate == 'sum_debit':
+                value = _float_to_dollar(debits) if debit_count else 0
+            elif aggregate == 'sum_credit':
+                value = _float_to_dollar(credits) if credit_count else 0
+            else:
+                value = dict((category, _float_to_dollar(amount))
+                             for category, amount in category_debits.items())
+            result_json[aggregate + suffix] = value
+
+    return result_json
+
+
+def windowed_feature_tuple(raw_data_json, windows=(BASE_WINDOW_DAYS, ),
+                           aggregates=DEFAULT_AGGREGATES, deadline=None):
+
+    # The live model's features (identical to single_pass_feature_tuple)
+    # plus every aggregate over every window, from one DailySeries
+
+    # Adding in the simple components (Current Balance and FICO Score)
+    result_json = {}
+    try:
+        result_json['current_balance'] = _float_to_dollar(
+            raw_data_json['CurrentBalance'])
+        result_json['fico_score'] = raw_data_json['FICOScore']
+    except Exception:
+        raise KeyError
+
+    series = DailySeries(raw_data_json['Transactions'], max(windows),
+                         with_categories='debits_by_category' in aggregates,
+                         deadline=deadline)
+    result_json['catg_max_debits'] = series.catg_max_debits
+    result_json.update(window_feature_json(
+        series, windows, result_json['current_balance'], aggregates))
+
+    # Results!
+    return result_json
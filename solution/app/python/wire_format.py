@@ -0,0 +1,37 @@
+# Compact Request and Response Encodings
+# Bodies sent with a MessagePack Content-Type are decoded with msgpack, and
+# responses are MessagePack encoded when the client Accepts it. msgpack is an
+# optional dependency; without it these content types are refused with 415.
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def msgpack_available():
+    return msgpack is not None
+
+
+def is_msgpack(mimetype):
+    return mimetype in MSGPACK_MIMETYPES
+
+
+def unpack(body):
+    return msgpack.unpackb(body, raw=False)
+
+
+def pack(payload):
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def preferred_response_mimetype(accept_mimetypes):
+    # MessagePack only when the client rates it above JSON
+    if not msgpack_available():
+        return 'application/json'
+    best_match = accept_mimetypes.best_match(
+        ('application/json', ) + MSGPACK_MIMETYPES, default='application/json')
+    return best_match
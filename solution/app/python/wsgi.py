@@ -0,0 +1,11 @@
+import logging
+
+from main import app, load_models
+
+
+# WSGI Entry Point
+# With preload_app the master process imports this module, so the Pipelines
+# are loaded once before the workers fork and their memory is shared
+# copy-on-write instead of being unpickled again in every worker.
+logging.basicConfig(level=logging.INFO)
+load_models()